@@ -1,14 +1,22 @@
 import os
+import re
 import time
 
 import pandas as pd
 import openai
 import streamlit as st
 from openai import AuthenticationError, APIError
-from typing import Optional, Dict, List
+from typing import Dict, Optional, List
 
-from consts import VALUE_TYPES, COLS_ORDER
-from scrape import rr_scrape
+from consts import COLS_DTYPES, VALUE_TYPES
+from jobs import JobManager
+from results_store import ResultsStore, to_typed_frame
+from similarity import INDEX_COLUMNS, MERGE_EVERY, Similar, SimilarityIndex
+
+URL_PATTERN = re.compile(r"https?://\S+")
+RESULTS_DIR = os.environ.get("RRSCRAPE_RESULTS_DIR", ".rrscrape_results")
+SIMILARITY_INDEX = os.environ.get("RRSCRAPE_SIMILARITY_INDEX", ".rrscrape_similarity.idx")
+SIMILARITY_SAVE_SECONDS = 300  # how often new results are saved to the similarity index, unless many arrive sooner
 
 st.set_page_config(layout="wide", page_title="rrscrape", page_icon=":fire:")
 
@@ -27,29 +35,120 @@ def initialize_session_state():
         st.session_state.url = ""
     if "urls" not in st.session_state:
         st.session_state.urls = []
-    if "data" not in st.session_state:
-        st.session_state.data = []
+    if "data" not in st.session_state:  # the results of this session - the full history stays on disk
+        st.session_state.data = to_typed_frame([])
+    if "store" not in st.session_state:
+        st.session_state.store = ResultsStore(RESULTS_DIR)
+    if "similarity" not in st.session_state:
+        st.session_state.similarity = load_similarity_index(st.session_state.store)
+        st.session_state.similarity_saved_at = time.monotonic()
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = JobManager()
     if "api_key_valid" not in st.session_state:
         st.session_state.api_key_valid = False
 
 
-@st.cache_data
-def convert_df(data: List[Dict[str, VALUE_TYPES]], columns: List[str]) -> bytes:
-    df = pd.DataFrame(data, columns=columns)
-    return df.to_csv(index=False).encode("utf-8")
+def load_similarity_index(store: ResultsStore) -> SimilarityIndex:
+    """Opens the saved similarity index, catching it up with (or building it from) the results stored since."""
+    index = SimilarityIndex.load(SIMILARITY_INDEX) if os.path.exists(SIMILARITY_INDEX) else SimilarityIndex()
+    if index.source_version != store.version:
+        index.add(store.read(columns=INDEX_COLUMNS).to_dict("records"))
+        index.source_version = store.version
+        index.save(SIMILARITY_INDEX)
+    return index
+
+
+def add_to_similarity_index(rows: List[Dict[str, VALUE_TYPES]]):
+    """
+    Adds new results to the similarity index, saving it only every `MERGE_EVERY` stories or `SIMILARITY_SAVE_SECONDS`,
+    since a save rewrites the whole file. Results lost to a crash in between are caught up from the store on the next
+    start (see `load_similarity_index`).
+    """
+    index: SimilarityIndex = st.session_state.similarity
+    if rows:
+        index.add(rows)
+    due = time.monotonic() - st.session_state.similarity_saved_at >= SIMILARITY_SAVE_SECONDS
+    if index.unsaved >= MERGE_EVERY or (index.unsaved and due):
+        index.source_version = st.session_state.store.version
+        index.save(SIMILARITY_INDEX)
+        st.session_state.similarity_saved_at = time.monotonic()
+
+
+@st.cache_data(max_entries=4)
+def convert_df(version: int, since: str, until: str, _store: ResultsStore) -> bytes:
+    # `version` is part of the cache key, so the CSV is only re-encoded after new results were stored
+    return _store.to_csv_bytes(since=since, until=until)
+
+
+def queue_urls(urls: List[str]):
+    """Hands URLs over to the background workers, warning about the ones that were already submitted."""
+    for url in urls:
+        if st.session_state.jobs.is_submitted(url):
+            st.warning(f"URL {url} has already been scraped.")
+    for url in st.session_state.jobs.submit(urls):
+        st.session_state.urls.append(url)
 
 
 def submit_url():
-    if st.session_state.url in st.session_state.urls:
-        st.warning(f"URL {st.session_state.url} has already been scraped.")
+    queue_urls([st.session_state.url])
+    st.session_state.url = ""
+
+
+def submit_bulk_urls():
+    text = st.session_state.bulk_urls
+    if st.session_state.urls_file is not None:
+        text += "\n" + st.session_state.urls_file.getvalue().decode("utf-8", errors="ignore")
+    urls = list(dict.fromkeys(URL_PATTERN.findall(text)))
+    if not urls:
+        st.warning("No URLs found.")
         return
-    try:
-        st.session_state.urls.append(st.session_state.url)
-        row_data = rr_scrape(st.session_state.url)
-        st.session_state.data.append(row_data)
-        st.session_state.url = ""
-    except Exception as e:
-        st.error(f"Failed to scrape URL: {st.session_state.url}. Error: {e}")
+    queue_urls(urls)
+    st.session_state.bulk_urls = ""
+
+
+@st.fragment(run_every=1)
+def show_results():
+    """Reruns every second on its own, to add finished stories to the table without rerunning the whole app."""
+    manager: JobManager = st.session_state.jobs
+    rows = manager.pop_finished()
+    if rows:
+        st.session_state.store.append(rows)
+        st.session_state.data = pd.concat([st.session_state.data, to_typed_frame(rows)], ignore_index=True).astype(
+            COLS_DTYPES
+        )
+    add_to_similarity_index(rows)  # also saves what earlier ticks added, once that is due
+    jobs = manager.jobs()
+    if jobs:
+        finished = sum(job["Status"] in ("done", "failed") for job in jobs)
+        st.progress(manager.progress(), text=f"Scraped {finished}/{len(jobs)} URLs")
+        with st.expander("Jobs", expanded=manager.is_busy()):
+            st.dataframe(pd.DataFrame(jobs), hide_index=True)
+    if len(st.session_state.data) > 0:
+        st.dataframe(st.session_state.data)
+
+
+def show_similar():
+    index: SimilarityIndex = st.session_state.similarity
+    if not len(index):
+        return
+    with st.expander("Similar stories"):
+        titles = index.fictions()
+        story_id = st.selectbox("Stories similar to", list(titles), format_func=titles.get)
+        k = st.slider("How many", min_value=5, max_value=50, value=10, step=5)
+        if story_id is not None:
+            st.dataframe(pd.DataFrame(index.similar(story_id, k=k), columns=Similar._fields), hide_index=True)
+
+
+def show_history():
+    store: ResultsStore = st.session_state.store
+    with st.expander(f"Results history ({store.count()} rows)"):
+        today = pd.Timestamp.today().date()
+        dates = st.date_input("Retrieved between", value=(today - pd.Timedelta(days=30), today))
+        if st.button("Prepare CSV") and len(dates) == 2:
+            since, until = (date.strftime("%Y-%m-%d") for date in dates)
+            st.session_state.export = convert_df(store.version, since, until, store)
+        if "export" in st.session_state:
+            st.download_button("Download CSV", st.session_state.export, file_name="rrscrape.csv", mime="text/csv")
 
 
 def main():
@@ -77,9 +176,14 @@ def main():
                 st.error("Invalid API key or base URL. Please try again.")
     if st.session_state.api_key_valid:
         st.text_input("URL", key="url", on_change=submit_url)
-
-        if len(st.session_state.data) > 0:
-            st.dataframe(pd.DataFrame(st.session_state.data, columns=COLS_ORDER))
+        with st.expander("Bulk add URLs"):
+            st.text_area("Paste URLs (one per line)", key="bulk_urls")
+            st.file_uploader("...or upload a list of URLs", type=["txt", "csv"], key="urls_file")
+            st.button("Scrape all", on_click=submit_bulk_urls)
+
+        show_results()
+        show_similar()
+        show_history()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,245 @@
+"""
+Offline RoyalRoad story pages for benchmarks and parity checks.
+
+The `fixtures` directory holds one page per debug URL of `scrape.example_for_debug`, saved under its fiction ID. They
+reproduce the markup of live RoyalRoad pages (header, stats, fiction info, chapter table, and the surrounding
+navigation and scripts that make up most of a real page's weight), with placeholder text. `generate_page` builds
+more variants of the same layout, deterministically from a fiction ID, so benchmarks can use any number of pages.
+"""
+
+from datetime import datetime, timezone
+import html
+import os
+import random
+from typing import Dict, List
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DEBUG_FICTIONS = {  # fiction id -> (slug, number of chapters)
+    "76259": ("ultimate-level-1", 90),
+    "45048": ("hive-minds-give-good-hugs", 180),
+    "36299": ("beneath-the-dragoneye-moons", 1200),
+    "52854": ("an-unwavering-craftsman", 260),
+}
+TAGS = [
+    "Action", "Adventure", "Comedy", "Drama", "Fantasy", "Romance", "Sci-fi", "Slice of Life", "LitRPG",
+    "Progression", "Female Lead", "Male Lead", "Magic", "Portal Fantasy / Isekai", "Reincarnation", "Strong Lead",
+    "Cultivation", "Dungeon", "GameLit", "High Fantasy", "Kingdom Building", "Non-Human Lead", "Time Loop",
+]  # fmt: skip
+WARNINGS = ["Profanity", "Sexual Content", "Gore", "Traumatising content"]
+SCORE_TITLES = ["Overall Score", "Style Score", "Story Score", "Grammar Score", "Character Score"]
+STAT_TITLES = ["Total Views", "Average Views", "Followers", "Favorites", "Ratings", "Pages"]
+WORDS = (
+    "the a of and to in her his level dungeon magic sword mana system guild city forest dragon quest power "
+    "friends strange world awakens must learn survive craft skills ancient secrets village empire war"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _release_ts(chapter_number: int) -> int:
+    return 1_600_000_000 + chapter_number * 3 * 86_400  # a chapter every three days
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.0000000Z")
+
+
+def fiction_url(fiction_id: str, base_url: str = "https://www.royalroad.com") -> str:
+    """Returns the URL of a fixture story, using the debug URL slug for the recorded pages."""
+    slug = DEBUG_FICTIONS.get(str(fiction_id), (f"fixture-story-{fiction_id}", 0))[0]
+    return f"{base_url}/fiction/{fiction_id}/{slug}"
+
+
+def generate_page(fiction_id: str, n_chapters: int = None) -> bytes:
+    """
+    Builds a RoyalRoad story page with the same markup as the live site. The content is random, seeded by the
+    fiction ID, so the same ID always produces the same page.
+
+    Args:
+        fiction_id (str): The fiction ID of the page.
+        n_chapters (int): The number of rows in the chapter table. Drawn at random if not given.
+
+    Returns:
+        bytes: The HTML of the page, UTF-8 encoded.
+    """
+    rng = random.Random(int(fiction_id))
+    n_chapters = n_chapters if n_chapters is not None else rng.randint(5, 400)
+    slug = DEBUG_FICTIONS.get(str(fiction_id), (f"fixture-story-{fiction_id}", 0))[0]
+    title = html.escape(slug.replace("-", " ").title())
+    author = f"Fixture Author {rng.randint(1, 999)}"
+    tags = "\n".join(
+        f'<a href="/fictions/search?tagsAdd={tag.lower()}" class="fiction-tag">{html.escape(tag)}</a>'
+        for tag in rng.sample(TAGS, rng.randint(3, 9))
+    )
+    warnings = "\n".join(f"<li>{warning}</li>" for warning in rng.sample(WARNINGS, rng.randint(0, 3)))
+    blurb = "\n".join(
+        f"<p>{_sentence(rng, rng.randint(8, 30))}{'&nbsp;' if rng.random() < 0.2 else ''}</p>"
+        for _ in range(rng.randint(2, 7))
+    )
+    scores = "\n".join(
+        f'<li class="list-item"><span class="popover-rating star" data-original-title="{score}" '
+        f'data-content="{rng.uniform(3, 5):.2f} / 5" aria-label="{score}"></span></li>'
+        for score in SCORE_TITLES
+    )
+    stats = "\n".join(
+        f'<li class="bold uppercase">{stat} :</li>\n<li class="bold uppercase font-red-sunglo">{rng.randint(1, 9_000_000):,}</li>'
+        for stat in STAT_TITLES
+    )
+    chapters = "\n".join(
+        f'<tr style="cursor: pointer" data-url="/fiction/{fiction_id}/{slug}/chapter/{1_000_000 + int(fiction_id) * 10_000 + i}/chapter-{i}" '
+        f'data-volume-id="null" class="chapter-row">'
+        f'<td><a href="/fiction/{fiction_id}/{slug}/chapter/{1_000_000 + int(fiction_id) * 10_000 + i}/chapter-{i}">Chapter {i}</a></td>'
+        f'<td data-content="{i - 1}" class="text-right"><a href="/fiction/{fiction_id}/{slug}/chapter/{i}">'
+        f'<time unixtime="{_release_ts(i)}" datetime="{_iso(_release_ts(i))}" format="agoshort">{i} days ago</time>'
+        f"</a></td></tr>"
+        for i in range(1, n_chapters + 1)
+    )
+    nav = "\n".join(
+        f'<li><a href="/fictions/{name}">{name.title()}</a></li>'
+        for name in ("best-rated", "trending", "complete", "popular")
+    )
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8" />
+<title>{title} | Royal Road</title>
+<meta name="description" content="{title}" />
+<link rel="stylesheet" href="/dist/vendor.css" />
+<script type="text/javascript">window.royalroad = {{ fictionId: {fiction_id}, isAuthenticated: false, ads: [{", ".join(str(i) for i in range(40))}] }};</script>
+</head>
+<body class="page-container-bg-solid page-boxed">
+<div class="page-header"><div class="page-header-top"><div class="container"><nav><ul class="nav navbar-nav">
+{nav}
+</ul></nav></div></div></div>
+<div class="page-container"><div class="page-content-wrapper"><div class="page-content"><div class="container">
+<div class="row fic-header">
+<div class="col-md-3 text-center cover-col"><div class="cover-art-container">
+<img class="thumbnail inline-block" data-type="cover" alt="{title}" src="https://www.royalroadcdn.com/public/covers-large/{fiction_id}-{slug}.jpg?time={1_700_000_000 + int(fiction_id)}" />
+</div></div>
+<div class="col-md-5 col-lg-6 text-center md-text-left fic-title"><div class="col">
+<h1 class="font-white">{title}</h1>
+<h4 class="font-white"><span class="small font-white">by </span><span><a href="/profile/{rng.randint(1, 500_000)}" class="font-white">{author}</a></span></h4>
+</div></div>
+</div>
+<div class="fiction-info"><div class="portlet light row"><div class="col-md-8">
+<div class="margin-bottom-10"><span class="tags">
+<span class="label label-default label-sm bg-blue-hoki">{rng.choice(["ONGOING", "COMPLETED", "HIATUS"])}</span>
+<span class="label label-default label-sm bg-blue-dark">Original</span>
+{tags}
+</span></div>
+<div class="text-center font-red-sunglo"><strong>This fiction contains:</strong>
+<ul class="list-inline">
+{warnings}
+</ul></div>
+<div class="description">
+<div class="hidden-content">
+{blurb}
+</div>
+</div>
+</div></div></div>
+<div class="fiction-stats"><div class="portlet light"><div class="portlet-body"><div class="stats-content">
+<div class="col-sm-6"><ul class="list-unstyled">
+{scores}
+</ul></div>
+<div class="col-sm-6"><ul class="list-unstyled">
+{stats}
+</ul></div>
+</div></div></div></div>
+<div class="portlet light"><div class="portlet-body">
+<table class="table no-border" id="chapters" data-chapters="{n_chapters}">
+<thead><tr><th>Chapter Name</th><th class="text-right">Release Date</th></tr></thead>
+<tbody>
+{chapters}
+</tbody></table>
+</div></div>
+<div class="comments-container">{"".join(f'<div class="comment"><div class="media-body"><p>{_sentence(rng, 25)}</p></div></div>' for _ in range(20))}</div>
+</div></div></div></div>
+<div class="page-footer"><div class="container">&copy; Royal Road</div></div>
+<script src="/dist/vendor.js"></script>
+<script type="text/javascript">window.chapters = {n_chapters};</script>
+</body>
+</html>
+""".encode(
+        "utf-8"
+    )
+
+
+LISTING_PAGES = 50  # pages per generated listing
+LISTING_PAGE_SIZE = 20  # stories per listing page
+
+
+def generate_listing_page(listing: str, page: int) -> bytes:
+    """
+    Builds a page of a RoyalRoad listing (e.g. "best-rated"), with the same markup as the live site. Every listing
+    has `LISTING_PAGES` pages of `LISTING_PAGE_SIZE` stories; listings overlap, and every page also links a few
+    "popular this week" stories in its sidebar, as the live site does. Pages past the end list no stories.
+
+    Args:
+        listing (str): The name of the listing; anything after "/fictions/" in the listing URL.
+        page (int): The page number, starting at 1.
+
+    Returns:
+        bytes: The HTML of the page, UTF-8 encoded.
+    """
+    offset = sum(map(ord, listing)) % 10 * LISTING_PAGE_SIZE  # different listings share most of their stories
+    ids = []
+    if 1 <= page <= LISTING_PAGES:
+        start = 100_000 + offset + (page - 1) * LISTING_PAGE_SIZE
+        ids = [str(fiction_id) for fiction_id in range(start, start + LISTING_PAGE_SIZE)]
+    items = "\n".join(
+        f'<div class="fiction-list-item row"><figure class="col-sm-2"><a href="/fiction/{fiction_id}/fixture-story-{fiction_id}">'
+        f'<img src="https://www.royalroadcdn.com/public/covers-large/{fiction_id}.jpg" /></a></figure>'
+        f'<div class="col-sm-10"><h2 class="fiction-title"><a href="/fiction/{fiction_id}/fixture-story-{fiction_id}" '
+        f'class="font-red-sunglo bold">Fixture Story {fiction_id}</a></h2>'
+        f'<div class="margin-bottom-10"><span class="tags"><a class="fiction-tag">Fantasy</a></span></div>'
+        f'<div class="row stats"><div class="col-sm-6"><span>{fiction_id} Followers</span></div></div>'
+        f'<div class="hidden-content"><p>{html.escape(listing)}, page {page}.</p></div></div></div>'
+        for fiction_id in ids
+    )
+    sidebar = "\n".join(
+        f'<li><a href="/fiction/{fiction_id}/popular-{fiction_id}">Popular</a></li>' for fiction_id in (1, 2, 3)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8" /><title>{html.escape(listing)} | Royal Road</title></head>
+<body><div class="page-content"><div class="container"><div class="row">
+<div class="col-md-8"><div class="fiction-list">
+{items}
+</div>
+<div class="text-center chapter-nav"><ul class="pagination"><li><a href="?page={page + 1}">Next</a></li></ul></div></div>
+<div class="col-md-4"><div class="portlet"><h3>Popular this week</h3><ul class="list-unstyled">{sidebar}</ul></div></div>
+</div></div></div></body></html>
+""".encode(
+        "utf-8"
+    )
+
+
+def load_page(fiction_id: str) -> bytes:
+    """Returns the saved page of a recorded fixture, or a generated page for any other fiction ID."""
+    path = os.path.join(FIXTURES_DIR, f"{fiction_id}.html")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return generate_page(fiction_id)
+
+
+def fixture_ids(n_variants: int = 0) -> List[str]:
+    """Returns the IDs of the recorded fixtures, followed by `n_variants` IDs of generated pages."""
+    return list(DEBUG_FICTIONS) + [str(100_000 + i) for i in range(n_variants)]
+
+
+def write_fixtures() -> Dict[str, str]:
+    """(Re)writes the recorded fixture pages to `FIXTURES_DIR` and returns their paths by fiction ID."""
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    paths = {}
+    for fiction_id, (_, n_chapters) in DEBUG_FICTIONS.items():
+        paths[fiction_id] = os.path.join(FIXTURES_DIR, f"{fiction_id}.html")
+        with open(paths[fiction_id], "wb") as f:
+            f.write(generate_page(fiction_id, n_chapters))
+    return paths
+
+
+if __name__ == "__main__":
+    for fiction_id, path in write_fixtures().items():
+        print(f"{fiction_id}: {path}")
@@ -0,0 +1,455 @@
+"""
+Offline benchmarks of rrscrape, against fixture pages and a stub chat API served locally (see `bench.stub_server`).
+
+Run from the `rrscrape` directory:
+
+    python -m bench.run_bench --pages 200 --llm-latency 0.3 --json bench_results.json
+
+For every scenario, reports pages/sec, parse ms/page, enrichment latency percentiles (per call of the enrichment
+function), the number of requests the stub chat API received, the values, LLM calls and tokens the rules saved, and peak traced memory (measured in a second pass).
+"""
+
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List
+from urllib.parse import urlparse
+
+import pandas as pd
+
+import cascade
+import extract
+import pipeline
+import results_store
+import scrape
+import similarity
+from rules import RULE_STATS
+from bench.fixtures import fixture_ids, fiction_url, load_page
+from bench.stub_server import StubServer
+from chapters import iter_chapters, summarize
+from consts import COLS_ORDER, GENERAL_COLUMNS
+from metrics import METRICS
+from parse_pool import ParsePool
+from politeness import PolitenessScheduler
+
+CHEAP_MODEL, STRONG_MODEL = "gpt-4o-mini", "gpt-4o"  # the stub answers as either, at their prices in the cost report
+
+
+def percentiles(samples: List[float], qs=(50, 95, 99)) -> Dict[str, float]:
+    """Returns the nearest-rank percentiles of the samples, e.g. {"p50": ..., "p95": ..., "p99": ...}."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{q}": float("nan") for q in qs}
+    return {f"p{q}": ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))] for q in qs}
+
+
+@contextlib.contextmanager
+def timed(module, name: str, samples: List[float]) -> Iterator[None]:
+    """Records the duration (in ms) of every call to `module.<name>` into `samples` while the context is active."""
+    original = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            samples.append((time.perf_counter() - start) * 1000)
+
+    setattr(module, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def bench_parse(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Times every extractor, and the chapter table walk, on the fixture pages, without any network or LLM calls."""
+    pages = [load_page(url.split("/fiction/")[1].split("/")[0]) for url in urls]
+    results = {}
+    parsers = {**extract.EXTRACTORS, "chapters": lambda page, _: summarize(iter_chapters(page))}
+    for name, extractor in parsers.items():
+        for page in pages[:5]:  # warm up
+            extractor(page, "")
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for page in pages:
+                extractor(page, "")
+        elapsed = time.perf_counter() - start
+        n = len(pages) * args.repeat
+        results[f"parse[{name}]"] = {"pages": n, "pages_per_sec": n / elapsed, "parse_ms_per_page": elapsed / n * 1000}
+    return results
+
+
+def bench_parse_pool(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Parses the fixture pages in a `ParsePool` of 1, 2, 4, ... worker processes, up to `--workers`."""
+    pages = [(url, load_page(url.split("/fiction/")[1].split("/")[0])) for url in urls] * args.repeat
+    results = {}
+    workers = 1
+    while True:
+        with ParsePool(workers=workers, chunk_size=args.chunk_size) as pool:
+            list(pool.parse_many(pages[: workers * args.chunk_size]))  # warm up - start the processes and imports
+            start = time.perf_counter()
+            errors = sum(error is not None for _, _, error in pool.parse_many(pages))
+            elapsed = time.perf_counter() - start
+        results[f"parse_pool[{workers}]"] = {
+            "pages": len(pages),
+            "pages_per_sec": len(pages) / elapsed,
+            "parse_ms_per_page": elapsed / len(pages) * 1000,
+            "errors": errors,
+        }
+        if workers >= args.workers:
+            return results
+        workers = min(workers * 2, args.workers)
+
+
+def bench_rr_scrape(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Scrapes the URLs one by one with `rr_scrape`, the way `example_for_debug` used to."""
+    parse_ms, llm_ms = [], []
+    start = time.perf_counter()
+    with timed(scrape, "parse_page", parse_ms), timed(scrape, "llm_fill_values", llm_ms):
+        for url in urls:
+            scrape.rr_scrape(url)
+    return {"rr_scrape": _summary(len(urls), time.perf_counter() - start, parse_ms, llm_ms)}
+
+
+def bench_rr_scrape_many(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Scrapes the URLs concurrently with `rr_scrape_many`."""
+    parse_ms, llm_ms, errors = [], [], 0
+    start = time.perf_counter()
+    with timed(scrape, "parse_page", parse_ms), timed(scrape, "llm_fill_values", llm_ms):
+        for result in scrape.rr_scrape_many(urls, max_concurrency=args.concurrency, max_per_host=args.concurrency):
+            errors += result.error is not None
+    return {"rr_scrape_many": {**_summary(len(urls), time.perf_counter() - start, parse_ms, llm_ms), "errors": errors}}
+
+
+def bench_pipeline(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Streams the URLs through the staged fetch -> parse -> enrich -> normalize pipeline."""
+    parse_ms, llm_ms, errors = [], [], 0
+    start = time.perf_counter()
+    with timed(pipeline, "parse_page", parse_ms), timed(scrape, "llm_fill_values", llm_ms):
+        for result in pipeline.run_pipeline(
+            iter(urls), fetch_workers=args.concurrency, enrich_workers=args.concurrency, queue_size=args.concurrency
+        ):
+            errors += result.error is not None
+    return {"pipeline": {**_summary(len(urls), time.perf_counter() - start, parse_ms, llm_ms), "errors": errors}}
+
+
+def bench_politeness(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """
+    Scrapes the URLs with `rr_scrape_many` from a second stub, which throttles over `--host-limit` concurrent pages and
+    answers with challenge pages for the first quarter second: at a fixed concurrency, and with a `PolitenessScheduler`.
+    """
+    results = {}
+    for name, scheduler in (("fixed", None), ("aimd", PolitenessScheduler(max_concurrency=args.concurrency))):
+        with StubServer(
+            page_latency=args.page_latency,
+            page_jitter=args.page_latency / 4,
+            page_max_concurrency=args.host_limit,
+            page_challenge_schedule=[(0.0, 0.25)],
+            page_retry_after=0.05,
+        ) as server:
+            host_urls = [fiction_url(url.split("/fiction/")[1].split("/")[0], server.base_url) for url in urls]
+            usage = _llm_usage(args.llm_counters)
+            errors = 0
+            start = time.perf_counter()
+            for result in scrape.rr_scrape_many(
+                host_urls, max_concurrency=args.concurrency, max_per_host=args.concurrency, scheduler=scheduler
+            ):
+                errors += result.error is not None
+            elapsed = time.perf_counter() - start
+            results[f"politeness[{name}]"] = {
+                "pages": len(urls),
+                "pages_per_sec": len(urls) / elapsed,
+                "errors": errors,
+                "page_requests": server.counters["page_requests"],
+                "throttled": server.counters["page_throttled"] + server.counters["page_challenged"],
+                **_llm_usage_since(args.llm_counters, usage),
+            }
+            if scheduler is not None:
+                results[f"politeness[{name}]"]["host_limit"] = scheduler.concurrency(urlparse(server.base_url).netloc)
+    return results
+
+
+def bench_enrich_batch(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Fetches and parses the URLs, then enriches them with batched LLM requests (`enrich_data_batch`)."""
+    session = scrape.make_session()
+    parse_ms, llm_ms = [], []
+    start = time.perf_counter()
+    with timed(scrape, "parse_page", parse_ms):
+        datas = [scrape.parse_page(scrape.fetch_page(url, session), url) for url in urls]
+    with timed(scrape, "llm_fill_values_batch", llm_ms):
+        scrape.enrich_data_batch(datas, batch_size=args.batch_size)
+    return {"enrich_data_batch": _summary(len(urls), time.perf_counter() - start, parse_ms, llm_ms)}
+
+
+def bench_normalize(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """
+    Normalizes a history of `--rows` raw parsed stories, value by value (`normalize_data`, then `to_typed_frame`) and
+    column by column (`normalize_frame`), and compares the memory of the raw and the typed frames.
+    """
+    pages = [
+        scrape.parse_page(load_page(url.split("/fiction/")[1].split("/")[0]), url, with_chapters=True) for url in urls
+    ]
+    records = (pages * (args.rows // len(pages) + 1))[: args.rows]
+    start = time.perf_counter()
+    results_store.to_typed_frame([scrape.normalize_data(data) for data in records])
+    per_value = time.perf_counter() - start
+    raw = pd.DataFrame(records, columns=COLS_ORDER)
+    start = time.perf_counter()
+    typed = results_store.normalize_frame(raw)
+    per_column = time.perf_counter() - start
+    results = {
+        f"normalize[{name}]": {"rows": len(records), "rows_per_sec": len(records) / elapsed, "ms": elapsed * 1000}
+        for name, elapsed in (("value", per_value), ("column", per_column))
+    }
+    results["normalize[column]"]["raw_mb"] = raw.memory_usage(deep=True).sum() / 2**20
+    results["normalize[column]"]["typed_mb"] = typed.memory_usage(deep=True).sum() / 2**20
+    return results
+
+
+def bench_cascade(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """
+    Enriches the URLs with the strong model alone, then with the cheap, fast model in front of it (see `cascade`), and
+    reports the latency, tokens, cost and resolved keys of every tier.
+    """
+    session = scrape.make_session()
+    datas = [scrape.parse_page(scrape.fetch_page(url, session), url) for url in urls]
+    configured = cascade.get_models()
+    results = {}
+    for models in ((STRONG_MODEL,), (CHEAP_MODEL, STRONG_MODEL)):
+        cascade.configure(models)
+        cascade.CASCADE_STATS.reset()
+        usage = _llm_usage(args.llm_counters)
+        llm_ms = []
+        start = time.perf_counter()
+        with timed(scrape, "llm_fill_values", llm_ms), ThreadPoolExecutor(args.concurrency) as pool:
+            filled = list(pool.map(scrape.infer_data, datas))
+        elapsed = time.perf_counter() - start
+        tiers = cascade.CASCADE_STATS.report()
+        label = f"cascade[{len(models)}]"
+        results[label] = {
+            **_summary(len(datas), elapsed, [], llm_ms),
+            "cost_usd": sum(tier["cost_usd"] for tier in tiers.values()),
+            "keys_unresolved": sum(data[col] is None for data in filled for col in GENERAL_COLUMNS),
+            **_llm_usage_since(args.llm_counters, usage),
+        }
+        for model, tier in tiers.items():
+            results[f"{label} {model}"] = {**tier, "llm_requests": tier["requests"]}
+    cascade.configure(configured)
+    return results
+
+
+def bench_similarity(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """
+    Builds a similarity index of `--index-size` stories (copies of the parsed pages under new fiction IDs), then times
+    top-10 queries against it, adding stories to it one at a time, and saving and memory-mapping it again.
+    """
+    pages = [scrape.parse_page(load_page(url.split("/fiction/")[1].split("/")[0]), url) for url in urls]
+    records = [
+        {**pages[i % len(pages)], "RR URL": f"https://www.royalroad.com/fiction/{i + 1}/story"}
+        for i in range(args.index_size)
+    ]
+    start = time.perf_counter()
+    index = similarity.SimilarityIndex.from_records(records[:-100])
+    build = time.perf_counter() - start
+    query_ms = []
+    for story_id in range(1, 1 + min(500, len(index))):
+        start = time.perf_counter()
+        index.similar(str(story_id), k=10)
+        query_ms.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    for record in records[-100:]:
+        index.add([record])
+    add_ms = (time.perf_counter() - start) * 1000 / 100
+    path = f"bench_similarity_{os.getpid()}.idx"
+    try:
+        start = time.perf_counter()
+        index.save(path)
+        save_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        similarity.SimilarityIndex.load(path).similar("1", k=10)
+        load_ms = (time.perf_counter() - start) * 1000
+        file_mb = os.path.getsize(path) / 2**20
+    finally:
+        os.remove(path)
+    return {
+        "similarity": {
+            "stories": len(index),
+            "build_ms": build * 1000,
+            **{f"query_ms_{q}": v for q, v in percentiles(query_ms).items()},
+            "add_ms": add_ms,
+            "save_ms": save_ms,
+            "load_query_ms": load_ms,
+            "file_mb": file_mb,
+        }
+    }
+
+
+def bench_stream(urls: List[str], args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """
+    Enriches the URLs with whole and with streamed responses, against a stub of its own that generates
+    `--llm-token-latency` seconds per token, and runs away (`--runaway-every`) or cuts off (`--truncate-every`) some of
+    its answers.
+    """
+    datas = [
+        scrape._relevant_data(scrape.parse_page(load_page(url.split("/fiction/")[1].split("/")[0]), url))
+        for url in urls
+    ]
+    api_base = os.environ["OPENAI_API_BASE"]
+    results = {}
+    with StubServer(
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        llm_token_latency=args.llm_token_latency,
+        llm_runaway_every=args.runaway_every,
+        llm_truncate_every=args.truncate_every,
+    ) as server:
+        os.environ["OPENAI_API_BASE"] = server.openai_base
+        try:
+            for stream in (False, True):
+                counters = dict(METRICS.snapshot()["counters"])
+                usage = _llm_usage(server.counters)
+                llm_ms = []
+                start = time.perf_counter()
+                with timed(scrape, "llm_fill_values", llm_ms), ThreadPoolExecutor(args.concurrency) as pool:
+                    filled = list(pool.map(lambda data: scrape.llm_fill_values(data, stream=stream), datas))
+                elapsed = time.perf_counter() - start
+                after = METRICS.snapshot()["counters"]
+                results[f"stream[{'on' if stream else 'off'}]"] = {
+                    **_summary(len(datas), elapsed, [], llm_ms),
+                    **_llm_usage_since(server.counters, usage),
+                    "keys_unresolved": sum(
+                        filled_data[k] is None
+                        for data, filled_data in zip(datas, filled)
+                        for k in data
+                        if data[k] is None
+                    ),
+                    **{
+                        name: after.get(name, 0) - counters.get(name, 0)
+                        for name in ("llm_streams_cut_off", "llm_partial_retries")
+                    },
+                }
+        finally:
+            os.environ["OPENAI_API_BASE"] = api_base
+    return results
+
+
+def _summary(n: int, elapsed: float, parse_ms: List[float], llm_ms: List[float]) -> Dict[str, float]:
+    return {
+        "pages": n,
+        "pages_per_sec": n / elapsed,
+        "parse_ms_per_page": sum(parse_ms) / len(parse_ms) if parse_ms else float("nan"),
+        **{f"enrich_ms_{q}": v for q, v in percentiles(llm_ms).items()},
+    }
+
+
+def _llm_usage(counters: Dict[str, int]) -> Dict[str, int]:
+    # the LLM requests a stub served so far (`counters` being its counters), and the LLM work the rules saved
+    rules = RULE_STATS.report()
+    return {
+        "llm_requests": counters["llm_requests"],
+        "rule_keys": rules["keys_resolved"],
+        "rule_calls_saved": rules["llm_calls_avoided"],
+        "rule_tokens_saved": rules["tokens_avoided"],
+    }
+
+
+def _llm_usage_since(counters: Dict[str, int], before: Dict[str, int]) -> Dict[str, int]:
+    return {column: value - before[column] for column, value in _llm_usage(counters).items()}
+
+
+SCENARIOS: Dict[str, Callable[[List[str], argparse.Namespace], Dict[str, Dict[str, float]]]] = {
+    "parse": bench_parse,
+    "parse_pool": bench_parse_pool,
+    "rr_scrape": bench_rr_scrape,
+    "rr_scrape_many": bench_rr_scrape_many,
+    "pipeline": bench_pipeline,
+    "enrich_batch": bench_enrich_batch,
+    "politeness": bench_politeness,
+    "normalize": bench_normalize,
+    "cascade": bench_cascade,
+    "similarity": bench_similarity,
+    "stream": bench_stream,
+}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    """Runs the selected scenarios against a fresh stub server and returns their metrics by scenario."""
+    results = {}
+    with StubServer(
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        page_latency=args.page_latency,
+        page_jitter=args.page_latency / 4,
+        llm_models={CHEAP_MODEL: (args.llm_latency / 4, args.cheap_null_rate)},
+    ) as server:
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_API_BASE"] = server.openai_base
+        urls = [fiction_url(fiction_id, server.base_url) for fiction_id in fixture_ids(max(0, args.pages - 4))]
+        urls = urls[: args.pages]
+        args.llm_counters = server.counters  # for the scenarios that compare configs to measure each of them
+        for name in args.scenarios:
+            usage = _llm_usage(server.counters)
+            scenario_results = SCENARIOS[name](urls, args)
+            for metrics in scenario_results.values():
+                if "llm_requests" not in metrics:  # rows that measured their own are left alone
+                    metrics.update(_llm_usage_since(server.counters, usage))
+            if args.memory:  # a second pass, since tracing allocations would distort the timings of the first one
+                tracemalloc.start()
+                SCENARIOS[name](urls, args)
+                for metrics in scenario_results.values():
+                    metrics["peak_mem_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+            results.update(scenario_results)
+    return results
+
+
+def print_report(results: Dict[str, Dict[str, float]]) -> None:
+    columns = sorted({column for metrics in results.values() for column in metrics}, key=_column_order)
+    print(f"{'scenario':<24}" + "".join(f"{column:>20}" for column in columns))
+    for name, metrics in results.items():
+        cells = "".join(f"{metrics[column]:>20.2f}" if column in metrics else f"{'-':>20}" for column in columns)
+        print(f"{name:<24}" + cells)
+
+
+def _column_order(column: str) -> tuple:
+    preferred = ["pages", "pages_per_sec", "parse_ms_per_page", "llm_requests"]
+    return (preferred.index(column) if column in preferred else len(preferred), column)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50, help="number of pages (4 recorded + generated variants)")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the pages in the parse scenarios")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--host-limit", type=int, default=4, help="concurrent pages the politeness stub serves")
+    parser.add_argument("--cheap-null-rate", type=float, default=0.3, help="keys the cheap stub model leaves null")
+    parser.add_argument("--rows", type=int, default=100_000, help="history rows in the normalize scenario")
+    parser.add_argument("--index-size", type=int, default=20_000, help="stories in the similarity scenario")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="most processes in parse_pool")
+    parser.add_argument("--chunk-size", type=int, default=4, help="pages sent to a parse_pool process at once")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="mean seconds per stub chat completion")
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--llm-token-latency", type=float, default=0.005, help="seconds per stub token (stream)")
+    parser.add_argument("--runaway-every", type=int, default=5, help="stub answers running on to max_tokens (stream)")
+    parser.add_argument("--truncate-every", type=int, default=7, help="stub answers cut off halfway (stream)")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="mean seconds per stub page")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak memory pass")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
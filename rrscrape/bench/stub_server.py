@@ -0,0 +1,415 @@
+"""
+A local stand-in for RoyalRoad and for an OpenAI-compatible chat API, so that scraping and enrichment can be
+benchmarked without network access or API costs.
+
+    GET  /fiction/<id>[/<slug>]   a fixture story page (see `bench.fixtures.load_page`), with ETag/Last-Modified;
+                                  can be made to throttle (429) over a concurrency limit, and to answer with a
+                                  Cloudflare challenge page (503) during scheduled windows
+    GET  /fictions/<listing>      a page of a generated listing (see `bench.fixtures.generate_listing_page`)
+    GET  /v1/models               a single stub model
+    POST /v1/chat/completions     answers enrichment prompts with plausible values for the requested keys, all at
+                                  once or streamed token by token; can be made to reject json_schema response
+                                  formats, to answer with malformed, cut-off or runaway JSON, or to stand in for
+                                  cheaper models that are faster but leave more keys null
+
+Point the scraper at it with `OPENAI_API_BASE=<server.openai_base>` and `fiction_url(id, server.base_url)`.
+"""
+
+import ast
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from bench.fixtures import generate_listing_page, load_page
+from general_utils import estimate_tokens
+
+STUB_VALUES = {
+    "Number of Published Book(s)": 2,
+    "Story Setting": "Fantasy world",
+    "MC Gender": "Female",
+    "Steamy (18+/NSFW)": "No",
+    "Subgenre": "LitRPG",
+    "MC Sexual Orientation": None,
+}
+FICTION_PATH_PATTERN = re.compile(r"^/fiction/(\d+)(/[^?#]*)?")
+LISTING_PATH_PATTERN = re.compile(r"^/fictions/([^?#]+)(?:\?([^#]*))?")
+SINGLE_KEYS_PATTERN = re.compile(r"===KEYS FOR MISSING VALUES===\s*(.*?)\s*===END KEYS FOR MISSING VALUES===", re.S)
+BATCH_KEYS_PATTERN = re.compile(r"===STORY (\S+)===.*?KEYS FOR MISSING VALUES: (\[.*?\])", re.S)
+CHALLENGE_PAGE = (
+    b"<!DOCTYPE html><html><head><title>Just a moment...</title></head><body>"
+    b'<script src="/cdn-cgi/challenge-platform/h/g/orchestrate/chl_page/v1"></script></body></html>'
+)
+
+
+def answer_prompt(prompt: str) -> Dict[str, Any]:
+    """
+    Builds the JSON answer a well-behaved model would give to an enrichment prompt of `scrape.llm_fill_values` or
+    `scrape.llm_fill_values_batch`: the requested keys with values from `STUB_VALUES`.
+    """
+    stories = BATCH_KEYS_PATTERN.findall(prompt)
+    if stories:
+        return {story_id: {key: STUB_VALUES.get(key) for key in ast.literal_eval(keys)} for story_id, keys in stories}
+    match = SINGLE_KEYS_PATTERN.search(prompt)
+    keys = ast.literal_eval(match.group(1)) if match else []
+    return {key: STUB_VALUES.get(key) for key in keys}
+
+
+def malform(content: str) -> str:
+    """Breaks a JSON answer the way models do: a preamble, single quotes, a trailing comma and no closing brace."""
+    return "Sure! Here is the JSON: " + content.replace('"', "'").rstrip("}") + ","
+
+
+def tokenize(content: str) -> List[str]:
+    """Splits a completion into the pieces it is generated (and streamed) in, at about 4 characters per token."""
+    return [content[i : i + 4] for i in range(0, len(content), 4)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def log_message(self, format: str, *args: Any) -> None:  # keep benchmark output clean
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def do_GET(self) -> None:
+        match = FICTION_PATH_PATTERN.match(self.path)
+        if match:
+            stub = self.server.stub
+            stub.count("page_requests")
+            if stub.challenging():
+                stub.count("page_challenged")
+                self._send(503, CHALLENGE_PAGE, "text/html; charset=utf-8", stub.retry_after_header())
+                return
+            if not stub.enter_page():
+                stub.count("page_throttled")
+                body = b"<html><body><h1>429 Too Many Requests</h1></body></html>"
+                self._send(429, body, "text/html; charset=utf-8", stub.retry_after_header())
+                return
+            try:
+                stub.sleep(stub.page_latency, stub.page_jitter)
+            finally:
+                stub.leave_page()
+            body = stub.page(match.group(1))
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self._send(200, body, "text/html; charset=utf-8", {"ETag": etag, "Last-Modified": stub.started})
+        elif LISTING_PATH_PATTERN.match(self.path):
+            self.server.stub.count("listing_requests")
+            self.server.stub.sleep(self.server.stub.page_latency, self.server.stub.page_jitter)
+            listing, query = LISTING_PATH_PATTERN.match(self.path).groups()
+            params = dict(parse_qsl(query or ""))
+            page = int(params.pop("page", 1))
+            listing += "?" + urlencode(sorted(params.items())) if params else ""
+            self._send(200, generate_listing_page(listing, page), "text/html")
+        elif self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"No fixture at {self.path}"}})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.server.stub.count("llm_requests")
+        throttle_every = self.server.stub.llm_throttle_every
+        if throttle_every and self.server.stub.counters["llm_requests"] % throttle_every == 0:
+            self.server.stub.count("llm_throttled")
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests"}}).encode("utf-8")
+            self._send(429, body, "application/json", {"Retry-After": str(self.server.stub.llm_retry_after)})
+            return
+        response_format = (request.get("response_format") or {}).get("type")
+        if response_format == "json_schema" and not self.server.stub.json_schema:
+            self.server.stub.count("llm_rejected")
+            message = "Invalid parameter: 'response_format' of type 'json_schema' is not supported with this model."
+            self._send_json(400, {"error": {"message": message, "type": "invalid_request_error"}})
+            return
+        stub = self.server.stub
+        n = stub.counters["llm_requests"]
+        latency, null_rate = stub.llm_models.get(request.get("model"), (stub.llm_latency, 0.0))
+        stub.sleep(latency, stub.llm_jitter)
+        prompt = "\n".join(message.get("content") or "" for message in request.get("messages", []))
+        content = json.dumps(stub.weaken(answer_prompt(prompt), null_rate))
+        if stub.llm_malformed_every and n % stub.llm_malformed_every == 0:
+            content = malform(content)
+        tokens, finish_reason = tokenize(content), "stop"
+        max_tokens = request.get("max_tokens") or 4096
+        if stub.llm_runaway_every and n % stub.llm_runaway_every == 0:  # whitespace until the token limit
+            tokens += [" \n"] * max(0, max_tokens - len(tokens))
+        if stub.llm_truncate_every and n % stub.llm_truncate_every == 0:
+            tokens = tokens[: len(tokens) // 2]
+        if len(tokens) >= max_tokens:
+            tokens, finish_reason = tokens[:max_tokens], "length"
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": len(tokens),
+            "total_tokens": estimate_tokens(prompt) + len(tokens),
+        }
+        completion = {
+            "id": f"chatcmpl-stub-{n}",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+        }
+        if request.get("stream"):
+            self._stream(completion, tokens, finish_reason, usage, request.get("stream_options") or {})
+            return
+        time.sleep(stub.llm_token_latency * len(tokens))
+        message = {"role": "assistant", "content": "".join(tokens)}
+        self._send_json(
+            200,
+            {
+                **completion,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": finish_reason, "message": message}],
+                "usage": usage,
+            },
+        )
+
+    def _stream(
+        self,
+        completion: Dict[str, Any],
+        tokens: List[str],
+        finish_reason: str,
+        usage: Dict[str, int],
+        stream_options: Dict[str, Any],
+    ) -> None:
+        # server-sent events of one chunk per token, like OpenAI's streaming API. A client that hangs up stops the
+        # generation, as it does there.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunk = {**completion, "object": "chat.completion.chunk"}
+        deltas = [{"role": "assistant", "content": ""}] + [{"content": token} for token in tokens]
+        events = [{**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]} for delta in deltas] + [
+            {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+        ]
+        if stream_options.get("include_usage"):
+            events.append({**chunk, "choices": [], "usage": usage})
+        try:
+            for i, event in enumerate(events):
+                if 1 <= i <= len(tokens):  # before each token
+                    time.sleep(self.server.stub.llm_token_latency)
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.stub.count("llm_streams_cut")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    stub: "StubServer"
+
+
+class StubServer:
+    """
+    Serves fixture pages and stub chat completions on a local port, in a background thread.
+
+    Example:
+        with StubServer(llm_latency=0.5) as server:
+            os.environ["OPENAI_API_BASE"] = server.openai_base
+            data = rr_scrape(fiction_url("76259", server.base_url))
+    """
+
+    def __init__(
+        self,
+        llm_latency: float = 0.0,
+        llm_jitter: float = 0.0,
+        page_latency: float = 0.0,
+        page_jitter: float = 0.0,
+        llm_throttle_every: int = 0,
+        llm_retry_after: float = 0.1,
+        llm_malformed_every: int = 0,
+        llm_token_latency: float = 0.0,
+        llm_runaway_every: int = 0,
+        llm_truncate_every: int = 0,
+        json_schema: bool = True,
+        page_max_concurrency: int = 0,
+        page_challenge_schedule: Sequence[Tuple[float, float]] = (),
+        page_retry_after: Optional[float] = 1.0,
+        llm_models: Optional[Dict[str, Tuple[float, float]]] = None,
+        port: int = 0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            llm_latency (float): Mean seconds a chat completion takes.
+            llm_jitter (float): Standard deviation of the chat completion latency.
+            page_latency (float): Mean seconds a story page takes to serve.
+            page_jitter (float): Standard deviation of the page latency.
+            llm_throttle_every (int): Answer every n-th chat completion with a 429. 0 never throttles.
+            llm_retry_after (float): The Retry-After seconds sent with a 429.
+            llm_malformed_every (int): Answer every n-th chat completion with malformed JSON. 0 never does.
+            llm_token_latency (float): Seconds each completion token takes to generate, after `llm_latency`. Streamed
+                completions send every token as it is generated; the others wait for all of them.
+            llm_runaway_every (int): Answer every n-th chat completion with whitespace after the JSON until the
+                request's max_tokens, like models in JSON mode sometimes do. 0 never does.
+            llm_truncate_every (int): Cut every n-th chat completion off halfway through. 0 never does.
+            json_schema (bool): Whether to accept json_schema response formats, or reject them with a 400 like
+                providers without structured outputs do.
+            page_max_concurrency (int): Answer story page requests with a 429 while this many are already being
+                served, like a rate limited server. 0 never throttles.
+            page_challenge_schedule (Sequence[Tuple[float, float]]): Windows of (start, end) seconds after the server
+                started during which story pages are answered with a Cloudflare challenge page (503).
+            page_retry_after (Optional[float]): The Retry-After seconds sent with throttled pages. None sends none.
+            llm_models (Optional[Dict[str, Tuple[float, float]]]): The (mean latency, null rate) of particular models,
+                to stand in for a cascade of models: a model answers that fraction of the requested keys with null,
+                and takes that long instead of `llm_latency`.
+            port (int): The port to listen on. 0 picks a free port.
+            seed (int): Seed of the latency jitter.
+        """
+        self.llm_latency = llm_latency
+        self.llm_jitter = llm_jitter
+        self.page_latency = page_latency
+        self.page_jitter = page_jitter
+        self.llm_throttle_every = llm_throttle_every
+        self.llm_retry_after = llm_retry_after
+        self.llm_malformed_every = llm_malformed_every
+        self.llm_token_latency = llm_token_latency
+        self.llm_runaway_every = llm_runaway_every
+        self.llm_truncate_every = llm_truncate_every
+        self.json_schema = json_schema
+        self.page_max_concurrency = page_max_concurrency
+        self.page_challenge_schedule = list(page_challenge_schedule)
+        self.page_retry_after = page_retry_after
+        self.llm_models = dict(llm_models or {})
+        self.pages_in_flight = 0
+        self.start_time = time.monotonic()
+        self.started = formatdate(usegmt=True)
+        self.counters = {
+            "page_requests": 0,
+            "listing_requests": 0,
+            "llm_requests": 0,
+            "llm_throttled": 0,
+            "llm_rejected": 0,
+            "llm_streams_cut": 0,
+            "page_throttled": 0,
+            "page_challenged": 0,
+        }
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pages: Dict[str, bytes] = {}
+        self._server = _Server(("127.0.0.1", port), _Handler)
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def openai_base(self) -> str:
+        return f"{self.base_url}/v1"
+
+    def page(self, fiction_id: str) -> bytes:
+        """Returns the page served for a fiction ID, generating it on first use."""
+        with self._lock:
+            if fiction_id not in self._pages:
+                self._pages[fiction_id] = load_page(fiction_id)
+            return self._pages[fiction_id]
+
+    def count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def challenging(self) -> bool:
+        """Whether story pages are answered with a challenge page right now, per `page_challenge_schedule`."""
+        elapsed = time.monotonic() - self.start_time
+        return any(start <= elapsed < end for start, end in self.page_challenge_schedule)
+
+    def enter_page(self) -> bool:
+        """Counts a story page request in flight, unless that's over `page_max_concurrency` - then returns False."""
+        with self._lock:
+            if self.page_max_concurrency and self.pages_in_flight >= self.page_max_concurrency:
+                return False
+            self.pages_in_flight += 1
+            return True
+
+    def leave_page(self) -> None:
+        with self._lock:
+            self.pages_in_flight -= 1
+
+    def retry_after_header(self) -> Dict[str, str]:
+        return {"Retry-After": f"{self.page_retry_after:g}"} if self.page_retry_after is not None else {}
+
+    def weaken(self, answer: Dict[str, Any], null_rate: float) -> Dict[str, Any]:
+        """Answers a random `null_rate` of the keys of an answer (of every story of a batch answer) with null."""
+        if null_rate <= 0:
+            return answer
+        with self._lock:
+            return self._weaken(answer, null_rate)
+
+    def _weaken(self, answer: Dict[str, Any], null_rate: float) -> Dict[str, Any]:
+        return {
+            key: (
+                self._weaken(value, null_rate)
+                if isinstance(value, dict)
+                else None if self._rng.random() < null_rate else value
+            )
+            for key, value in answer.items()
+        }
+
+    def sleep(self, mean: float, jitter: float) -> None:
+        if mean <= 0 and jitter <= 0:
+            return
+        with self._lock:
+            delay = self._rng.gauss(mean, jitter) if jitter > 0 else mean
+        time.sleep(max(0.0, delay))
+
+    def start(self) -> "StubServer":
+        self.start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve fixture pages and stub chat completions locally.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-token-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubServer(
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        llm_token_latency=args.llm_token_latency,
+        port=args.port,
+    )
+    print(f"Serving on {stub.base_url} (OPENAI_API_BASE={stub.openai_base})")
+    stub._server.serve_forever()
@@ -0,0 +1,141 @@
+"""
+The cascade of models that enrichment asks, cheapest first, and what each tier of it costs.
+
+`scrape.llm_fill_values` asks the first model about every missing value, and only escalates the keys it answered
+with null (or with a value that failed validation) to the next, stronger model - so the expensive model only sees
+the stories and keys the cheap one couldn't handle. `CASCADE_STATS` keeps the requests, latency, tokens and cost of
+every tier, and how many keys each one resolved, to tune the tradeoff between quality and throughput:
+
+    configure(["gpt-4o-mini", "gpt-4o"])
+    ...
+    CASCADE_STATS.report()["gpt-4o-mini"]["keys_resolved"]
+
+The cascade is configured with `configure(...)`, or with the RRSCRAPE_LLM_MODELS environment variable (e.g.
+"gpt-4o-mini,gpt-4o"). By default, it is just "gpt-4o".
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+DEFAULT_MODELS = ("gpt-4o",)
+PRICES: Dict[str, Tuple[float, float]] = {  # USD per million (prompt, completion) tokens, for the cost report
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Returns the cost of a request in USD, per `PRICES`. Models without a price cost nothing."""
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class CascadeStats:
+    """Thread-safe counters of the requests, latency, tokens, cost and resolved keys of each model of the cascade."""
+
+    _FIELDS = (
+        "requests",
+        "seconds",
+        "max_seconds",
+        "prompt_tokens",
+        "completion_tokens",
+        "keys_asked",
+        "keys_resolved",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers: Dict[str, Dict[str, float]] = {}
+
+    def _tier(self, model: str) -> Dict[str, float]:
+        if model not in self._tiers:
+            self._tiers[model] = dict.fromkeys(self._FIELDS, 0)
+        return self._tiers[model]
+
+    def record_request(self, model: str, seconds: float, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            tier = self._tier(model)
+            tier["requests"] += 1
+            tier["seconds"] += seconds
+            tier["max_seconds"] = max(tier["max_seconds"], seconds)
+            tier["prompt_tokens"] += prompt_tokens
+            tier["completion_tokens"] += completion_tokens
+
+    def record_keys(self, model: str, asked: int, resolved: int) -> None:
+        with self._lock:
+            tier = self._tier(model)
+            tier["keys_asked"] += asked
+            tier["keys_resolved"] += resolved
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the totals of each model that was asked: its "requests", their mean and max latency ("latency_ms",
+        "max_latency_ms"), "prompt_tokens", "completion_tokens" and "cost_usd", and the missing "keys_asked" of it and
+        "keys_resolved" by it (the rest were escalated to the next model, or left missing by the last one).
+        """
+        with self._lock:
+            tiers = {model: dict(tier) for model, tier in self._tiers.items()}
+        return {
+            model: {
+                "requests": tier["requests"],
+                "latency_ms": tier["seconds"] / tier["requests"] * 1000 if tier["requests"] else 0.0,
+                "max_latency_ms": tier["max_seconds"] * 1000,
+                "prompt_tokens": tier["prompt_tokens"],
+                "completion_tokens": tier["completion_tokens"],
+                "cost_usd": cost(model, tier["prompt_tokens"], tier["completion_tokens"]),
+                "keys_asked": tier["keys_asked"],
+                "keys_resolved": tier["keys_resolved"],
+            }
+            for model, tier in tiers.items()
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tiers.clear()
+
+
+CASCADE_STATS = CascadeStats()
+
+_models: Optional[Tuple[str, ...]] = None
+_models_lock = threading.Lock()
+
+
+def get_models() -> Tuple[str, ...]:
+    """Returns the process-wide cascade, reading it from the environment on first use."""
+    global _models
+    with _models_lock:
+        if _models is None:
+            names = [name.strip() for name in os.environ.get("RRSCRAPE_LLM_MODELS", "").split(",")]
+            _models = tuple(name for name in names if name) or DEFAULT_MODELS
+        return _models
+
+
+def configure(models: Sequence[str], prices: Optional[Dict[str, Tuple[float, float]]] = None) -> Tuple[str, ...]:
+    """
+    Replaces the process-wide cascade, and returns it.
+
+    Args:
+        models (Sequence[str]): The models to ask, cheapest first.
+        prices (Optional[Dict[str, Tuple[float, float]]]): USD per million (prompt, completion) tokens of models
+            missing from `PRICES`, or to correct them.
+    """
+    global _models
+    if not models:
+        raise ValueError("A cascade needs at least one model")
+    with _models_lock:
+        _models = tuple(models)
+        PRICES.update(prices or {})
+        return _models
+
+
+def resolve_models(model: Union[str, Sequence[str], None]) -> Tuple[str, ...]:
+    """Returns the cascade to ask: a single model, the given models in order, or the process-wide cascade for None."""
+    if model is None:
+        return get_models()
+    if isinstance(model, str):
+        return (model,)
+    return tuple(model) or get_models()
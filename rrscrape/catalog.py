@@ -0,0 +1,227 @@
+"""
+Linking scraped stories to their published editions in offline Amazon and Audible catalog dumps.
+
+Live Amazon scraping is blocked (see `scrape-dev/scrape_amazon.py`), but catalog dumps can be had as CSV or JSON lines
+files. A `Catalog` indexes the normalized titles of such a dump by character trigrams, so a lookup only compares a
+story against the catalog rows that share its less common trigrams, instead of fuzzy-matching every row:
+
+    amazon = Catalog.from_file("amazon.csv", source="Amazon")
+    for match in amazon.match("Beneath the Dragoneye Moons", "Selkie"):
+        print(match.score, match.record["Amazon Title"])
+
+Catalog files have a column per `consts.AMAZON_COLUMNS` (or `AUDIBLE_COLUMNS`), e.g. "Amazon Title" and
+"Amazon Author"; an "Audible Author" column is used too, if there is one.
+"""
+
+import csv
+import json
+import re
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+import numpy as np
+
+from consts import AMAZON_COLUMNS, AUDIBLE_COLUMNS, VALUE_TYPES
+
+SOURCE_COLUMNS = {"Amazon": AMAZON_COLUMNS, "Audible": AUDIBLE_COLUMNS}
+MIN_TITLE_SIMILARITY = 0.6  # the lowest trigram Jaccard similarity of the titles of a match
+AUTHOR_WEIGHT = 0.25  # the share of the author similarity in the score, when both sides have an author
+
+# series and format noise around the actual title, e.g. "(Book 3)", "[A LitRPG Adventure]", "Vol. 2"
+_BRACKETED = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+_SERIES_MARKER = re.compile(r"\b(book|volume|vol|part|episode|arc)\.?\s*\d+\b")
+_SUBTITLE = re.compile(r"\s(?::|-|–|—)\s|:\s")
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_NUMBER = re.compile(r"\d+")
+_NO_NUMBERS = frozenset()
+
+
+def _fold(text: str) -> str:
+    # casefolded, without accents or punctuation, single-spaced
+    text = text or ""
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    text = text.casefold()
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text)).strip()
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalizes a title for matching: bracketed notes, series markers ("Book 2") and subtitles are dropped, and what's
+    left is casefolded and stripped of accents, punctuation and a leading "the".
+
+    Example:
+        normalize_title("The Wandering Inn: Volume 1 (A LitRPG Adventure)") == "wandering inn"
+    """
+    title = _BRACKETED.sub(" ", title or "")
+    main = _SUBTITLE.split(title, maxsplit=1)[0]
+    main = _SERIES_MARKER.sub(" ", _fold(main)).strip()
+    if not main:  # the title was all subtitle or series marker - keep it whole
+        main = _fold(title)
+    return main[4:] if main.startswith("the ") else main
+
+
+def normalize_author(author: str) -> str:
+    """Normalizes an author name for matching: casefolded, without accents and punctuation, words in order."""
+    return " ".join(sorted(_fold(author).split()))
+
+
+def trigrams(text: str) -> Set[str]:
+    """Returns the distinct character trigrams of a normalized text, padded so that short words have some too."""
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _numbers(normalized: str) -> frozenset:
+    # the numbers left in a normalized title - "Ultimate Level 1" and "Ultimate Level 2" are different books
+    return frozenset(_NUMBER.findall(normalized)) or _NO_NUMBERS
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+class Match(NamedTuple):
+    """A catalog row matched to a story."""
+
+    score: float  # the combined similarity, between 0 and 1
+    title_similarity: float
+    author_similarity: Optional[float]  # None if either side has no author
+    record: Dict[str, VALUE_TYPES]  # the catalog row, keyed by `SOURCE_COLUMNS` names
+
+
+class Catalog:
+    """
+    A trigram index over the normalized titles of a catalog, for fast fuzzy title and author matching.
+
+    Args:
+        records (Iterable[Dict[str, VALUE_TYPES]]): The catalog rows.
+        source (str): "Amazon" or "Audible" - the prefix of the row's title and author columns.
+    """
+
+    def __init__(self, records: Iterable[Dict[str, VALUE_TYPES]], source: str = "Amazon"):
+        self.source = source
+        self.title_column, self.author_column = f"{source} Title", f"{source} Author"
+        self.records: List[Dict[str, VALUE_TYPES]] = []
+        self._titles: List[frozenset] = []  # trigram IDs of each row's normalized title
+        self._authors: List[frozenset] = []
+        self._numbers: List[frozenset] = []
+        self._gram_ids: Dict[str, int] = {}
+        gram_ids = self._gram_ids
+        posting_grams, posting_rows = array("i"), array("i")  # (trigram, row) pairs, grouped into postings below
+        for record in records:
+            title = normalize_title(str(record.get(self.title_column) or ""))
+            if not title:
+                continue
+            row = len(self.records)
+            grams = frozenset([gram_ids.setdefault(gram, len(gram_ids)) for gram in trigrams(title)])
+            posting_grams.extend(grams)
+            posting_rows.extend([row] * len(grams))
+            self.records.append(record)
+            self._titles.append(grams)
+            self._numbers.append(_numbers(title))
+            self._authors.append(frozenset(trigrams(normalize_author(str(record.get(self.author_column) or "")))))
+        grams_of_pairs = np.frombuffer(posting_grams, dtype=np.int32)
+        order = np.argsort(grams_of_pairs, kind="stable")  # stable, so every posting stays sorted by row
+        rows_by_gram = np.frombuffer(posting_rows, dtype=np.int32)[order]
+        bounds = np.searchsorted(grams_of_pairs[order], np.arange(len(gram_ids) + 1))
+        self._postings: Dict[int, np.ndarray] = {
+            gram_id: rows_by_gram[bounds[gram_id] : bounds[gram_id + 1]] for gram_id in range(len(gram_ids))
+        }
+        self._sizes = np.array([len(grams) for grams in self._titles], dtype=np.int32)
+        # trigrams in more than this many rows (" th", "the", ...) are too common to be worth counting per row
+        self._common = max(1000, len(self.records) // 50)
+
+    @classmethod
+    def from_file(cls, path: str, source: str = "Amazon") -> "Catalog":
+        """Loads and indexes a catalog dump, as CSV (.csv) or JSON lines (anything else)."""
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            if path.lower().endswith(".csv"):
+                return cls(csv.DictReader(f), source)
+            return cls((json.loads(line) for line in f if line.strip()), source)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def _candidates(self, grams: List[str], min_similarity: float) -> np.ndarray:
+        # counts, for every row sharing a rare trigram with the query, how many of the query's trigrams it has, and
+        # keeps the rows whose Jaccard similarity could still reach `min_similarity` if they had every common one too
+        ids = [self._gram_ids[gram] for gram in grams if gram in self._gram_ids]
+        rare = [self._postings[gram_id] for gram_id in ids if len(self._postings[gram_id]) <= self._common]
+        n_common = len(ids) - len(rare)
+        if n_common >= min_similarity * len(grams):  # the query is all common trigrams - count them too, then
+            rare, n_common = [self._postings[gram_id] for gram_id in ids], 0
+        if not rare:
+            return np.empty(0, dtype=np.int32)
+        rows, shared = np.unique(np.concatenate(rare), return_counts=True)
+        most_shared = shared + n_common
+        best_case = most_shared / (len(grams) + self._sizes[rows] - most_shared)
+        return rows[best_case >= min_similarity]
+
+    def match(
+        self, title: str, author: Optional[str] = None, limit: int = 5, min_similarity: float = MIN_TITLE_SIMILARITY
+    ) -> List[Match]:
+        """
+        Finds the catalog rows whose title (and author) best match a story's. Titles with different numbers in them
+        (other than series markers like "Book 2") never match.
+
+        Args:
+            title (str): The title of the story.
+            author (Optional[str]): The author of the story, if known.
+            limit (int): The maximum number of matches to return.
+            min_similarity (float): The lowest title similarity (trigram Jaccard) of a match.
+
+        Returns:
+            List[Match]: The matches, best first.
+        """
+        title = normalize_title(title)
+        grams, numbers = trigrams(title), _numbers(title)
+        query = frozenset(self._gram_ids.get(gram, -1 - i) for i, gram in enumerate(grams))  # unknown: unique IDs
+        author_grams = frozenset(trigrams(normalize_author(author))) if author and _fold(author) else None
+        matches = []
+        for row in self._candidates(grams, min_similarity):
+            title_similarity = _jaccard(query, self._titles[row])
+            if title_similarity < min_similarity or self._numbers[row] != numbers:
+                continue
+            author_similarity = None
+            score = title_similarity
+            if author_grams and len(self._authors[row]) > 3:  # more than the padding of an empty name
+                author_similarity = _jaccard(author_grams, self._authors[row])
+                score = (1 - AUTHOR_WEIGHT) * title_similarity + AUTHOR_WEIGHT * author_similarity
+            matches.append(Match(score, title_similarity, author_similarity, self.records[row]))
+        matches.sort(key=lambda match: -match.score)
+        return matches[:limit]
+
+
+def link_editions(
+    data: Dict[str, VALUE_TYPES], catalogs: Iterable[Catalog], min_score: float = 0.7
+) -> Dict[str, VALUE_TYPES]:
+    """
+    Fills in the `AMAZON_COLUMNS` and `AUDIBLE_COLUMNS` of a story from its best match in each catalog, and - if it
+    is missing - "Number of Published Book(s)" from the number of distinct editions matched on Amazon.
+
+    Args:
+        data (Dict[str, VALUE_TYPES]): The story data, with "RR Title" and "RR Author".
+        catalogs (Iterable[Catalog]): The catalogs to link to.
+        min_score (float): The lowest score of a match to link to.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: A new dictionary with the linked values. Columns without a match are left as they are.
+    """
+    res = dict(data)
+    for catalog in catalogs:
+        matches = [
+            m for m in catalog.match(str(data.get("RR Title") or ""), data.get("RR Author"), 50) if m.score >= min_score
+        ]
+        if not matches:
+            continue
+        for column in SOURCE_COLUMNS.get(catalog.source, []):
+            res[column] = matches[0].record.get(column)
+        if catalog.source == "Amazon" and res.get("Number of Published Book(s)") is None:
+            res["Number of Published Book(s)"] = len({_fold(str(m.record.get(catalog.title_column))) for m in matches})
+    return res
@@ -0,0 +1,157 @@
+"""
+Streaming extraction of the chapter table of a RoyalRoad story page, and the release cadence derived from it.
+
+A story page lists every chapter of the fiction in one table, which makes up most of the page for long fictions.
+`iter_chapters` skips to that table and feeds only its bytes, in chunks, to an incremental lxml parser, yielding a
+compact `Chapter` record per row and discarding each row as soon as it's read - so memory stays flat no matter how
+many chapters there are. It also takes an iterable of chunks, e.g. `response.iter_content(CHUNK_SIZE)`, to stream a
+page straight off the network.
+
+    summary = summarize(iter_chapters(content))
+    summary["RR Chapters per Week"]
+"""
+
+import itertools
+import re
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Union
+
+from lxml import etree
+
+from consts import VALUE_TYPES
+
+CHUNK_SIZE = 64 * 1024
+WEEK = 7 * 24 * 60 * 60
+_TABLE_START = re.compile(rb"""<table\b[^>]*?\bid\s*=\s*["']?chapters\b""", re.I)
+_TABLE_END = b"</table>"
+_MAX_START_TAG = 512  # bytes kept between chunks, so that a table start tag split across two chunks is still found
+_CHAPTER_ID = re.compile(r"/chapter/(\d+)")
+
+
+class Chapter(NamedTuple):
+    """A row of the chapter table."""
+
+    id: int  # the RoyalRoad chapter ID
+    title: str
+    ts: Optional[int]  # the release time, as a unix timestamp
+
+
+def _table_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # the bytes from the start tag of the chapter table up to its end tag, in chunks; nothing if there is no table
+    buffer = b""
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        if not started:
+            match = _TABLE_START.search(buffer)
+            if match is None:
+                buffer = buffer[-_MAX_START_TAG:]
+                continue
+            started = True
+            buffer = buffer[match.start() :]
+        end = buffer.find(_TABLE_END)
+        if end >= 0:
+            yield buffer[: end + len(_TABLE_END)]
+            return
+        yield buffer[: -len(_TABLE_END)]  # keep a tail, in case the end tag is split across two chunks
+        buffer = buffer[-len(_TABLE_END) :]
+    if started:
+        yield buffer
+
+
+def _timestamp(unixtime: Optional[str], iso: Optional[str]) -> Optional[int]:
+    if unixtime and unixtime.isdigit():
+        return int(unixtime)
+    try:  # e.g. "2024-07-01T12:00:00.0000000Z" - Python only parses up to microseconds
+        return int(datetime.fromisoformat(re.sub(r"(\.\d{6})\d+", r"\1", iso or "")).timestamp())
+    except ValueError:
+        return None
+
+
+def _text(element: etree._Element) -> str:
+    text = (element.text or "") if not len(element) else "".join(element.itertext())
+    return " ".join(text.split())
+
+
+def table_offset(content: bytes) -> int:
+    """Returns the offset of the chapter table in a story page, or the length of the page if it has none."""
+    match = _TABLE_START.search(content)
+    return match.start() if match is not None else len(content)
+
+
+def iter_chapters(source: Union[bytes, Iterable[bytes]], chunk_size: int = CHUNK_SIZE) -> Iterator[Chapter]:
+    """
+    Yields the chapters of a story page in the order of its chapter table (oldest first, on RoyalRoad).
+
+    Args:
+        source (Union[bytes, Iterable[bytes]]): The page content, or an iterable of chunks of it.
+        chunk_size (int): The number of bytes fed to the parser at once, if `source` is the whole page.
+
+    Yields:
+        Chapter: The chapters. Rows without a chapter link are skipped.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        content = memoryview(source)
+        chunks = (bytes(content[i : i + chunk_size]) for i in range(0, len(content), chunk_size))
+    else:
+        chunks = source
+    # only the row, link and time tags are reported, and each row is read off their events and thrown away at its
+    # end, instead of walking it as a tree
+    parser = etree.HTMLPullParser(
+        events=("start", "end"), tag=("tr", "a", "time"), no_network=True, remove_comments=True
+    )
+    row: Optional[list] = None  # [href, title, unixtime, datetime] of the chapter row being read
+    fed = False
+    for chunk in itertools.chain(_table_chunks(chunks), [None]):
+        if chunk is not None:
+            parser.feed(chunk)
+            fed = True
+        elif fed:
+            parser.close()
+        for event, element in parser.read_events():
+            tag = element.tag
+            if event == "start":
+                if tag == "tr":
+                    is_chapter = "chapter-row" in (element.get("class") or "").split()
+                    row = [element.get("data-url"), None, None, None] if is_chapter else None
+                elif tag == "time" and row is not None and row[2] is None:
+                    row[2], row[3] = element.get("unixtime"), element.get("datetime")
+            elif tag == "a":
+                if row is not None and row[1] is None:  # the first link of a row is the chapter's
+                    row[0] = row[0] or element.get("href")
+                    row[1] = _text(element)
+            elif tag == "tr":
+                match = _CHAPTER_ID.search(row[0] or "") if row is not None else None
+                if match is not None:
+                    yield Chapter(int(match.group(1)), row[1] or "", _timestamp(row[2], row[3]))
+                row = None
+                element.clear()
+                parent = element.getparent()
+                while parent is not None and element.getprevious() is not None:  # drop the rows already read
+                    del parent[0]
+
+
+def summarize(chapters: Iterable[Chapter]) -> Dict[str, VALUE_TYPES]:
+    """
+    Derives the release cadence of a fiction from its chapters, in a single pass.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: The "RR First Chapter TS" and "RR Last Chapter TS" (unix timestamps), the number of
+        "RR Chapters", and the "RR Chapters per Week" released between the first and the last one (None for fewer
+        than two dated chapters).
+    """
+    count = dated = 0
+    first = last = None
+    for chapter in chapters:
+        count += 1
+        if chapter.ts is not None:
+            dated += 1
+            first = chapter.ts if first is None else min(first, chapter.ts)
+            last = chapter.ts if last is None else max(last, chapter.ts)
+    per_week = round((dated - 1) / ((last - first) / WEEK), 2) if dated > 1 and last > first else None
+    return {
+        "RR First Chapter TS": first,
+        "RR Last Chapter TS": last,
+        "RR Chapters": count,
+        "RR Chapters per Week": per_week,
+    }
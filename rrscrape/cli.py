@@ -0,0 +1,250 @@
+"""
+Headless batch scraping from the command line.
+
+    python cli.py urls.txt -o stories.jsonl
+    cat urls.txt | python cli.py - -o stories.csv --concurrency 16
+
+URLs are read from a file or stdin (one per line; anything that isn't a URL is ignored) and every scraped story is
+written to the output as soon as it is done, as JSON lines or CSV. Next to a file output, an append-only journal
+(`<output>.journal`) records every URL that was finished; running the same command again after an interruption skips
+those, and appends the rest to the output.
+
+Heavy modules (requests, lxml, openai, ...) are only imported once the arguments are parsed, so `--help` and argument
+errors return immediately.
+"""
+
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterable, Iterator, Optional, Set, TextIO
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # the modules of rrscrape import each other flatly
+
+# light - these only import the standard library
+from consts import AMAZON_COLUMNS, AUDIBLE_COLUMNS, COLS_ORDER, VALUE_TYPES
+from general_utils import canonical_fiction_url
+
+FORMATS = ("jsonl", "csv")
+DONE, FAILED = "done", "failed"
+
+
+def read_urls(source: TextIO) -> Iterator[str]:
+    """Yields the URLs in a text stream, one per line. Blank lines, comments (#) and other text are skipped."""
+    for line in source:
+        line = line.strip()
+        if line.startswith("http://") or line.startswith("https://"):
+            yield line.split()[0]
+
+
+class Journal:
+    """
+    An append-only record of the URLs a run has finished, as JSON lines of {"url", "status", "ts"[, "error"]}.
+    A line is only written after the story itself was written to the output, so a killed run at worst repeats the
+    story it was writing - it never loses one.
+
+    Args:
+        path (str): The journal file. Created if it doesn't exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.finished: Dict[str, str] = {}  # canonical URL -> last status
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # a line cut short by a crash
+                        continue
+                    self.finished[entry["url"]] = entry["status"]
+        self._file = open(path, "a", encoding="utf-8")
+
+    def skip(self, retry_failed: bool) -> Set[str]:
+        """Returns the canonical URLs a resumed run should skip."""
+        return {url for url, status in self.finished.items() if status == DONE or not retry_failed}
+
+    def record(self, url: str, status: str, error: Optional[str] = None) -> None:
+        entry = {"url": url, "status": status, "ts": time.time()}
+        if error is not None:
+            entry["error"] = error
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _Writer:
+    # writes stories as JSON lines or CSV rows (in `COLS_ORDER`), flushing after every one
+
+    def __init__(self, out: TextIO, fmt: str, header: bool, linked: bool = False):
+        self.out = out
+        self.fmt = fmt
+        if fmt == "csv":
+            fieldnames = COLS_ORDER + AMAZON_COLUMNS + AUDIBLE_COLUMNS if linked else COLS_ORDER
+            self._csv = csv.DictWriter(out, fieldnames=fieldnames, extrasaction="ignore")
+            if header:
+                self._csv.writeheader()
+
+    def write(self, data: Dict[str, VALUE_TYPES]) -> None:
+        if self.fmt == "csv":
+            self._csv.writerow(data)
+        else:
+            self.out.write(json.dumps(data, ensure_ascii=False) + "\n")
+        self.out.flush()
+
+
+def _format(args: argparse.Namespace) -> str:
+    if args.format:
+        return args.format
+    if args.output and args.output.lower().endswith(".csv"):
+        return "csv"
+    return "jsonl"
+
+
+def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="rrscrape", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("input", nargs="?", default="-", help="file of story URLs, or - for stdin (default)")
+    parser.add_argument("-o", "--output", help="output file (default: stdout); appended to when resuming")
+    parser.add_argument("-f", "--format", choices=FORMATS, help="output format (default: by extension, else jsonl)")
+    parser.add_argument("--journal", help="resume journal (default: <output>.journal, none for stdout)")
+    parser.add_argument("--no-journal", action="store_true", help="neither read nor write a journal")
+    parser.add_argument("--retry-failed", action="store_true", help="retry the URLs that failed in earlier runs")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent downloads and LLM requests")
+    parser.add_argument(
+        "--no-backoff", action="store_true", help="download at full concurrency, even while RoyalRoad throttles us"
+    )
+    parser.add_argument("--parse-workers", type=int, default=0, help="parse in this many processes (0: threads)")
+    parser.add_argument("--chapters", action="store_true", help="parse the chapter tables for the release cadence")
+    parser.add_argument("--cache-dir", help="cache pages on disk here, and revalidate them on later runs")
+    parser.add_argument("--llm-cache", help="SQLite file caching LLM responses across runs")
+    parser.add_argument(
+        "--models", help="LLMs to ask in turn, cheapest first, e.g. gpt-4o-mini,gpt-4o (default: $RRSCRAPE_LLM_MODELS)"
+    )
+    parser.add_argument(
+        "--stream", action="store_true", help="stream LLM responses and stop them once every value is in"
+    )
+    parser.add_argument("--snapshots", help="SQLite file of previous scrapes, to skip the LLM for unchanged stories")
+    parser.add_argument("--amazon-catalog", help="Amazon catalog dump (.csv or JSON lines) to link editions from")
+    parser.add_argument("--audible-catalog", help="Audible catalog dump (.csv or JSON lines) to link editions from")
+    parser.add_argument("--metrics", help="write the run's metrics here (.prom: Prometheus textfile, else JSON lines)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress on stderr")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    """Runs the CLI. Returns the exit code: 0 if every URL was scraped, 1 if some failed, 130 if interrupted."""
+    args = parse_args(argv)
+    with contextlib.ExitStack() as stack:
+        return _run(args, stack)
+
+
+def _run(args: argparse.Namespace, stack: contextlib.ExitStack) -> int:
+    journal_path = None if args.no_journal else args.journal or (args.output and f"{args.output}.journal")
+    journal = stack.enter_context(contextlib.closing(Journal(journal_path))) if journal_path else None
+    skip = journal.skip(args.retry_failed) if journal is not None else set()
+    source = sys.stdin if args.input == "-" else stack.enter_context(open(args.input, "r", encoding="utf-8"))
+    header = not args.output or not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+    out = sys.stdout if not args.output else stack.enter_context(open(args.output, "a", encoding="utf-8", newline=""))
+    linked = bool(args.amazon_catalog or args.audible_catalog)
+    writer = _Writer(out, _format(args), header, linked)
+
+    seen: Set[str] = set()
+    skipped = 0
+
+    def pending() -> Iterator[str]:
+        nonlocal skipped
+        for url in read_urls(source):
+            key = canonical_fiction_url(url)
+            if key in skip or key in seen:
+                skipped += 1
+                continue
+            seen.add(key)
+            yield url
+
+    urls = pending()
+    first = next(urls, None)
+    if first is None:  # everything was done before - no need for the heavy imports
+        if not args.quiet:
+            print(f"Nothing to do, {skipped} skipped", file=sys.stderr)
+        return 0
+
+    # the heavy imports, now that we know there is work to do
+    from cascade import CASCADE_STATS, configure as configure_models
+    from http_cache import HttpCache
+    from llm_cache import LLMCache
+    from metrics import METRICS
+    from pipeline import run_pipeline
+    from politeness import PolitenessScheduler
+    from snapshots import SnapshotStore
+
+    if args.metrics:
+        export = METRICS.export_prometheus if args.metrics.endswith(".prom") else METRICS.export_jsonl
+        stack.callback(export, args.metrics)
+    if args.models:
+        configure_models([model.strip() for model in args.models.split(",") if model.strip()])
+    if args.stream:
+        os.environ["RRSCRAPE_LLM_STREAM"] = "1"
+    parse_pool = None
+    if args.parse_workers:
+        from parse_pool import ParsePool
+
+        parse_pool = stack.enter_context(ParsePool(workers=args.parse_workers))
+    catalogs = []
+    if linked:
+        from catalog import Catalog, link_editions
+
+        sources = (("Amazon", args.amazon_catalog), ("Audible", args.audible_catalog))
+        catalogs = [Catalog.from_file(path, source) for source, path in sources if path]
+    done = failed = 0
+    start = time.perf_counter()
+    results = run_pipeline(
+        itertools.chain([first], urls),
+        fetch_workers=args.concurrency,
+        enrich_workers=args.concurrency,
+        queue_size=2 * args.concurrency,
+        cache=HttpCache(args.cache_dir) if args.cache_dir else None,
+        llm_cache=LLMCache(args.llm_cache) if args.llm_cache else None,
+        snapshots=SnapshotStore(args.snapshots) if args.snapshots else None,
+        parse_pool=parse_pool,
+        with_chapters=args.chapters,
+        scheduler=None if args.no_backoff else PolitenessScheduler(min(4, args.concurrency), 1, args.concurrency),
+    )
+    stack.callback(results.close)  # stops the pipeline's workers if we leave early
+    try:
+        for result in results:
+            if result.error is None:
+                writer.write(link_editions(result.data, catalogs) if catalogs else result.data)
+                done += 1
+            else:
+                METRICS.event("scrape_failed", level="error", url=result.url, error=repr(result.error))
+                failed += 1
+            if journal is not None:
+                error = repr(result.error) if result.error is not None else None
+                journal.record(canonical_fiction_url(result.url), FAILED if error else DONE, error)
+            if not args.quiet:
+                print(f"\r{done} done, {failed} failed, {skipped} skipped", end="", file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        print("\nInterrupted - run the same command again to resume.", file=sys.stderr)
+        return 130
+    if not args.quiet:
+        print(f"\nFinished in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        for model, tier in CASCADE_STATS.report().items():
+            print(
+                f"  {model}: {tier['requests']} requests, {tier['latency_ms']:.0f} ms avg, "
+                f"{tier['prompt_tokens'] + tier['completion_tokens']} tokens, ${tier['cost_usd']:.4f}, "
+                f"{tier['keys_resolved']}/{tier['keys_asked']} keys resolved",
+                file=sys.stderr,
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,9 @@ from typing import Union
 VALUE_TYPES = Union[str, int, float, None]
 SCORE_PATTERN = re.compile(r"^\d+\.\d+ / \d+$")
 COUNT_PATTERN = re.compile(r"^\d+(,\d+)*$")
+ROYALROAD_URL = "https://www.royalroad.com"
+FICTION_ID_PATTERN = re.compile(r"/fiction/(\d+)")
+REQUEST_TIMEOUT = 30  # seconds to wait for a page before giving up on it
 
 GENERAL_COLUMNS = [
     "Number of Published Book(s)",  # source: amazon
@@ -28,6 +31,25 @@ RR_COLUMNS = [
     "RR Favorites",
     "RR Thumbnail URL",
     "RR Retrieved TS",
+    "RR Last Chapter TS",
+    "RR Chapters",
+    "RR Chapters per Week",
+]
+CHAPTER_COLUMNS = [  # the release cadence, from the chapter table (see `chapters.summarize`)
+    "RR First Chapter TS",
+    "RR Last Chapter TS",
+    "RR Chapters",
+    "RR Chapters per Week",
+]
+RR_STATS_COLUMNS = [  # the stats that change between scrapes of the same fiction
+    "RR Overall Score",
+    "RR Total Views",
+    "RR Average Views",
+    "RR Followers",
+    "RR Favorites",
+    "RR Ratings",
+    "RR Pages",
+    "RR Chapters",
 ]
 AMAZON_COLUMNS = [
     "Amazon Title",
@@ -69,5 +91,37 @@ COLS_ORDER = [
     "RR Tags",
     "RR Warnings",
     "RR Thumbnail URL",
+    "RR First Chapter TS",
+    "RR Last Chapter TS",
+    "RR Chapters",
+    "RR Chapters per Week",
     "RR URL",
 ]
+
+COLS_DTYPES = {  # pandas dtypes of COLS_ORDER, as stored in `results_store.ResultsStore`
+    "RR Title": "string",
+    "RR Author": "string",
+    "RR Overall Score": "Float32",
+    "RR Ratings": "Int32",
+    "RR Retrieved at": "string",
+    "RR Followers": "Int32",
+    "RR Pages": "Int32",
+    "Number of Published Book(s)": "Int32",
+    "Story Setting": "category",
+    "MC Gender": "category",
+    "Steamy (18+/NSFW)": "category",
+    "MC Sexual Orientation": "category",
+    "Subgenre": "category",
+    "RR Total Views": "Int64",
+    "RR Average Views": "Int32",
+    "RR Favorites": "Int32",
+    "RR Blurb": "string",
+    "RR Tags": "category",
+    "RR Warnings": "category",
+    "RR Thumbnail URL": "string",
+    "RR First Chapter TS": "Int64",
+    "RR Last Chapter TS": "Int64",
+    "RR Chapters": "Int32",
+    "RR Chapters per Week": "Float32",
+    "RR URL": "string",
+}
@@ -0,0 +1,213 @@
+"""
+Discovers RoyalRoad stories by crawling listing pages (best rated, trending, search results, tag filters, ...)
+concurrently, and collects them in a persistent, deduplicating frontier of fiction IDs to scrape.
+
+Example:
+    frontier = Frontier("frontier.sqlite3")
+    crawl_listings(["https://www.royalroad.com/fictions/best-rated",
+                    "https://www.royalroad.com/fictions/search?tagsAdd=litrpg"], pages=50, frontier=frontier)
+    for result in scrape_frontier(frontier, limit=1000):
+        ...
+"""
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import requests
+from lxml import etree
+
+from general_utils import canonical_fiction_url, fiction_id
+from http_cache import HttpCache
+from metrics import METRICS
+from politeness import PolitenessScheduler
+from scrape import ScrapeResult, fetch_page, make_session, rr_scrape_many
+
+NEW, SCRAPED, FAILED = "new", "scraped", "failed"
+_HTML_PARSER = etree.HTMLParser(no_network=True)
+_TITLE_LINKS = etree.XPath('//*[contains(concat(" ", normalize-space(@class), " "), " fiction-title ")]//a/@href')
+
+
+def listing_page_url(listing_url: str, page: int) -> str:
+    """
+    Returns the URL of a page of a listing, keeping its other query parameters (search terms, tag filters, ...).
+    Example: ("https://www.royalroad.com/fictions/search?tagsAdd=litrpg", 3) ->
+        "https://www.royalroad.com/fictions/search?tagsAdd=litrpg&page=3"
+    """
+    parts = urlsplit(listing_url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != "page"] + [("page", str(page))]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def extract_fiction_urls(content: bytes, page_url: str) -> List[str]:
+    """
+    Extracts the canonical URLs of the stories listed on a listing page, in listing order and without duplicates.
+    Only the story title links are used, so that links in sidebars and ads don't leak into the listing.
+
+    Args:
+        content (bytes): The HTML content of the listing page.
+        page_url (str): The URL of the listing page, to resolve relative links against.
+
+    Returns:
+        List[str]: The canonical story URLs (see `canonical_fiction_url`).
+    """
+    root = etree.fromstring(content, _HTML_PARSER)
+    if root is None:
+        return []
+    links = _TITLE_LINKS(root)
+    urls = (canonical_fiction_url(urljoin(page_url, link)) for link in links if fiction_id(link))
+    return list(dict.fromkeys(urls))
+
+
+class Frontier:
+    """
+    A persistent SQLite queue of discovered stories, deduplicated by fiction ID, that remembers which of them have
+    been scraped. Safe to share between threads.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The SQLite database file. Use ":memory:" for a frontier that lives only as long as the process.
+        """
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS frontier (
+                fiction_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                source TEXT,
+                discovered_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'new',
+                updated_at REAL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS frontier_status ON frontier (status, discovered_at)")
+        self._conn.commit()
+
+    def add(self, urls: Iterable[str], source: Optional[str] = None) -> int:
+        """
+        Adds story URLs to the frontier. Stories already in it (under any URL of the same fiction ID) are skipped.
+
+        Args:
+            urls (Iterable[str]): The story URLs.
+            source (Optional[str]): Where the URLs were found, e.g. the listing page.
+
+        Returns:
+            int: The number of new stories.
+        """
+        now = time.time()
+        rows = [(fiction_id(url), canonical_fiction_url(url), source, now) for url in urls if fiction_id(url)]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO frontier (fiction_id, url, source, discovered_at) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def pending(self, limit: Optional[int] = None) -> List[str]:
+        """Returns the URLs of stories that haven't been scraped yet, in discovery order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url FROM frontier WHERE status = ? ORDER BY discovered_at, rowid LIMIT ?",
+                (NEW, -1 if limit is None else limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark(self, url: str, status: str) -> None:
+        """Sets the status (`NEW`, `SCRAPED` or `FAILED`) of the story with the URL's fiction ID."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE frontier SET status = ?, updated_at = ? WHERE fiction_id = ?",
+                (status, time.time(), fiction_id(url)),
+            )
+            self._conn.commit()
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of stories in each status."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM frontier GROUP BY status").fetchall())
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM frontier WHERE fiction_id = ?", (fiction_id(url),)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def crawl_listings(
+    listing_urls: List[str],
+    pages: int,
+    frontier: Frontier,
+    max_concurrency: int = 8,
+    session: Optional[requests.Session] = None,
+    cache: Optional[HttpCache] = None,
+    scheduler: Optional[PolitenessScheduler] = None,
+) -> Dict[str, int]:
+    """
+    Fetches the first `pages` pages of every listing concurrently and adds the stories on them to the frontier.
+    Pages past the end of a listing (empty or missing) are skipped, as are pages that fail to download.
+
+    Args:
+        listing_urls (List[str]): The listings to crawl, e.g. "https://www.royalroad.com/fictions/best-rated".
+        pages (int): The number of pages to crawl per listing.
+        frontier (Frontier): The frontier to add the discovered stories to.
+        max_concurrency (int): The number of listing pages downloaded at the same time.
+        session (Optional[requests.Session]): A session to use instead of creating a pooled one.
+        cache (Optional[HttpCache]): An on-disk cache to serve and revalidate the listing pages from.
+        scheduler (Optional[PolitenessScheduler]): A scheduler to download through, which backs off while the host
+            throttles requests. Share it with `scrape_frontier` to keep both within the same limits.
+
+    Returns:
+        Dict[str, int]: Counts of "pages" crawled, "failed" pages, "found" story links and "new" stories.
+    """
+    session = session or make_session(pool_size=max_concurrency)
+    page_urls = [listing_page_url(listing_url, page) for listing_url in listing_urls for page in range(1, pages + 1)]
+    stats = {"pages": 0, "failed": 0, "found": 0, "new": 0}
+
+    def crawl_page(page_url: str) -> Tuple[str, List[str]]:
+        return page_url, extract_fiction_urls(fetch_page(page_url, session, cache, scheduler), page_url)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {executor.submit(crawl_page, page_url): page_url for page_url in page_urls}
+        for future in as_completed(futures):
+            try:
+                page_url, urls = future.result()
+            except Exception as e:
+                METRICS.event("listing_failed", level="error", url=futures[future], error=repr(e))
+                stats["failed"] += 1
+                continue
+            stats["pages"] += 1
+            stats["found"] += len(urls)
+            stats["new"] += frontier.add(urls, source=page_url)
+    return stats
+
+
+def scrape_frontier(frontier: Frontier, limit: Optional[int] = None, **scrape_kwargs) -> Iterator[ScrapeResult]:
+    """
+    Scrapes the stories of the frontier that haven't been scraped yet with `rr_scrape_many`, marking each one as
+    scraped or failed as its result comes in, so an interrupted run picks up where it stopped.
+
+    Args:
+        frontier (Frontier): The frontier to scrape.
+        limit (Optional[int]): The maximum number of stories to scrape.
+        **scrape_kwargs: Passed on to `rr_scrape_many` (max_concurrency, cache, llm_cache, snapshots, ...).
+
+    Yields:
+        ScrapeResult: The result of each story, in the order in which they finish.
+    """
+    for result in rr_scrape_many(frontier.pending(limit), **scrape_kwargs):
+        frontier.mark(result.url, SCRAPED if result.error is None else FAILED)
+        yield result
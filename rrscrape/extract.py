@@ -0,0 +1,228 @@
+"""
+Extractors that turn the HTML of a RoyalRoad story page into raw (not yet normalized) story data.
+
+`extract_lxml` is the fast path: it evaluates a handful of precompiled XPath expressions against an lxml tree, and
+only walks the fic-header, stats-content and fiction-info regions of the page. It doesn't even parse the chapter
+table after them, which is most of the page for long fictions - `chapters.iter_chapters` streams that instead.
+`extract_bs4` is the original BeautifulSoup implementation, kept as the reference and as a fallback for pages the
+fast path can't handle.
+Both must return the same dictionary for the same page - `check_parity` verifies that on saved pages, and the tests
+run it over every page in `bench/fixtures`.
+"""
+
+from datetime import datetime as dt
+import sys
+from typing import Callable, Dict, List
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from chapters import table_offset
+from consts import GENERAL_COLUMNS, RR_COLUMNS, VALUE_TYPES
+from metrics import METRICS
+
+
+def _has_class(name: str) -> str:
+    # XPath equivalent of BeautifulSoup's class_="name" for a single class name
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+def _class_is(value: str) -> str:
+    # XPath equivalent of BeautifulSoup's class_="a b" for a multi-class string, which must match the attribute exactly
+    return f'normalize-space(@class)="{value}"'
+
+
+_HTML_PARSER = etree.HTMLParser(remove_comments=False, remove_pis=True, no_network=True)
+_HEADER = etree.XPath(f"(//div[{_class_is('row fic-header')}])[1]")
+_TITLE = etree.XPath("string((.//h1)[1])")
+_AUTHOR = etree.XPath("string((.//a)[1])")
+_THUMBNAIL = etree.XPath(f"(//img[{_class_is('thumbnail inline-block')}])[1]/@src")
+_STATS = etree.XPath(f"(//div[{_has_class('stats-content')}])[1]")
+_SCORES = etree.XPath(f".//span[{_has_class('star')}]")
+_STATS_LIST = etree.XPath(f".//li[{_class_is('bold uppercase font-red-sunglo')}]")
+_INFO = etree.XPath(f"(//div[{_has_class('fiction-info')}])[1]")
+_TAGS = etree.XPath(f"(.//span[{_has_class('tags')}])[1]//a")
+_WARNINGS = etree.XPath(f"(.//ul[{_has_class('list-inline')}])[1]//li")
+_DESCRIPTION = etree.XPath(f"(.//div[{_has_class('description')}])[1]")
+_TEXT = etree.XPath("string()")
+
+
+def _first(elements: List[etree._Element]) -> etree._Element:
+    if not elements:
+        raise AttributeError("Expected element not found in page")  # what the BeautifulSoup path raises, too
+    return elements[0]
+
+
+def _children_text(element: etree._Element) -> List[str]:
+    # the text of each direct child node, as BeautifulSoup yields them when iterating over a tag
+    texts = [element.text] if element.text else []
+    for child in element:
+        texts.append(_TEXT(child) if isinstance(child.tag, str) else "")  # comments have no text in BeautifulSoup
+        if child.tail:
+            texts.append(child.tail)
+    return texts
+
+
+def _base_data(url: str, title: str, author: str, thumbnail_url: str) -> Dict[str, VALUE_TYPES]:
+    return {
+        "RR Retrieved at": dt.now().strftime("%Y-%m-%d"),
+        "RR URL": url,
+        "RR Title": title,
+        "RR Author": author,
+        "RR Thumbnail URL": thumbnail_url,
+        **{col: None for col in GENERAL_COLUMNS},
+    }
+
+
+def extract_lxml(content: bytes, url: str) -> Dict[str, VALUE_TYPES]:
+    """
+    Extracts the raw story data from a RoyalRoad story page using precompiled lxml XPath expressions.
+
+    Args:
+        content (bytes): The HTML content of the story page.
+        url (str): The URL the content was fetched from.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: The extracted data, keyed by column name.
+
+    Raises:
+        AttributeError: If a required region of the page is missing.
+    """
+    offset = table_offset(content)
+    if offset < len(content):
+        try:  # everything extracted here comes before the chapter table
+            return _extract_lxml(content[:offset], url)
+        except AttributeError:
+            pass  # not in the usual place - look at the whole page
+    return _extract_lxml(content, url)
+
+
+def _extract_lxml(content: bytes, url: str) -> Dict[str, VALUE_TYPES]:
+    root = etree.fromstring(content, _HTML_PARSER)
+    if root is None:
+        raise AttributeError("Empty page")
+    header = _first(_HEADER(root))
+    data = _base_data(
+        url,
+        _TITLE(header).strip(),
+        _AUTHOR(header).strip(),
+        _first(_THUMBNAIL(root)).split("?")[0],
+    )
+
+    stats_containers = _STATS(root)
+    if stats_containers:
+        for score in _SCORES(stats_containers[0]):
+            title = "RR " + score.get("data-original-title")
+            if title in RR_COLUMNS:
+                data[title] = score.get("data-content")
+        stats_list = [_TEXT(li).strip() for li in _STATS_LIST(stats_containers[0])]
+        data["RR Total Views"] = stats_list[0]
+        data["RR Average Views"] = stats_list[1]
+        data["RR Followers"] = stats_list[2]
+        data["RR Favorites"] = stats_list[3]
+        data["RR Ratings"] = stats_list[4]
+        data["RR Pages"] = stats_list[5]
+    else:
+        METRICS.event("stats_not_found", url=url)
+
+    info_container = _first(_INFO(root))
+    data["RR Tags"] = ", ".join(_TEXT(tag).strip() for tag in _TAGS(info_container))
+    data["RR Warnings"] = ", ".join(_TEXT(warning).strip() for warning in _WARNINGS(info_container))
+    data["RR Blurb"] = "\n".join(
+        text.strip().replace("\xa0", " ") for text in _children_text(_first(_DESCRIPTION(info_container)))
+    )
+    return data
+
+
+def extract_bs4(content: bytes, url: str) -> Dict[str, VALUE_TYPES]:
+    """
+    Extracts the raw story data from a RoyalRoad story page using a full BeautifulSoup tree.
+
+    Args:
+        content (bytes): The HTML content of the story page.
+        url (str): The URL the content was fetched from.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: The extracted data, keyed by column name.
+    """
+    soup = BeautifulSoup(content, "lxml")
+    header = soup.find("div", class_="row fic-header")
+    data = _base_data(
+        url,
+        header.find("h1").text.strip(),
+        header.find("a").text.strip(),
+        soup.find("img", class_="thumbnail inline-block").get("src").split("?")[0],
+    )
+
+    stats_container = soup.find("div", class_="stats-content")
+    if stats_container:
+        # Extract overall, style, story, grammar, and character scores
+        scores = stats_container.find_all("span", class_="star")
+        for score in scores:
+            title = "RR " + score.get("data-original-title")
+            value = score.get("data-content")
+            if title in RR_COLUMNS:
+                data[title] = value
+        # Extract other stats
+        stats_list = stats_container.find_all(
+            "li", class_="bold uppercase font-red-sunglo"
+        )  # TODO - find better way to do this so that it doesn't break
+        data["RR Total Views"] = stats_list[0].text.strip()
+        data["RR Average Views"] = stats_list[1].text.strip()
+        data["RR Followers"] = stats_list[2].text.strip()
+        data["RR Favorites"] = stats_list[3].text.strip()
+        data["RR Ratings"] = stats_list[4].text.strip()
+        data["RR Pages"] = stats_list[5].text.strip()
+    else:
+        METRICS.event("stats_not_found", url=url)
+
+    info_container = soup.find("div", class_="fiction-info")
+    data["RR Tags"] = ", ".join(tag.text.strip() for tag in info_container.find("span", class_="tags").find_all("a"))
+
+    data["RR Warnings"] = ", ".join(
+        warning.text.strip() for warning in info_container.find("ul", class_="list-inline").find_all("li")
+    )
+
+    data["RR Blurb"] = "\n".join(
+        row.text.strip().replace("\xa0", " ") for row in info_container.find("div", class_="description")
+    )
+    return data
+
+
+EXTRACTORS: Dict[str, Callable[[bytes, str], Dict[str, VALUE_TYPES]]] = {
+    "lxml": extract_lxml,
+    "bs4": extract_bs4,
+}
+
+
+def check_parity(content: bytes, url: str = "") -> Dict[str, tuple]:
+    """
+    Runs every extractor on the same page and reports where their results differ from the BeautifulSoup reference.
+
+    Args:
+        content (bytes): The HTML content of a story page.
+        url (str): The URL the content was fetched from.
+
+    Returns:
+        Dict[str, tuple]: Maps "<extractor>: <column>" to the (reference, extractor) values of every mismatch.
+            Empty if all extractors agree.
+    """
+    reference = extract_bs4(content, url)
+    mismatches = {}
+    for name, extractor in EXTRACTORS.items():
+        result = extractor(content, url)
+        for key in reference.keys() | result.keys():
+            if reference.get(key) != result.get(key):
+                mismatches[f"{name}: {key}"] = (reference.get(key), result.get(key))
+    return mismatches
+
+
+if __name__ == "__main__":
+    # usage: python extract.py page1.html page2.html ...
+    failed = False
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            page_mismatches = check_parity(f.read(), path)
+        failed = failed or bool(page_mismatches)
+        print(f"{path}: {'OK' if not page_mismatches else page_mismatches}")
+    sys.exit(1 if failed else 0)
@@ -1,9 +1,12 @@
 import json
 import os
 import re
-from typing import Dict, Any, Optional
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
-from consts import VALUE_TYPES, SCORE_PATTERN, COUNT_PATTERN
+from consts import VALUE_TYPES, SCORE_PATTERN, COUNT_PATTERN, FICTION_ID_PATTERN, ROYALROAD_URL
 
 
 def build_dir_tree(start_dir: str) -> Dict[str, Any]:
@@ -60,12 +63,169 @@ def print_dir_tree(tree: Dict[str, Any], prefix: str = "") -> None:
                 print_dir_tree(tree[key], prefix + extension)
 
 
+_NUMBER_PATTERN = re.compile(r"-?\d+(\.\d+)?([eE][-+]?\d+)?")
+_LITERALS = {"null": None, "true": True, "false": False, "None": None, "True": True, "False": False}
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+_VALUE_STARTS = set("\"'{[}]-0123456789")
+
+
+_INCOMPLETE = object()  # a value cut off by the end of the text
+
+
+class _TolerantJsonParser:
+    # a single left-to-right pass over the text - every character is looked at a bounded number of times
+
+    def __init__(self, s: str):
+        self.s = s
+        self.i = 0
+        self.n = len(s)
+        self.cut_off = False  # whether an object or array ran into the end of the text
+
+    def skip_ws(self, i: int) -> int:
+        while i < self.n and self.s[i].isspace():
+            i += 1
+        return i
+
+    def value(self) -> Any:
+        self.i = self.skip_ws(self.i)
+        if self.i >= self.n:
+            return _INCOMPLETE
+        c = self.s[self.i]
+        if c == "{":
+            return self.object()
+        if c == "[":
+            return self.array()
+        if c in "\"'":
+            return self.string(c)
+        return self.bare(",}]\n")
+
+    def object(self) -> Dict[str, Any]:
+        self.i += 1
+        res = {}
+        while True:
+            self.i = self.skip_ws(self.i)
+            if self.i >= self.n:  # cut off - keep what we have
+                self.cut_off = True
+                return res
+            c = self.s[self.i]
+            if c == "}":
+                self.i += 1
+                return res
+            if c in ",]":  # stray, leading or trailing commas
+                self.i += 1
+                continue
+            key = self.string(c) if c in "\"'" else self.bare(":,}\n")
+            self.i = self.skip_ws(self.i)
+            if self.i < self.n and self.s[self.i] == ":":
+                self.i += 1
+            value = self.value() if key is not _INCOMPLETE else _INCOMPLETE
+            if value is not _INCOMPLETE and not self.cut_off:  # a member cut off in its key or value is left out
+                res[str(key)] = value
+
+    def array(self) -> List[Any]:
+        self.i += 1
+        res = []
+        while True:
+            self.i = self.skip_ws(self.i)
+            if self.i >= self.n:
+                self.cut_off = True
+                return res
+            c = self.s[self.i]
+            if c == "]":
+                self.i += 1
+                return res
+            if c in ",}":
+                self.i += 1
+                continue
+            value = self.value()
+            if value is not _INCOMPLETE and not self.cut_off:
+                res.append(value)
+
+    def closes_string(self, i: int) -> bool:
+        # whether the quote at i ends the string, rather than being an unescaped quote inside it: it must be followed
+        # by the end of the text, a colon or closing bracket, or a comma and then the start of another value
+        j = self.skip_ws(i + 1)
+        if j >= self.n or self.s[j] in ":}]":
+            return True
+        if self.s[j] != ",":
+            return False
+        j = self.skip_ws(j + 1)
+        return j >= self.n or self.s[j] in _VALUE_STARTS or self.s.startswith(("null", "true", "false"), j)
+
+    def string(self, quote: str) -> str:
+        self.i += 1
+        chars = []
+        while self.i < self.n:
+            c = self.s[self.i]
+            if c == "\\" and self.i + 1 < self.n:
+                escaped = self.s[self.i + 1]
+                if escaped == "u" and self.i + 6 <= self.n:
+                    try:
+                        chars.append(chr(int(self.s[self.i + 2 : self.i + 6], 16)))
+                        self.i += 6
+                        continue
+                    except ValueError:
+                        pass
+                chars.append(_ESCAPES.get(escaped, escaped))
+                self.i += 2
+                continue
+            if c == quote and self.closes_string(self.i):
+                self.i += 1
+                return "".join(chars)
+            chars.append(c)
+            self.i += 1
+        return _INCOMPLETE  # cut off inside the string
+
+    def bare(self, stops: str) -> Any:
+        # an unquoted number, literal or word, up to the next of `stops`
+        start = self.i
+        while self.i < self.n and self.s[self.i] not in stops:
+            self.i += 1
+        word = self.s[start : self.i].strip()
+        if self.i >= self.n and word not in _LITERALS:  # cut off - "12" might have been "125", "tr" "true"
+            return _INCOMPLETE
+        if word in _LITERALS:
+            return _LITERALS[word]
+        if _NUMBER_PATTERN.fullmatch(word):
+            return float(word) if any(c in word for c in ".eE") else int(word)
+        return word
+
+
+def parse_json_tolerant(s: str) -> Any:
+    """
+    Parses the JSON object or array in a string, tolerating the mistakes language models make: text before and after
+    it, unescaped quotes inside strings, trailing commas, single quotes, unquoted keys, Python literals, and output
+    cut off before the end (whatever was complete is returned - a member whose value was cut off is left out).
+
+    Valid JSON is parsed by `json.loads`; anything else in a single linear pass.
+
+    Args:
+        s (str): The text containing the JSON.
+
+    Returns:
+        Any: The parsed object or array.
+
+    Raises:
+        ValueError: If the text contains no JSON object or array at all.
+    """
+    starts = [i for i in (s.find("{"), s.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON object or array found.")
+    start = min(starts)
+    try:
+        return json.JSONDecoder().raw_decode(s, start)[0]
+    except ValueError:
+        pass
+    parser = _TolerantJsonParser(s)
+    parser.i = start
+    return parser.value()
+
+
 def fix_json_string(s: str) -> Any:
     """
     Attempts to fix common issues in a JSON string and parse it into a Python object.
 
-    This function looks for unescaped quotes causing JSON parsing errors and escapes them
-    correctly to produce a valid JSON string.
+    Kept for compatibility - this is `parse_json_tolerant`, which handles unescaped quotes (and more) in linear time.
 
     Args:
         s (str): The JSON string to fix and parse.
@@ -74,36 +234,208 @@ def fix_json_string(s: str) -> Any:
         Any: The parsed JSON object.
 
     Raises:
-        ValueError: If the JSON string cannot be parsed after attempts to fix it.
+        ValueError: If the string contains no JSON object or array.
+    """
+    return parse_json_tolerant(s)
+
+
+class JsonMemberStream:
+    """
+    Parses a JSON object as its text arrives in chunks (e.g. a streamed completion), returning each of its top-level
+    members as soon as the value is complete, so callers can use the first keys while the rest is still generated.
+    Strings, `true`, `false` and `null` are complete at their last character; numbers, arrays and objects at the
+    comma or brace after them. Text before the object is skipped, and so are members whose value isn't valid JSON -
+    parse the whole `text` with `parse_json_tolerant` to recover those.
+
+    Example:
+        members = JsonMemberStream()
+        for chunk in chunks:
+            for key, value in members.feed(chunk):
+                print(key, value)
     """
-    while True:
-        try:
-            # Try to parse the JSON string
-            result = json.loads(s)
-            # Parsing succeeded, exit the loop
-            break
-        except Exception as e:
-            # Extract the position of the unexpected character from the exception message
-            match = re.search(r"\(char (\d+)\)", str(e))
-            if not match:
-                raise ValueError("JSON parsing error cannot be resolved.")
 
-            # Position of the unexpected character
-            unexp = int(match.group(1))
+    def __init__(self):
+        self.text = ""  # everything fed so far
+        self.done = False  # whether the object was closed
+        self._i = 0  # the next character to look at
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._value_start = -1  # where the value of the current member starts, or -1 while reading its key
+
+    def _commit(self, end: int, members: List[Tuple[str, Any]]) -> None:
+        if self._key is not None and self._value_start >= 0:
+            try:
+                members.append((self._key, json.loads(self.text[self._value_start : end])))
+            except ValueError:
+                pass
+        self._key, self._value_start = None, -1
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Adds the next chunk of text.
+
+        Returns:
+            List[Tuple[str, Any]]: The (key, value) members completed by the chunk, in order.
+        """
+        self.text += chunk
+        s, members = self.text, []
+        while self._i < len(s) and not self.done:
+            c = s[self._i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._value_start < 0:
+                        try:
+                            self._key = json.loads(s[self._string_start : self._i + 1])
+                        except ValueError:
+                            self._key = None
+                    elif self._depth == 1 and not s[self._value_start : self._string_start].strip():
+                        self._commit(self._i + 1, members)  # a string value
+            elif self._depth == 0:  # before the object
+                self._depth = 1 if c == "{" else 0
+            elif c == '"':
+                self._in_string, self._string_start = True, self._i
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._commit(self._i, members)
+                    self.done = True
+            elif self._depth == 1:
+                if c == ":" and self._key is not None and self._value_start < 0:
+                    self._value_start = self._i + 1
+                elif c == ",":
+                    self._commit(self._i, members)
+                elif self._value_start >= 0 and s[self._value_start : self._i + 1].strip() in ("true", "false", "null"):
+                    self._commit(self._i + 1, members)
+            self._i += 1
+        return members
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normalizes a URL so that trivially different spellings of the same page compare equal.
 
-            # Position of the unescaped double quote before the unexpected character
-            unesc = s.rfind(r'"', 0, unexp)
+    The scheme and host are lowercased, the fragment and any trailing slash are dropped, and query parameters are
+    sorted. Example: "HTTPS://www.RoyalRoad.com/fiction/76259/?b=2&a=1#top" ->
+    "https://www.royalroad.com/fiction/76259?a=1&b=2"
 
-            # Escape the unescaped double quote
-            s = s[:unesc] + r"\"" + s[unesc + 1 :]
+    Args:
+        url (str): The URL to normalize.
 
-            # Position of the corresponding closing double quote (+2 for inserted '\')
-            closg = s.find(r'"', unesc + 2)
+    Returns:
+        str: The canonical form of the URL.
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/") or "/", query, ""))
 
-            # Escape the closing double quote
-            s = s[:closg] + r"\"" + s[closg + 1 :]
 
-    return result
+def fiction_id(url: str) -> Optional[str]:
+    """
+    Extracts the fiction ID from a RoyalRoad story URL.
+    Example: "https://www.royalroad.com/fiction/76259/ultimate-level-1" -> "76259"
+
+    Args:
+        url (str): The URL of the story.
+
+    Returns:
+        Optional[str]: The fiction ID, or None if the URL is not a RoyalRoad story URL.
+    """
+    match = FICTION_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def canonical_fiction_url(url: str, base_url: Optional[str] = None) -> str:
+    """
+    Reduces a RoyalRoad story URL to its canonical form, which only depends on the fiction ID, so that all the URLs
+    of a story (with or without slug, chapter links, query parameters, ...) compare equal.
+    Example: "https://www.royalroad.com/fiction/76259/ultimate-level-1?foo=1" -> "https://www.royalroad.com/fiction/76259"
+    URLs that aren't RoyalRoad story URLs are normalized with `canonical_url` instead.
+
+    Args:
+        url (str): The URL to normalize.
+        base_url (Optional[str]): The site root the canonical URL points to. Defaults to the scheme and host of the
+            URL itself, or to RoyalRoad for relative URLs.
+
+    Returns:
+        str: The canonical URL of the story.
+    """
+    story_id = fiction_id(url)
+    if story_id is None:
+        return canonical_url(url)
+    if base_url is None:
+        parts = urlsplit(url.strip())
+        base_url = f"{parts.scheme.lower()}://{parts.netloc.lower()}" if parts.netloc else ROYALROAD_URL
+    return f"{base_url.rstrip('/')}/fiction/{story_id}"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimates the number of LLM tokens in a text, at about 4 characters per token for English prose.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return (len(text) + 3) // 4
+
+
+_SENTENCE_END = re.compile(r"[.!?…][\"'”’)\]]*\s")
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Shortens a text to about `max_tokens` LLM tokens (see `estimate_tokens`). Runs of whitespace and blank lines are
+    collapsed first; a text that is still too long is cut after the last full sentence that fits (or the last word, if
+    that would drop more than half of it), and "…" marks the cut.
+
+    Args:
+        text (str): The text to shorten, e.g. a blurb.
+        max_tokens (int): The token budget of the text.
+
+    Returns:
+        str: The shortened text.
+    """
+    text = "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    head = text[: max(0, max_tokens * 4 - 4)]  # room for the ellipsis
+    ends = [match.end() for match in _SENTENCE_END.finditer(head)]
+    cut = ends[-1] if ends and ends[-1] >= len(head) // 2 else head.rfind(" ")
+    return (head[:cut] if cut > 0 else head).rstrip() + "…"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses the value of a Retry-After header, either a number of seconds or an HTTP date.
+
+    Args:
+        value (Optional[str]): The header value.
+
+    Returns:
+        Optional[float]: The number of seconds to wait (0 for a date in the past), or None if there is no valid value.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
 
 def convert_score(score_str: str) -> float:
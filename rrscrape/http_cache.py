@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import requests
+
+from consts import REQUEST_TIMEOUT
+from general_utils import canonical_url
+from metrics import METRICS
+from politeness import check_response
+
+
+class HttpCache:
+    """
+    A persistent on-disk cache of HTTP responses, keyed by canonical URL.
+
+    Every entry stores the response body alongside its ETag / Last-Modified validators, so that a cached page is
+    revalidated with a conditional GET and only downloaded again if it changed on the server. Pages fetched less than
+    `max_age` seconds ago are served straight from disk without touching the network at all.
+
+    Entries older than `max_entry_age` seconds are evicted, and when the bodies on disk outgrow `max_bytes` the least
+    recently fetched entries are evicted first. The cache is safe to share between threads.
+
+    Example:
+        cache = HttpCache(".rrscrape_cache", max_age=24 * 60 * 60)
+        content = cache.fetch("https://www.royalroad.com/fiction/76259/ultimate-level-1")
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_age: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        max_entry_age: Optional[float] = None,
+    ):
+        """
+        Args:
+            cache_dir (str): The directory to keep the cached responses in. Created if it doesn't exist.
+            max_age (Optional[float]): Seconds for which a fetched page is considered fresh and served without
+                revalidation. If None, every fetch makes a conditional GET.
+            max_bytes (Optional[int]): The maximum total size of the cached bodies. If None, the size is unbounded.
+            max_entry_age (Optional[float]): Seconds after which an entry is evicted regardless of its validators.
+        """
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_entry_age = max_entry_age
+        self.hits = 0  # served from disk without a network round trip
+        self.revalidated = 0  # conditional GET answered with 304 Not Modified
+        self.misses = 0  # downloaded in full
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # (fetched_at, size) of every entry, least recently fetched first - refreshed entries are moved to the end
+        entries = sorted((meta["fetched_at"], key, meta["size"]) for key, meta in self._iter_meta())
+        self._entries: Dict[str, Tuple[float, int]] = {key: (fetched_at, size) for fetched_at, key, size in entries}
+        self._total = sum(size for _, key, size in entries)
+        self.evict()
+
+    def fetch(self, url: str, session: Optional[requests.Session] = None) -> bytes:
+        """
+        Returns the content of the page at `url`, from the cache when possible.
+
+        Args:
+            url (str): The URL of the page.
+            session (Optional[requests.Session]): A session to make the request with, if one is needed.
+
+        Returns:
+            bytes: The response body.
+
+        Raises:
+            politeness.ThrottledError: If the server throttles the request, or answers with a challenge page.
+            requests.HTTPError: If the server responds with an error status code.
+        """
+        key = self._key(url)
+        meta = self._load_meta(key)
+        body = self._load_body(key) if meta is not None else None
+        if body is None:
+            meta = None
+        now = time.time()
+        if meta is not None and self.max_age is not None and now - meta["fetched_at"] < self.max_age:
+            with self._lock:
+                self.hits += 1
+            METRICS.inc("http_cache_hits")
+            return body
+
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        response = (session or requests).get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and meta is not None:
+            meta["fetched_at"] = now
+            self._write(self._path(key, "json"), json.dumps(meta).encode("utf-8"))
+            with self._lock:
+                self.revalidated += 1
+                self._track(key, now, meta["size"])
+            METRICS.inc("http_cache_revalidated")
+            return body
+        check_response(response)  # before caching anything - a challenge page must not be kept as the page
+        response.raise_for_status()
+
+        body = response.content
+        meta = {
+            "url": canonical_url(url),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": now,
+            "size": len(body),
+        }
+        self._write(self._path(key, "body"), body)  # body first, so that a meta file always has a body
+        self._write(self._path(key, "json"), json.dumps(meta).encode("utf-8"))
+        with self._lock:
+            self.misses += 1
+            self._track(key, now, len(body))
+            over_budget = self.max_bytes is not None and self._total > self.max_bytes
+        METRICS.inc("http_cache_misses")
+        if over_budget:
+            self.evict()
+        return body
+
+    def evict(self) -> int:
+        """
+        Removes expired entries, then the oldest entries until the cache fits in `max_bytes`.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        if self.max_entry_age is None and self.max_bytes is None:
+            return 0
+        now = time.time()
+        victims = []
+        with self._lock:
+            total = self._total
+            for key, (fetched_at, size) in self._entries.items():  # oldest first
+                expired = self.max_entry_age is not None and now - fetched_at > self.max_entry_age
+                if not expired and (self.max_bytes is None or total <= self.max_bytes):
+                    break
+                victims.append(key)
+                total -= size
+        for key in victims:
+            self._remove(key)
+        return len(victims)
+
+    def clear(self) -> None:
+        """Removes every entry from the cache."""
+        for key, _ in list(self._iter_meta()):
+            self._remove(key)
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(canonical_url(url).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    def _load_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key, "json"), "rb") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):  # missing or half-written entry - treat as a miss
+            return None
+
+    def _load_body(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key, "body"), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _iter_meta(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                key = name[: -len(".json")]
+                meta = self._load_meta(key)
+                if meta is not None:
+                    yield key, meta
+
+    def _track(self, key: str, fetched_at: float, size: int) -> None:
+        # with the lock held
+        _, old_size = self._entries.pop(key, (0.0, 0))
+        self._entries[key] = (fetched_at, size)
+        self._total += size - old_size
+
+    def _write(self, path: str, content: bytes) -> None:
+        # write to a temporary file and swap it in, so that readers never see a partially written file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _remove(self, key: str) -> None:
+        for ext in ("json", "body"):
+            try:
+                os.remove(self._path(key, ext))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            _, size = self._entries.pop(key, (0.0, 0))
+            self._total -= size
@@ -0,0 +1,120 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from consts import VALUE_TYPES
+from general_utils import canonical_fiction_url
+from politeness import PolitenessScheduler
+from scrape import enrich_data, fetch_page, make_session, parse_page
+
+QUEUED, FETCHING, ENRICHING, DONE, FAILED = "queued", "fetching", "enriching", "done", "failed"
+
+
+class Job:
+    """The state of scraping a single URL in the background."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.status = QUEUED
+        self.data: Optional[Dict[str, VALUE_TYPES]] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def as_row(self) -> Dict[str, VALUE_TYPES]:
+        elapsed = (self.finished_at or time.time()) - self.submitted_at
+        return {"URL": self.url, "Status": self.status, "Seconds": round(elapsed, 1), "Error": self.error}
+
+
+class JobManager:
+    """
+    Owns a pool of worker threads that scrape URLs in the background, so that the Streamlit app never blocks on a
+    download or an LLM call. Keep one instance in `st.session_state` and it survives reruns of the script.
+
+    Example:
+        manager = JobManager(max_workers=4)
+        manager.submit(["https://www.royalroad.com/fiction/76259/ultimate-level-1"])
+        rows = manager.pop_finished()  # the data of jobs that finished since the last call
+    """
+
+    def __init__(self, max_workers: int = 4):
+        """
+        Args:
+            max_workers (int): The number of URLs scraped at the same time. Downloads from RoyalRoad back off below
+                that while it throttles them (see `politeness.PolitenessScheduler`).
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rrscrape-job")
+        self._session = make_session(pool_size=max_workers)
+        self._scheduler = PolitenessScheduler(initial_concurrency=min(4, max_workers), max_concurrency=max_workers)
+        self._jobs: Dict[str, Job] = {}  # by canonical story URL, in submission order
+        self._finished: List[Job] = []  # finished jobs not yet collected by `pop_finished`
+        self._lock = threading.Lock()
+
+    def submit(self, urls: List[str]) -> List[str]:
+        """
+        Queues URLs for scraping. URLs that were already submitted are skipped.
+
+        Args:
+            urls (List[str]): The URLs to scrape.
+
+        Returns:
+            List[str]: The URLs that were queued.
+        """
+        queued = []
+        with self._lock:
+            for url in urls:
+                key = canonical_fiction_url(url)
+                if key in self._jobs:
+                    continue
+                self._jobs[key] = Job(url)
+                queued.append(url)
+                self._executor.submit(self._run, self._jobs[key])
+        return queued
+
+    def is_submitted(self, url: str) -> bool:
+        """Returns whether the story was already submitted, under this or any other URL of the same fiction ID."""
+        with self._lock:
+            return canonical_fiction_url(url) in self._jobs
+
+    def jobs(self) -> List[Dict[str, VALUE_TYPES]]:
+        """Returns a status row for every submitted job, in submission order."""
+        with self._lock:
+            return [job.as_row() for job in self._jobs.values()]
+
+    def progress(self) -> float:
+        """Returns the fraction of submitted jobs that are finished (1.0 if there are none)."""
+        with self._lock:
+            if not self._jobs:
+                return 1.0
+            return sum(job.status in (DONE, FAILED) for job in self._jobs.values()) / len(self._jobs)
+
+    def is_busy(self) -> bool:
+        """Returns whether any job is still queued or running."""
+        with self._lock:
+            return any(job.status not in (DONE, FAILED) for job in self._jobs.values())
+
+    def pop_finished(self) -> List[Dict[str, VALUE_TYPES]]:
+        """Returns the data of the jobs that succeeded since the last call, in the order in which they finished."""
+        with self._lock:
+            finished, self._finished = self._finished, []
+        return [job.data for job in finished if job.status == DONE]
+
+    def shutdown(self) -> None:
+        """Cancels the queued jobs and stops the workers once the running ones are done."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job) -> None:
+        try:
+            job.status = FETCHING
+            content = fetch_page(job.url, self._session, scheduler=self._scheduler)
+            data = parse_page(content, job.url, with_chapters=True)  # the app shows and stores every column
+            job.status = ENRICHING
+            job.data = enrich_data(data)
+            job.status = DONE
+        except Exception as e:  # reported in the job's status row instead
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = FAILED
+        job.finished_at = time.time()
+        with self._lock:
+            self._finished.append(job)
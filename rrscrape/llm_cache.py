@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from consts import VALUE_TYPES
+from metrics import METRICS
+
+
+class LLMCache:
+    """
+    A persistent SQLite cache of LLM-inferred values.
+
+    Entries are content-addressed: the key is a hash of the prompt inputs, the model name and the prompt version (see
+    `make_key`), so a story is only sent to the model again once its blurb, tags, warnings or title change, or the
+    prompt itself does. Entries expire after `ttl` seconds, and once there are more than `max_entries` the least
+    recently used ones are evicted. The cache is safe to share between threads.
+
+    Example:
+        cache = LLMCache(".rrscrape_cache/llm.sqlite3", ttl=30 * 24 * 60 * 60)
+        values = llm_fill_values(relevant_data, cache=cache)
+        print(cache.hits, cache.misses)
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        """
+        Args:
+            path (str): The SQLite database file. Use ":memory:" for a cache that lives only as long as the process.
+            ttl (Optional[float]): Seconds after which an entry expires. If None, entries never expire.
+            max_entries (Optional[int]): The maximum number of entries to keep. If None, the cache is unbounded.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_values (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_values_accessed_at ON llm_values (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(inputs: Dict[str, VALUE_TYPES], model: str, prompt_version: str) -> str:
+        """
+        Computes the cache key of a prompt.
+
+        Args:
+            inputs (Dict[str, VALUE_TYPES]): The data the prompt is built from.
+            model (str): The name of the model that answers the prompt.
+            prompt_version (str): The version of the prompt template.
+
+        Returns:
+            str: A hex digest identifying the prompt.
+        """
+        payload = json.dumps([inputs, model, prompt_version], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up a cached response, refreshing its position in the LRU order.
+
+        Args:
+            key (str): The key returned by `make_key`.
+
+        Returns:
+            Optional[Dict[str, Any]]: The cached values, or None if there is no fresh entry for the key.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM llm_values WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                METRICS.inc("llm_cache_misses")
+                return None
+            self._conn.execute("UPDATE llm_values SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        METRICS.inc("llm_cache_hits")
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, values: Dict[str, Any]) -> None:
+        """
+        Stores a response, evicting expired and least recently used entries as needed.
+
+        Args:
+            key (str): The key returned by `make_key`.
+            model (str): The name of the model that produced the values.
+            values (Dict[str, Any]): The values to cache. Must be JSON serializable.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_values (key, model, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, json.dumps(values, ensure_ascii=False), now, now),
+            )
+            if self.ttl is not None:
+                self._conn.execute("DELETE FROM llm_values WHERE created_at < ?", (now - self.ttl,))
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM llm_values WHERE key NOT IN "
+                    "(SELECT key FROM llm_values ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_values").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit/miss counters and the hit rate of this cache instance."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,282 @@
+"""
+A process-wide manager of the OpenAI(-compatible) clients used for enrichment.
+
+Clients are created once per API key and base URL and then shared, so their connection pools are reused across
+calls and threads. Every request first takes its share of a requests-per-minute and a tokens-per-minute token
+bucket, so that many concurrent enrichments stay within the provider's quota instead of running into 429s. When a
+request is throttled or fails transiently anyway, it is retried with jittered exponential backoff, waiting at least
+as long as the provider's Retry-After header asks for.
+
+Limits are configured with `configure(...)`, or with the RRSCRAPE_LLM_RPM / RRSCRAPE_LLM_TPM environment variables.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import openai
+
+from general_utils import estimate_tokens, parse_retry_after
+from metrics import METRICS
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled at `rate_per_minute`, holding at most `capacity` tokens (a minute's worth by
+    default). Callers may take more than is left; the bucket then goes into debt, which later callers wait out.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, amount: float) -> float:
+        # takes the tokens right away and returns how long the caller must wait until they would have been there
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, amount: float = 1) -> float:
+        """Blocks until `amount` tokens are available and returns the number of seconds waited."""
+        wait = self._reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, amount: float = 1) -> float:
+        """Like `acquire`, but waits without blocking the event loop."""
+        wait = self._reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def refund(self, amount: float) -> None:
+        """Returns tokens that were taken but not used (or takes more, if `amount` is negative)."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    # the number of seconds the provider asked us to wait, from the Retry-After(-Ms) headers of the error response
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+    except (TypeError, ValueError):
+        pass
+    return parse_retry_after(headers.get("retry-after"))
+
+
+class ClientManager:
+    """
+    Shares OpenAI clients between callers and schedules their chat completions within rate limits.
+    Use the process-wide instance from `get_client_manager` rather than creating new ones.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        timeout: float = 60.0,
+    ):
+        """
+        Args:
+            requests_per_minute (Optional[float]): The request budget. If None, requests are not rate limited.
+            tokens_per_minute (Optional[float]): The (prompt + completion) token budget. If None, tokens are not
+                rate limited.
+            max_retries (int): The number of retries of a throttled or transiently failing request.
+            base_delay (float): The backoff delay of the first retry, in seconds. Doubles with every retry.
+            max_delay (float): The maximum backoff delay, in seconds.
+            timeout (float): The timeout of a single request, in seconds.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._clients: Dict[Tuple[Optional[str], Optional[str], bool], Any] = {}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "queue_depth": 0, "throttle_seconds": 0.0, "backoff_seconds": 0.0}
+
+    def client(self) -> openai.Client:
+        """Returns the shared sync client for the current OPENAI_API_KEY and OPENAI_API_BASE."""
+        return self._client(asynchronous=False)
+
+    def async_client(self) -> openai.AsyncClient:
+        """Returns the shared async client for the current OPENAI_API_KEY and OPENAI_API_BASE."""
+        return self._client(asynchronous=True)
+
+    def _client(self, asynchronous: bool):
+        # keyed by the environment, since the app only sets the API key after the user entered it
+        key = (os.environ.get("OPENAI_API_KEY"), os.environ.get("OPENAI_API_BASE"), asynchronous)
+        with self._lock:
+            if key not in self._clients:
+                client_class = openai.AsyncClient if asynchronous else openai.Client
+                # retries are ours to make, so they go through the rate limits too
+                self._clients[key] = client_class(api_key=key[0], base_url=key[1], max_retries=0, timeout=self.timeout)
+            return self._clients[key]
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+        if name != "queue_depth":  # a gauge, not a running total
+            METRICS.inc(f"llm_{name}", amount)
+
+    def _estimate(self, kwargs: Dict[str, Any]) -> int:
+        prompt = "".join(str(message.get("content") or "") for message in kwargs.get("messages", []))
+        return estimate_tokens(prompt) + int(kwargs.get("max_tokens") or 0)
+
+    def _settle(self, estimated: int, usage: Any) -> None:
+        # correct the token bucket by what the request actually used, once the response reports it
+        if usage is not None:
+            METRICS.inc("llm_prompt_tokens", getattr(usage, "prompt_tokens", None) or 0)
+            METRICS.inc("llm_completion_tokens", getattr(usage, "completion_tokens", None) or 0)
+        if self._token_bucket is not None and usage is not None and getattr(usage, "total_tokens", None):
+            self._token_bucket.refund(estimated - usage.total_tokens)
+
+    def _refund(self, estimated: int) -> None:
+        # give back the tokens reserved for an attempt that failed without a usage report
+        if self._token_bucket is not None:
+            self._token_bucket.refund(estimated)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0.5, 1.0) * min(self.max_delay, self.base_delay * 2**attempt)
+        return max(delay, _retry_after(error) or 0.0)
+
+    def chat(self, **kwargs: Any) -> Any:
+        """
+        Creates a chat completion (same arguments as `client.chat.completions.create`) within the rate limits,
+        retrying throttled and transiently failing requests.
+
+        Raises:
+            openai.OpenAIError: If the request fails for good, or keeps failing after `max_retries` retries.
+        """
+        estimated = self._estimate(kwargs)
+        for attempt in range(self.max_retries + 1):
+            self._count("queue_depth")
+            try:
+                waited = self._request_bucket.acquire() if self._request_bucket else 0.0
+                waited += self._token_bucket.acquire(estimated) if self._token_bucket else 0.0
+            finally:
+                self._count("queue_depth", -1)
+            self._count("throttle_seconds", waited)
+            self._count("requests")
+            try:
+                response = self.client().chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                self._refund(estimated)  # the next attempt reserves its tokens again
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                self._count("retries")
+                self._count("backoff_seconds", delay)
+                time.sleep(delay)
+                continue
+            self._settle(estimated, getattr(response, "usage", None))
+            return response
+
+    async def achat(self, **kwargs: Any) -> Any:
+        """Like `chat`, but with the async client, waiting without blocking the event loop."""
+        estimated = self._estimate(kwargs)
+        for attempt in range(self.max_retries + 1):
+            self._count("queue_depth")
+            try:
+                waited = await self._request_bucket.acquire_async() if self._request_bucket else 0.0
+                waited += await self._token_bucket.acquire_async(estimated) if self._token_bucket else 0.0
+            finally:
+                self._count("queue_depth", -1)
+            self._count("throttle_seconds", waited)
+            self._count("requests")
+            try:
+                response = await self.async_client().chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                self._refund(estimated)  # the next attempt reserves its tokens again
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                self._count("retries")
+                self._count("backoff_seconds", delay)
+                await asyncio.sleep(delay)
+                continue
+            self._settle(estimated, getattr(response, "usage", None))
+            return response
+
+    def chat_stream(self, **kwargs: Any) -> Iterator[Any]:
+        """
+        Like `chat`, but streams the completion: returns an iterator of its chunks once the request was accepted (only
+        opening the stream is retried). Closing the iterator early closes the connection, which makes the provider stop
+        generating. The tokens are settled with the usage the provider sends at the end of the stream, if it gets there.
+
+        Raises:
+            openai.OpenAIError: If the request fails for good, or keeps failing after `max_retries` retries.
+        """
+        stream = self.chat(**kwargs, stream=True, stream_options={"include_usage": True})
+        return self._chunks(stream, self._estimate(kwargs))
+
+    def _chunks(self, stream: Any, estimated: int) -> Iterator[Any]:
+        usage = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                yield chunk
+        finally:
+            stream.close()
+            self._settle(estimated, usage)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the counters of this manager: "requests" made (including retries), "retries", the current
+        "queue_depth" (callers waiting for the rate limits), and the total "throttle_seconds" spent waiting for the
+        rate limits and "backoff_seconds" spent waiting between retries.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+_manager: Optional[ClientManager] = None
+_manager_lock = threading.Lock()
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+def get_client_manager() -> ClientManager:
+    """Returns the process-wide client manager, creating it from the environment on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ClientManager(
+                requests_per_minute=_env_float("RRSCRAPE_LLM_RPM"), tokens_per_minute=_env_float("RRSCRAPE_LLM_TPM")
+            )
+        return _manager
+
+
+def configure(**kwargs: Any) -> ClientManager:
+    """Replaces the process-wide client manager with one built from `kwargs` (see `ClientManager`), and returns it."""
+    global _manager
+    with _manager_lock:
+        _manager = ClientManager(**kwargs)
+        return _manager
@@ -0,0 +1,229 @@
+"""
+Instrumentation of scraping and enrichment: timing spans around each phase, counters, and structured events.
+
+Everything is recorded in the process-wide `METRICS` registry, e.g.:
+
+    with METRICS.span("parse"):
+        data = parse_page(content, url)
+    METRICS.inc("bytes_fetched", len(content))
+    METRICS.event("parse_fallback", url=url, error=repr(e))
+
+Spans are kept as histograms of their durations per phase, counters as running totals. Both can be exported as a
+Prometheus textfile (for the node exporter's textfile collector) or appended as JSON lines, e.g. at the end of a run:
+
+    METRICS.export_prometheus("/var/lib/node_exporter/rrscrape.prom")
+    METRICS.export_jsonl("metrics.jsonl")
+
+Events (warnings and errors that used to be printed) go to the registered sinks - by default, a readable line on
+stderr. `METRICS.add_sink(JsonlSink("events.jsonl"))` records them as JSON lines too.
+
+For a closer look at single URLs, `METRICS.configure_profiling(directory, sample_rate)` runs a sampled subset of the
+`METRICS.profile(url)` blocks (around each `rr_scrape`) under cProfile and tracemalloc.
+"""
+
+import contextlib
+import cProfile
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# upper bounds (in seconds) of the span duration histogram buckets
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "rrscrape_"
+
+
+class _SpanStats:
+    __slots__ = ("count", "total", "max", "errors", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.buckets = [0] * len(SPAN_BUCKETS)
+
+    def add(self, seconds: float, failed: bool) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.errors += failed
+        for i, bound in enumerate(SPAN_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "seconds": self.total, "max_seconds": self.max, "errors": self.errors}
+
+
+def stderr_sink(event: Dict[str, Any]) -> None:
+    """Prints an event as a readable line on stderr."""
+    fields = " ".join(f"{k}={v}" for k, v in event.items() if k not in ("ts", "event", "level"))
+    print(f"[{event['level']}] {event['event']}: {fields}", file=sys.stderr)
+
+
+class JsonlSink:
+    """An event sink appending every event to a file as a line of JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, default=str, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class Metrics:
+    """A thread-safe registry of timing spans, counters and event sinks. Use the process-wide `METRICS`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: Dict[str, _SpanStats] = {}
+        self._counters: Dict[str, float] = {}
+        self._sinks: List[Callable[[Dict[str, Any]], None]] = [stderr_sink]
+        self._profile_dir: Optional[str] = None
+        self._profile_rate = 0.0
+        self._profile_lock = threading.Lock()  # cProfile and tracemalloc only make sense for one URL at a time
+
+    @contextlib.contextmanager
+    def span(self, phase: str) -> Iterator[None]:
+        """Times the block as one occurrence of `phase`. A block that raises is counted as an error of the phase."""
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.observe(phase, time.perf_counter() - start, failed)
+
+    def observe(self, phase: str, seconds: float, failed: bool = False) -> None:
+        """Records a duration of `phase` measured elsewhere, e.g. the time to response headers of a request."""
+        with self._lock:
+            if phase not in self._spans:
+                self._spans[phase] = _SpanStats()
+            self._spans[phase].add(seconds, failed)
+
+    def inc(self, name: str, amount: float = 1) -> None:
+        """Adds `amount` to the counter `name`, e.g. "bytes_fetched" or "llm_cache_hits"."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def event(self, name: str, level: str = "warning", **fields: Any) -> None:
+        """Sends a structured event (a dictionary of `ts`, `event`, `level` and `fields`) to every sink."""
+        record = {"ts": time.time(), "event": name, "level": level, **fields}
+        self.inc(f"events_{name}")
+        for sink in list(self._sinks):
+            sink(record)
+
+    def add_sink(self, sink: Callable[[Dict[str, Any]], None]) -> None:
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink: Callable[[Dict[str, Any]], None]) -> None:
+        self._sinks.remove(sink)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current totals: {"ts": ..., "spans": {phase: {...}}, "counters": {name: value}}."""
+        with self._lock:
+            return {
+                "ts": time.time(),
+                "spans": {phase: stats.to_dict() for phase, stats in self._spans.items()},
+                "counters": dict(self._counters),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def prometheus(self) -> str:
+        """Formats the spans (as a histogram) and the counters in the Prometheus text exposition format."""
+        with self._lock:
+            spans = {
+                phase: (list(stats.buckets), stats.count, stats.total, stats.errors)
+                for phase, stats in self._spans.items()
+            }
+            counters = dict(self._counters)
+        lines = [
+            f"# HELP {PREFIX}phase_seconds Duration of each scrape and enrichment phase.",
+            f"# TYPE {PREFIX}phase_seconds histogram",
+        ]
+        for phase, (buckets, count, total, _) in sorted(spans.items()):
+            cumulative = 0
+            for bound, n in zip(SPAN_BUCKETS, buckets):
+                cumulative += n
+                lines.append(f'{PREFIX}phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {count}')
+            lines.append(f'{PREFIX}phase_seconds_sum{{phase="{phase}"}} {total}')
+            lines.append(f'{PREFIX}phase_seconds_count{{phase="{phase}"}} {count}')
+        lines += [f"# TYPE {PREFIX}phase_errors_total counter"]
+        lines += [f'{PREFIX}phase_errors_total{{phase="{phase}"}} {s[3]}' for phase, s in sorted(spans.items())]
+        for name, value in sorted(counters.items()):
+            lines += [f"# TYPE {PREFIX}{name}_total counter", f"{PREFIX}{name}_total {value}"]
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path: str) -> None:
+        """Writes `prometheus()` to a textfile, atomically, so the collector never reads a partial file."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def export_jsonl(self, path: str) -> None:
+        """Appends `snapshot()` to a file as a line of JSON."""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+    def configure_profiling(self, directory: Optional[str], sample_rate: float = 0.01) -> None:
+        """
+        Profiles a sample of the URLs passed to `profile`. The sample is deterministic (by a hash of the URL), so the
+        same URLs are profiled on every run. Pass None as the directory to stop profiling.
+
+        Args:
+            directory (Optional[str]): Where to write the cProfile stats (`<hash>.prof`, for `pstats` or snakeviz).
+            sample_rate (float): The share of URLs to profile, between 0 and 1.
+        """
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._profile_dir, self._profile_rate = directory, sample_rate
+
+    @contextlib.contextmanager
+    def profile(self, url: str) -> Iterator[None]:
+        """
+        Runs the block under cProfile and tracemalloc if the URL is in the profiled sample (see `configure_profiling`),
+        and reports the profile file and the peak traced memory in a "profiled" event. Only one URL is profiled at a
+        time; a sampled URL whose turn comes while another one is being profiled runs unprofiled.
+        """
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        sampled = self._profile_dir is not None and int(digest[:8], 16) / 0xFFFFFFFF < self._profile_rate
+        if not sampled or not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        was_tracing = tracemalloc.is_tracing()
+        if was_tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            yield
+        finally:
+            profiler.disable()
+            peak = tracemalloc.get_traced_memory()[1]
+            if not was_tracing:
+                tracemalloc.stop()
+            path = os.path.join(self._profile_dir, f"{digest[:16]}.prof")
+            profiler.dump_stats(path)
+            self._profile_lock.release()
+            self.event("profiled", level="info", url=url, profile=path, peak_mem_mb=round(peak / 2**20, 2))
+
+
+METRICS = Metrics()
@@ -0,0 +1,125 @@
+"""
+Parsing story pages in a pool of worker processes.
+
+Extracting a page is pure Python CPU work, so no matter how many threads download pages, parsing them in the same
+process runs on a single core at a time (the GIL). A `ParsePool` sends the raw page bytes to worker processes instead,
+and gets back the data `scrape.parse_page` extracted from them, unchanged. The calling process stays free to handle
+the network and LLM I/O.
+
+Example:
+    with ParsePool(workers=4) as pool:
+        for url, data, error in pool.parse_many(pages):
+            ...
+"""
+
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from chapters import Chapter
+from consts import VALUE_TYPES
+from scrape import parse_page
+
+# a parsed page as sent back from a worker: (data, chapters if asked for, error)
+Record = Tuple[Optional[Dict[str, VALUE_TYPES]], Optional[List[Chapter]], Optional[Exception]]
+
+
+def _parse_record(url: str, content: bytes, parser: str, with_chapters: bool = False) -> Record:
+    # runs in the worker processes; errors are returned rather than raised, so one bad page can't fail a whole chunk
+    chapters: Optional[List[Chapter]] = [] if with_chapters else None
+    try:
+        return parse_page(content, url, parser, chapters), chapters, None
+    except Exception as e:
+        return None, None, e
+
+
+class ParsePool:
+    """
+    A pool of processes extracting story pages (see `scrape.parse_page`). The data it returns is the same raw data
+    in-process parsing gives, and is passed on to `scrape.enrich_data` (or the pipeline's stages) the same way.
+
+    Args:
+        workers (Optional[int]): The number of worker processes. Defaults to the number of CPU cores.
+        chunk_size (int): The number of pages sent to a worker at once by `parse_many`. Larger chunks cost fewer
+            round trips between the processes, smaller ones balance the load better.
+        parser (str): The page extractor to use, one of `extract.EXTRACTORS`.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 4, parser: str = "lxml"):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.parser = parser
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def submit(self, url: str, content: bytes, with_chapters: bool = False) -> "Future[Record]":
+        """
+        Sends one page to a worker and returns the future of its record (see `to_data`). With `with_chapters`, the
+        record also carries the chapters of the page.
+        """
+        return self._executor.submit(_parse_record, url, content, self.parser, with_chapters)
+
+    @staticmethod
+    def to_data(record: Record, chapters: Optional[List[Chapter]] = None) -> Dict[str, VALUE_TYPES]:
+        """
+        Returns the story data of a record returned by a worker.
+
+        Args:
+            record (Record): The record, as returned by `submit`.
+            chapters (Optional[List[Chapter]]): If given, the chapters carried by the record are added to it.
+
+        Raises:
+            Exception: The error the page failed to parse with, if it did.
+        """
+        data, record_chapters, error = record
+        if error is not None:
+            raise error
+        if chapters is not None and record_chapters is not None:
+            chapters.extend(record_chapters)
+        return data
+
+    def parse(self, url: str, content: bytes, chapters: Optional[List[Chapter]] = None) -> Dict[str, VALUE_TYPES]:
+        """
+        Parses a single page in a worker, blocking until it is done. Safe to call from many threads at once.
+
+        Args:
+            url (str): The URL the content was fetched from.
+            content (bytes): The HTML content of the story page.
+            chapters (Optional[List[Chapter]]): If given, the chapters of the page are added to it, as with
+                `scrape.parse_page`.
+
+        Returns:
+            Dict[str, VALUE_TYPES]: The extracted (not yet normalized) data.
+        """
+        return self.to_data(self.submit(url, content, chapters is not None).result(), chapters)
+
+    def parse_many(
+        self, pages: Iterable[Tuple[str, bytes]]
+    ) -> Iterator[Tuple[str, Optional[Dict[str, VALUE_TYPES]], Optional[Exception]]]:
+        """
+        Parses many pages across the workers, `chunk_size` pages at a time.
+
+        Args:
+            pages (Iterable[Tuple[str, bytes]]): The (URL, content) of every page.
+
+        Yields:
+            Tuple[str, Optional[Dict[str, VALUE_TYPES]], Optional[Exception]]: The URL, data and parsing error of each
+            page, in the order of `pages`.
+        """
+        urls, contents = [], []
+        for url, content in pages:
+            urls.append(url)
+            contents.append(content)
+        records = self._executor.map(
+            _parse_record, urls, contents, [self.parser] * len(urls), chunksize=max(1, self.chunk_size)
+        )
+        for url, (data, _, error) in zip(urls, records):
+            yield url, data, error
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "ParsePool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,201 @@
+"""
+A streaming scrape pipeline: fetch -> parse -> enrich -> normalize, each stage with its own pool of worker threads,
+connected by bounded queues.
+
+Unlike `scrape.rr_scrape`, where every story waits for its own download and LLM call in turn, the stages here run
+side by side: pages keep downloading while earlier stories wait on the LLM, and vice versa. The queues apply
+backpressure - a stage that falls behind makes the stages before it block - so memory stays bounded no matter how
+long the input is, and URLs are only pulled from the input iterable as capacity frees up.
+"""
+
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+from chapters import Chapter
+from consts import VALUE_TYPES
+from http_cache import HttpCache
+from llm_cache import LLMCache
+from parse_pool import ParsePool
+from politeness import PolitenessScheduler
+from snapshots import SnapshotStore
+from scrape import ScrapeResult, fetch_page, infer_data, make_session, normalize_data, parse_page, record_chapters
+
+_DONE = object()  # end-of-stream marker, one per worker of the receiving stage
+_POLL_INTERVAL = 0.1  # seconds between checks for a cancelled pipeline while blocked on a queue
+
+# an item flowing through the pipeline: (url, payload of the current stage, error that ended its processing)
+_Item = Tuple[str, Any, Optional[Exception]]
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event) -> Any:
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+class _Stage:
+    """A pool of worker threads applying `func(url, payload)` to every item of `inbox` and passing it to `outbox`."""
+
+    def __init__(self, name: str, func: Callable[[str, Any], Any], workers: int, queue_size: int):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.inbox: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.outbox: Optional[queue.Queue] = None
+        self.downstream_workers = 1
+        self._running = workers
+        self._lock = threading.Lock()
+
+    def start(self, stop: threading.Event) -> List[threading.Thread]:
+        threads = [
+            threading.Thread(target=self._work, args=(stop,), name=f"{self.name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _work(self, stop: threading.Event) -> None:
+        while True:
+            item = _get(self.inbox, stop)
+            if item is _DONE:
+                break
+            url, payload, error = item
+            if error is None:
+                try:
+                    payload = self.func(url, payload)
+                except Exception as e:  # the story drops out of the pipeline, but the rest keep going
+                    payload, error = None, e
+            if not _put(self.outbox, (url, payload, error), stop):
+                return
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last:  # the stage is drained - let every worker of the next one know
+            for _ in range(self.downstream_workers):
+                _put(self.outbox, _DONE, stop)
+
+
+def run_pipeline(
+    urls: Iterable[str],
+    fetch_workers: int = 8,
+    parse_workers: int = 2,
+    enrich_workers: int = 8,
+    normalize_workers: int = 1,
+    queue_size: int = 16,
+    session: Optional[requests.Session] = None,
+    cache: Optional[HttpCache] = None,
+    llm_cache: Optional[LLMCache] = None,
+    snapshots: Optional[SnapshotStore] = None,
+    parser: str = "lxml",
+    parse_pool: Optional[ParsePool] = None,
+    scheduler: Optional[PolitenessScheduler] = None,
+    with_chapters: bool = False,
+) -> Iterator[ScrapeResult]:
+    """
+    Scrapes a stream of RoyalRoad story URLs through a staged pipeline, yielding each story as soon as it is done.
+
+    Example:
+        for result in run_pipeline(open("urls.txt").read().split()):
+            print(result.url, result.error or result.data["RR Followers"])
+
+    Args:
+        urls (Iterable[str]): The story URLs. May be a lazy iterator of any length; it is consumed as the pipeline
+            has room for more.
+        fetch_workers (int): The number of concurrent downloads.
+        parse_workers (int): The number of threads parsing pages.
+        enrich_workers (int): The number of concurrent LLM enrichments.
+        normalize_workers (int): The number of threads normalizing the enriched data.
+        queue_size (int): The capacity of each queue between stages, which bounds the number of stories in flight.
+        session (Optional[requests.Session]): A session to download with instead of creating a pooled one.
+        cache (Optional[HttpCache]): An on-disk cache to serve and revalidate the pages from.
+        llm_cache (Optional[LLMCache]): A cache of previous LLM responses to reuse for unchanged stories.
+        snapshots (Optional[SnapshotStore]): A store of previous scrapes to record into (the new chapters of each
+            story too) and carry inferred values forward from.
+        parser (str): The page extractor to use, see `scrape.parse_page`.
+        parse_pool (Optional[ParsePool]): A pool of processes to parse the pages in, instead of the parse threads,
+            so that parsing can use more than one core. The parse threads then only hand the pages over to it, and
+            `parser` is taken from the pool.
+        scheduler (Optional[PolitenessScheduler]): A scheduler to download through, which adapts the number of
+            concurrent downloads per host (up to `fetch_workers`) to how the host responds, and requeues throttled
+            URLs.
+        with_chapters (bool): Whether to fill in the `CHAPTER_COLUMNS` from the chapter tables, which takes most of
+            the parse stage's time (see `scrape.parse_page`). Always done with `snapshots`.
+
+    Yields:
+        ScrapeResult: The result of each URL, in the order in which they finish. A failed URL carries the exception
+        of the stage it failed in.
+
+    Raises:
+        Exception: The error `urls` failed with, if it did - once the URLs taken from it before have been yielded.
+    """
+    session = session or make_session(pool_size=fetch_workers)
+    if parse_pool is not None:
+        parse_workers = max(parse_workers, parse_pool.workers)  # one thread per process keeps them all busy
+
+    def parse(url: str, content: bytes) -> Dict[str, VALUE_TYPES]:
+        chapters: Optional[List[Chapter]] = [] if with_chapters or snapshots is not None else None
+        if parse_pool is not None:
+            data = parse_pool.parse(url, content, chapters)
+        else:
+            data = parse_page(content, url, parser, chapters)
+        if snapshots is not None:
+            record_chapters(content, url, snapshots, chapters)
+        return data
+
+    stages = [
+        _Stage("fetch", lambda url, _: fetch_page(url, session, cache, scheduler), fetch_workers, queue_size),
+        _Stage("parse", parse, parse_workers, queue_size),
+        _Stage("enrich", lambda url, data: infer_data(data, llm_cache, snapshots), enrich_workers, queue_size),
+        _Stage("normalize", lambda url, data: normalize_data(data), normalize_workers, queue_size),
+    ]
+    results: queue.Queue = queue.Queue(maxsize=queue_size)
+    for stage, next_stage in zip(stages, stages[1:]):
+        stage.outbox, stage.downstream_workers = next_stage.inbox, next_stage.workers
+    stages[-1].outbox = results
+
+    stop = threading.Event()
+    feed_errors: List[Exception] = []
+
+    def feed() -> None:
+        try:
+            for url in urls:
+                if not _put(stages[0].inbox, (url, None, None), stop):
+                    return
+        except Exception as e:  # raised to the consumer once the stages drained
+            feed_errors.append(e)
+        finally:
+            for _ in range(stages[0].workers):
+                _put(stages[0].inbox, _DONE, stop)
+
+    threads = [threading.Thread(target=feed, name="feed", daemon=True)]
+    for stage in stages:
+        threads += stage.start(stop)
+    threads[0].start()
+    try:
+        while True:
+            item = _get(results, stop)
+            if item is _DONE:
+                break
+            url, data, error = item
+            yield ScrapeResult(url, data if error is None else None, error)
+        if feed_errors:
+            raise feed_errors[0]
+    finally:
+        stop.set()  # unblocks and ends all workers if the consumer stops early
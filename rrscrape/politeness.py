@@ -0,0 +1,233 @@
+"""
+Polite, adaptive downloading: a per-host scheduler that finds the highest request concurrency a host sustains.
+
+RoyalRoad (behind Cloudflare) answers too many requests with a 429, a 503, or a challenge page instead of the story.
+`check_response` recognizes all of them and raises a `ThrottledError` carrying the Retry-After delay, if any. A
+`PolitenessScheduler` then adjusts how many requests it lets through to that host at once with AIMD, like TCP
+congestion control: every success raises the host's concurrency limit additively (by about one per limit's worth of
+successes), and every throttle halves it and pauses the host for the Retry-After delay (or an exponential backoff).
+The throttled URL is requeued - it waits for the host's pause and a free slot again - instead of failing.
+
+    scheduler = PolitenessScheduler(max_concurrency=8)
+    for result in rr_scrape_many(urls, scheduler=scheduler):
+        ...
+    print(scheduler.stats())
+"""
+
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, TypeVar
+from urllib.parse import urlparse
+
+import requests
+
+from general_utils import parse_retry_after
+from metrics import METRICS
+
+T = TypeVar("T")
+
+THROTTLE_STATUSES = (429, 503)
+# markers of Cloudflare's interstitial and block pages, searched for in the head of the body
+CHALLENGE_PATTERN = re.compile(
+    rb"<title>\s*(?:Just a moment|Attention Required|Please Wait)|cf-browser-verification|/cdn-cgi/challenge-platform",
+    re.I,
+)
+CHALLENGE_SCAN_BYTES = 16384
+
+
+class ThrottledError(requests.HTTPError):
+    """
+    A response telling us to slow down: a 429 or 503 status, or a challenge page.
+
+    Attributes:
+        retry_after (Optional[float]): The seconds the server asked us to wait, if it said.
+        challenge (bool): Whether the response was a challenge page rather than a plain throttle status.
+    """
+
+    def __init__(self, message: str, response: requests.Response, retry_after: Optional[float], challenge: bool):
+        super().__init__(message, response=response)
+        self.retry_after = retry_after
+        self.challenge = challenge
+
+
+def is_challenge(response: requests.Response) -> bool:
+    """Whether a response is a Cloudflare challenge or block page instead of the requested page."""
+    if response.headers.get("cf-mitigated") == "challenge":
+        return True
+    if response.status_code not in (200, 403, 503) or "html" not in response.headers.get("Content-Type", "html"):
+        return False
+    return CHALLENGE_PATTERN.search(response.content[:CHALLENGE_SCAN_BYTES]) is not None
+
+
+def check_response(response: requests.Response) -> None:
+    """
+    Raises a `ThrottledError` if the response is a throttle status or a challenge page. Other responses, errors
+    included, are left to `raise_for_status`.
+    """
+    challenge = is_challenge(response)
+    if challenge or response.status_code in THROTTLE_STATUSES:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        kind = "challenge page" if challenge else f"{response.status_code} response"
+        raise ThrottledError(f"Throttled with a {kind} for url: {response.url}", response, retry_after, challenge)
+
+
+class _Host:
+    __slots__ = ("limit", "in_flight", "resume_at", "epoch", "throttles", "consecutive_throttles", "successes")
+
+    def __init__(self, limit: float):
+        self.limit = limit  # the AIMD concurrency window; floor(limit) requests may run at once
+        self.in_flight = 0
+        self.resume_at = 0.0  # monotonic time until which the host is paused
+        self.epoch = 0  # bumped on every decrease, so that one burst of throttles only decreases once
+        self.throttles = 0
+        self.consecutive_throttles = 0
+        self.successes = 0
+
+
+class PolitenessScheduler:
+    """
+    Limits the concurrent requests to each host, adapting the limit to how the host responds (see the module doc).
+    Safe to share between threads; one scheduler should see all requests to a host.
+    """
+
+    def __init__(
+        self,
+        initial_concurrency: float = 4,
+        min_concurrency: float = 1,
+        max_concurrency: float = 16,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        base_backoff: float = 5.0,
+        max_backoff: float = 300.0,
+        max_requeues: int = 8,
+    ):
+        """
+        Args:
+            initial_concurrency (float): The concurrency limit each host starts with.
+            min_concurrency (float): The lowest limit a host is throttled down to.
+            max_concurrency (float): The highest limit a host is allowed to reach.
+            increase (float): How much the limit grows per limit's worth of successful requests.
+            decrease (float): The factor the limit is multiplied by when the host throttles us.
+            base_backoff (float): The pause after a throttle without a Retry-After header, in seconds. Doubles with
+                every consecutive throttle.
+            max_backoff (float): The longest pause without a Retry-After header, in seconds.
+            max_requeues (int): How often a URL is requeued after being throttled before its request fails.
+        """
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_requeues = max_requeues
+        self._hosts: Dict[str, _Host] = {}
+        self._cond = threading.Condition()
+
+    def _host(self, host: str) -> _Host:
+        if host not in self._hosts:
+            self._hosts[host] = _Host(self.initial_concurrency)
+        return self._hosts[host]
+
+    def _acquire(self, host: str) -> int:
+        # blocks until the host isn't paused and has a free slot; returns the epoch the request is sent in
+        with self._cond:
+            state = self._host(host)
+            while True:
+                wait = state.resume_at - time.monotonic()
+                if wait <= 0 and state.in_flight < max(1, int(state.limit)):
+                    state.in_flight += 1
+                    return state.epoch
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def _succeeded(self, host: str) -> None:
+        with self._cond:
+            state = self._hosts[host]
+            state.in_flight -= 1
+            state.successes += 1
+            state.consecutive_throttles = 0
+            state.limit = min(self.max_concurrency, state.limit + self.increase / state.limit)
+            self._cond.notify_all()
+
+    def _failed(self, host: str) -> None:
+        # an error that says nothing about the host's load - just free the slot
+        with self._cond:
+            self._hosts[host].in_flight -= 1
+            self._cond.notify_all()
+
+    def _throttled(self, host: str, epoch: int, retry_after: Optional[float]) -> float:
+        with self._cond:
+            state = self._hosts[host]
+            state.in_flight -= 1
+            state.throttles += 1
+            state.consecutive_throttles += 1
+            if epoch == state.epoch:  # requests sent before the last decrease don't decrease again
+                state.limit = max(self.min_concurrency, state.limit * self.decrease)
+                state.epoch += 1
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (state.consecutive_throttles - 1))
+            pause = retry_after if retry_after is not None else random.uniform(0.5, 1.0) * backoff
+            state.resume_at = max(state.resume_at, time.monotonic() + pause)
+            self._cond.notify_all()
+        METRICS.inc("fetch_throttled")
+        METRICS.inc("fetch_backoff_seconds", pause)
+        return pause
+
+    def run(self, url: str, request: Callable[[], T]) -> T:
+        """
+        Makes a request to the host of `url` within its concurrency limit, requeueing it while it is throttled.
+
+        Args:
+            url (str): The URL requested, which determines the host.
+            request (Callable[[], T]): Makes the request, raising a `ThrottledError` if it was throttled (see
+                `check_response`).
+
+        Returns:
+            T: What `request` returned.
+
+        Raises:
+            ThrottledError: If the request was still throttled after `max_requeues` requeues.
+        """
+        host = urlparse(url).netloc
+        for requeues in range(self.max_requeues + 1):
+            epoch = self._acquire(host)
+            try:
+                result = request()
+            except ThrottledError as e:
+                pause = self._throttled(host, epoch, e.retry_after)
+                if requeues == self.max_requeues:
+                    raise
+                METRICS.inc("fetch_requeued")
+                METRICS.event(
+                    "fetch_throttled",
+                    level="info",
+                    url=url,
+                    challenge=e.challenge,
+                    pause=round(pause, 2),
+                    concurrency=round(self.concurrency(host), 2),
+                )
+                continue
+            except BaseException:
+                self._failed(host)
+                raise
+            self._succeeded(host)
+            return result
+
+    def concurrency(self, host: str) -> float:
+        """Returns the current concurrency limit of a host (a URL's netloc)."""
+        with self._cond:
+            return self._host(host).limit
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns per host: the concurrency "limit", the requests "in_flight", "successes" and "throttles"."""
+        with self._cond:
+            return {
+                host: {
+                    "limit": state.limit,
+                    "in_flight": state.in_flight,
+                    "successes": state.successes,
+                    "throttles": state.throttles,
+                }
+                for host, state in self._hosts.items()
+            }
@@ -0,0 +1,306 @@
+"""
+An append-only, typed, columnar store of scrape results, kept as Parquet files partitioned by retrieval date.
+
+Every `append` writes new files rather than rewriting old ones, so adding results costs the same however large the
+history grows. Once a date partition has `COMPACT_AT` files, they are merged into one, so that many small appends
+(e.g. one per finished story) don't leave thousands of tiny files behind. Reads go through `pyarrow.dataset`, which
+only opens the date partitions and columns a query needs.
+"""
+
+import io
+import os
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from consts import COLS_DTYPES, COLS_ORDER, VALUE_TYPES
+
+PARTITION_KEY = "retrieved_at"  # directory-level partition key, mirrors the "RR Retrieved at" column
+COMPACT_AT = 32  # files in a date partition that `append` merges into one
+_ARROW_TYPES = {
+    "string": pa.string(),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "Float32": pa.float32(),
+    "Int32": pa.int32(),
+    "Int64": pa.int64(),
+}
+ARROW_SCHEMA = pa.schema([pa.field(col, _ARROW_TYPES[COLS_DTYPES[col]]) for col in COLS_ORDER])
+
+
+_NUMBER = r"^[-+]?\d+(\.\d+)?$"
+_NUMERIC_KINDS = ("empty", "integer", "floating", "mixed-integer-float", "decimal")  # see `pd.api.types.infer_dtype`
+
+
+def _strings(column: pd.Series) -> pa.Array:
+    # the column as an Arrow string array, stripped, with non-breaking spaces as plain ones (as `normalize_vals` does)
+    if pd.api.types.infer_dtype(column, skipna=True) not in ("string", "empty"):
+        column = column.map(lambda v: v if isinstance(v, str) else str(v), na_action="ignore")
+    if isinstance(column.dtype, pd.StringDtype):  # e.g. pandas' Arrow-backed strings, taken over without a copy
+        text = pa.array(column, from_pandas=True)
+    else:
+        text = pa.array(column, type=pa.string(), from_pandas=True)
+    return pc.utf8_trim_whitespace(pc.replace_substring(text, "\xa0", " "))
+
+
+def _numeric_column(column: pd.Series, dtype: str) -> pd.Series:
+    if pd.api.types.infer_dtype(column, skipna=True) in _NUMERIC_KINDS:  # already normalized
+        values = pd.to_numeric(column, errors="coerce")
+    else:  # raw strings, e.g. "1,234" or "4.5 / 5"
+        text = pc.replace_substring(_strings(column), ",", "")
+        if pc.any(pc.match_substring(text, "/")).as_py():
+            text = pc.ascii_trim_whitespace(pc.list_element(pc.split_pattern(text, "/", max_splits=1), 0))
+        try:
+            numbers = pc.cast(text, pa.float64())
+        except pa.ArrowInvalid:  # some values aren't numbers - they become missing
+            numbers = pc.cast(pc.if_else(pc.match_substring_regex(text, _NUMBER), text, None), pa.float64())
+        values = pd.Series(numbers.to_numpy(zero_copy_only=False), index=column.index)
+    if not dtype.startswith("Float"):
+        values = values.round()
+    return values.astype(dtype)
+
+
+def _text_column(column: pd.Series, dtype: str) -> pd.Series:
+    text = _strings(column)
+    if dtype == "category":  # encoded in Arrow, so every distinct value is only converted once
+        return pd.Series(text.dictionary_encode().to_pandas(), index=column.index, dtype=dtype)
+    return pd.Series(text.to_pandas(), index=column.index, dtype=dtype)
+
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalizes scrape results a whole column at a time, into the `COLS_ORDER` columns and their `COLS_DTYPES` dtypes.
+
+    This is the batch counterpart of `scrape.normalize_data`: raw values straight from the extractors ("1,234",
+    "4.5 / 5", padded strings) are converted with vectorized Arrow string kernels instead of a regex match per value,
+    and values that are already normalized pass through. The declared dtype of a column decides how it is converted,
+    so e.g. a title that looks like a count stays a string. Values that don't fit a numeric column (e.g. an LLM
+    answering "unknown" for a count) become missing.
+
+    Args:
+        df (pd.DataFrame): The scrape results, with any subset of the `COLS_ORDER` columns.
+
+    Returns:
+        pd.DataFrame: The typed results. Missing columns are all-missing.
+    """
+    columns = {}
+    for col in COLS_ORDER:
+        column = df[col] if col in df.columns else pd.Series(None, index=df.index, dtype=object)
+        dtype = COLS_DTYPES[col]
+        if dtype in ("Float32", "Int32", "Int64"):
+            columns[col] = _numeric_column(column, dtype)
+        else:
+            columns[col] = _text_column(column, dtype)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def to_typed_frame(records: List[Dict[str, VALUE_TYPES]]) -> pd.DataFrame:
+    """
+    Builds a DataFrame of scrape results with the `COLS_ORDER` columns and their `COLS_DTYPES` dtypes.
+    The records may be raw or already normalized, see `normalize_frame`.
+
+    Args:
+        records (List[Dict[str, VALUE_TYPES]]): The scraped data of each story.
+
+    Returns:
+        pd.DataFrame: The typed results.
+    """
+    return normalize_frame(pd.DataFrame(records, columns=COLS_ORDER))
+
+
+class ResultsStore:
+    """
+    Scrape results on disk, as `<root>/retrieved_at=<YYYY-MM-DD>/part-<id>.parquet` files with `ARROW_SCHEMA`.
+
+    Example:
+        store = ResultsStore("results")
+        store.append([rr_scrape(url) for url in urls])
+        recent = store.read(since="2024-07-01", columns=["RR Title", "RR Followers"])
+        store.export_csv("results.csv")
+    """
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root (str): The directory of the store. Created if it doesn't exist.
+        """
+        self.root = root
+        self._version_path = os.path.join(root, ".version")  # hidden, like temporary files, so reads skip it
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def version(self) -> int:
+        """
+        A number that changes whenever results are appended or compacted, for caching reads. It is kept in a small
+        file, so checking it costs the same however many files the store has.
+        """
+        try:
+            with open(self._version_path) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_version(self) -> None:
+        # a timestamp rather than a counter, so that processes appending at the same time can't lose an update
+        tmp_path = os.path.join(self.root, f".version-{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, self._version_path)
+
+    def _write(self, table: pa.Table, partition_dir: str) -> None:
+        tmp_path = os.path.join(partition_dir, f".part-{uuid.uuid4().hex}.tmp")
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, tmp_path.replace(".tmp", ".parquet").replace(".part-", "part-"))  # readers skip tmp
+
+    def _compact_partition(self, partition_dir: str, min_files: int) -> int:
+        # merges the files of a date partition, oldest first, into one, if it has at least `min_files` of them. The
+        # merged file replaces the old ones before they are removed, so a read in between may see rows twice, but
+        # never misses any.
+        parts = [
+            os.path.join(partition_dir, name)
+            for name in os.listdir(partition_dir)
+            if name.startswith("part-") and name.endswith(".parquet")
+        ]
+        if len(parts) < max(2, min_files):
+            return 0
+        parts.sort(key=os.path.getmtime)
+        self._write(pa.concat_tables([pq.ParquetFile(path).read() for path in parts]), partition_dir)
+        for path in parts:
+            os.remove(path)
+        return len(parts)
+
+    def compact(self, min_files: int = 2) -> int:
+        """
+        Merges the files of every date partition that has at least `min_files` of them into one. `append` already does
+        this once a partition has `COMPACT_AT` files.
+
+        Returns:
+            int: The number of files merged.
+        """
+        merged = sum(
+            self._compact_partition(entry.path, min_files)
+            for entry in os.scandir(self.root)
+            if entry.is_dir() and entry.name.startswith(f"{PARTITION_KEY}=")
+        )
+        if merged:
+            self._bump_version()
+        return merged
+
+    def append(self, records: List[Dict[str, VALUE_TYPES]]) -> int:
+        """
+        Appends scrape results to the store, one new file per retrieval date (see `COMPACT_AT`).
+
+        Args:
+            records (List[Dict[str, VALUE_TYPES]]): The scraped data of each story.
+
+        Returns:
+            int: The number of rows written.
+        """
+        if not records:
+            return 0
+        df = to_typed_frame(records)
+        dates = df["RR Retrieved at"].fillna("unknown")
+        for date in dates.unique():
+            table = pa.Table.from_pandas(df[dates == date], schema=ARROW_SCHEMA, preserve_index=False)
+            partition_dir = os.path.join(self.root, f"{PARTITION_KEY}={date}")
+            os.makedirs(partition_dir, exist_ok=True)
+            self._write(table, partition_dir)
+            self._compact_partition(partition_dir, COMPACT_AT)
+        self._bump_version()
+        return len(df)
+
+    def _dataset(self) -> ds.Dataset:
+        return ds.dataset(
+            self.root,
+            schema=ARROW_SCHEMA.append(pa.field(PARTITION_KEY, pa.string())),
+            format="parquet",
+            partitioning="hive",
+            exclude_invalid_files=True,
+            ignore_prefixes=["."],
+        )
+
+    def _filter(
+        self, since: Optional[str], until: Optional[str], filter: Optional[ds.Expression]
+    ) -> Optional[ds.Expression]:
+        # date bounds are applied to the partition key, so that files outside the range are never opened
+        expressions = [filter] if filter is not None else []
+        if since is not None:
+            expressions.append(pc.field(PARTITION_KEY) >= since)
+        if until is not None:
+            expressions.append(pc.field(PARTITION_KEY) <= until)
+        if not expressions:
+            return None
+        expression = expressions[0]
+        for other in expressions[1:]:
+            expression = expression & other
+        return expression
+
+    def read(
+        self,
+        columns: Optional[List[str]] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        filter: Optional[ds.Expression] = None,
+    ) -> pd.DataFrame:
+        """
+        Reads results from the store, only touching the date partitions and columns the query needs.
+
+        Example:
+            popular = store.read(filter=pc.field("RR Followers") > 10_000, columns=["RR Title", "RR Followers"])
+
+        Args:
+            columns (Optional[List[str]]): The columns to read. All of `COLS_ORDER` if not given.
+            since (Optional[str]): The earliest retrieval date to read, as "YYYY-MM-DD".
+            until (Optional[str]): The latest retrieval date to read, as "YYYY-MM-DD".
+            filter (Optional[ds.Expression]): A row filter, e.g. `pc.field("Subgenre") == "LitRPG"`.
+
+        Returns:
+            pd.DataFrame: The matching results, with `COLS_DTYPES` dtypes.
+        """
+        columns = columns or COLS_ORDER
+        table = self._dataset().to_table(columns=columns, filter=self._filter(since, until, filter))
+        return table.to_pandas().astype({col: COLS_DTYPES[col] for col in columns})
+
+    def count(self, since: Optional[str] = None, until: Optional[str] = None) -> int:
+        """Returns the number of stored results, optionally within a range of retrieval dates."""
+        return self._dataset().count_rows(filter=self._filter(since, until, None))
+
+    def export_csv(
+        self,
+        destination,
+        columns: Optional[List[str]] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        filter: Optional[ds.Expression] = None,
+    ) -> None:
+        """
+        Writes results to a CSV file batch by batch, without loading the whole history into memory.
+
+        Args:
+            destination: A file path or a binary file-like object.
+            columns, since, until, filter: Select the results to export, as in `read`.
+        """
+        columns = columns or COLS_ORDER
+        scanner = self._dataset().scanner(columns=columns, filter=self._filter(since, until, filter))
+        plain_schema = pa.schema(  # CSV has no dictionary type - write categories as plain strings
+            [
+                pa.field(col, pa.string() if pa.types.is_dictionary(field.type) else field.type)
+                for col, field in ((col, ARROW_SCHEMA.field(col)) for col in columns)
+            ]
+        )
+        with pa_csv.CSVWriter(destination, plain_schema) as writer:
+            for batch in scanner.to_batches():
+                if batch.num_rows:
+                    writer.write_batch(batch.cast(plain_schema))
+
+    def to_csv_bytes(self, **query) -> bytes:
+        """Returns the results of a query (see `export_csv`) as the bytes of a CSV file."""
+        buffer = io.BytesIO()
+        self.export_csv(buffer, **query)
+        return buffer.getvalue()
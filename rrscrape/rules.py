@@ -0,0 +1,151 @@
+"""
+Rule-based inference of `GENERAL_COLUMNS` values straight from the scraped page, used before (and instead of) the
+LLM wherever the page leaves little doubt. RoyalRoad tags and content warnings are chosen by the authors from a fixed
+list, so e.g. a "Female Lead" tag or a "Sexual Content" warning is as reliable as anything the LLM could infer.
+
+Every rule yields a value with a confidence between 0 and 1; `apply_rules` only accepts values at or above a
+threshold, and leaves the rest for the LLM. `RULE_STATS` keeps count of the LLM calls and tokens this saves.
+"""
+
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from consts import VALUE_TYPES
+from general_utils import estimate_tokens
+
+MIN_CONFIDENCE = 0.75  # rule values below this confidence are left for the LLM
+
+# (tag, value, confidence), in order of precedence - the first tag a story has wins
+SUBGENRE_TAGS = [
+    ("LitRPG", "LitRPG", 0.85),
+    ("GameLit", "GameLit", 0.8),
+    ("Cultivation", "Cultivation", 0.8),
+    ("Xianxia", "Cultivation", 0.8),
+    ("Wuxia", "Wuxia", 0.8),
+    ("Dungeon Core", "Dungeon Core", 0.8),
+    ("Portal Fantasy / Isekai", "Isekai", 0.75),
+    ("Progression", "Progression Fantasy", 0.75),
+]
+SETTING_TAGS = [
+    ("Space Opera", "Sci-fi", 0.85),
+    ("Sci-fi", "Sci-fi", 0.8),
+    ("Post Apocalyptic", "Post-apocalyptic", 0.85),
+    ("Urban Fantasy", "Urban fantasy", 0.85),
+    ("Portal Fantasy / Isekai", "Fantasy world (from Earth)", 0.75),
+    ("High Fantasy", "Fantasy world", 0.8),
+    ("Low Fantasy", "Fantasy world", 0.75),
+    ("Historical", "Historical", 0.75),
+    ("Virtual Reality", "Virtual reality", 0.8),
+]
+FEMALE_WORDS = re.compile(r"\b(she|her|hers|herself|girl|woman|princess|queen)\b", re.IGNORECASE)
+MALE_WORDS = re.compile(r"\b(he|him|his|himself|boy|man|prince|king)\b", re.IGNORECASE)
+SEXUAL_CONTENT_WARNING = "Sexual Content"
+
+
+def _split(value: VALUE_TYPES) -> List[str]:
+    return [item.strip() for item in str(value or "").split(",") if item.strip()]
+
+
+def _by_tags(tags: List[str], table: List[Tuple[str, str, float]]) -> Optional[Tuple[str, float]]:
+    for tag, value, confidence in table:
+        if tag in tags:
+            return value, confidence
+    return None
+
+
+def infer_values(data: Dict[str, VALUE_TYPES]) -> Dict[str, Tuple[VALUE_TYPES, float]]:
+    """
+    Infers whatever `GENERAL_COLUMNS` values the tags, warnings and blurb of a story allow.
+
+    Args:
+        data (Dict[str, VALUE_TYPES]): The story data, with "RR Tags", "RR Warnings" and "RR Blurb".
+
+    Returns:
+        Dict[str, Tuple[VALUE_TYPES, float]]: Maps each inferred column to its (value, confidence).
+    """
+    tags, warnings = _split(data.get("RR Tags")), _split(data.get("RR Warnings"))
+    blurb = str(data.get("RR Blurb") or "")
+    inferred = {}
+
+    # authors have to declare sexual content; its absence is weak evidence, so "No" is left for the LLM to judge
+    inferred["Steamy (18+/NSFW)"] = ("Yes", 0.9) if SEXUAL_CONTENT_WARNING in warnings else ("No", 0.6)
+
+    female_lead, male_lead = "Female Lead" in tags, "Male Lead" in tags
+    if female_lead != male_lead:
+        inferred["MC Gender"] = ("Female", 0.9) if female_lead else ("Male", 0.9)
+    elif not female_lead:  # no lead tag at all - fall back to the pronouns of the blurb
+        female, male = len(FEMALE_WORDS.findall(blurb)), len(MALE_WORDS.findall(blurb))
+        if female + male >= 3:
+            share = max(female, male) / (female + male)
+            inferred["MC Gender"] = ("Female" if female > male else "Male", round(0.5 + 0.35 * share, 2))
+
+    for column, table in (("Subgenre", SUBGENRE_TAGS), ("Story Setting", SETTING_TAGS)):
+        match = _by_tags(tags, table)
+        if match is not None:
+            inferred[column] = match
+    return inferred
+
+
+class RuleStats:
+    """Thread-safe counters of how much LLM work the rules saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stories = 0  # stories the rules were applied to
+        self.keys_resolved = 0  # missing values the rules filled in
+        self.llm_calls_avoided = 0  # stories the rules filled in completely
+        self.tokens_avoided = 0  # estimated prompt + completion tokens not sent to, or generated by, the LLM
+
+    def record(self, keys_resolved: int, call_avoided: bool, tokens_avoided: int) -> None:
+        with self._lock:
+            self.stories += 1
+            self.keys_resolved += keys_resolved
+            self.llm_calls_avoided += call_avoided
+            self.tokens_avoided += tokens_avoided
+
+    def report(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "stories": self.stories,
+                "keys_resolved": self.keys_resolved,
+                "llm_calls_avoided": self.llm_calls_avoided,
+                "tokens_avoided": self.tokens_avoided,
+            }
+
+
+RULE_STATS = RuleStats()
+
+
+def apply_rules(
+    data: Dict[str, VALUE_TYPES], min_confidence: float = MIN_CONFIDENCE
+) -> Tuple[Dict[str, VALUE_TYPES], Dict[str, float]]:
+    """
+    Fills in the missing (None) values of the story data that the rules can infer with enough confidence.
+
+    Args:
+        data (Dict[str, VALUE_TYPES]): The story data, as passed to `scrape.llm_fill_values`.
+        min_confidence (float): The lowest confidence at which a rule value is accepted.
+
+    Returns:
+        Tuple[Dict[str, VALUE_TYPES], Dict[str, float]]: The updated data, and the confidence of every value filled in.
+    """
+    res, confidences = dict(data), {}
+    for key, (value, confidence) in infer_values(data).items():
+        if key in res and res[key] is None and confidence >= min_confidence:
+            res[key] = value
+            confidences[key] = confidence
+    return res, confidences
+
+
+def record_savings(resolved: Dict[str, VALUE_TYPES], prompt: str, call_avoided: bool) -> None:
+    """
+    Adds the savings of a story to `RULE_STATS`.
+
+    Args:
+        resolved (Dict[str, VALUE_TYPES]): The values the rules filled in.
+        prompt (str): The prompt the LLM would have been sent for the story without the rules.
+        call_avoided (bool): Whether the rules filled in every missing value, so the LLM wasn't called at all.
+    """
+    completion_tokens = sum(estimate_tokens(f'"{key}": "{value}", ') for key, value in resolved.items())
+    RULE_STATS.record(len(resolved), call_avoided, (estimate_tokens(prompt) if call_avoided else 0) + completion_tokens)
@@ -1,8 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
 from io import BytesIO
+import json
+import os
+import sys
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
 import requests
 
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # rrscrape, imported flatly
+
+from consts import REQUEST_TIMEOUT
+from metrics import METRICS
+from scrape import make_session
 
 
 def load_image(url: str) -> np.ndarray:
@@ -30,3 +45,209 @@ def load_image(url: str) -> np.ndarray:
     except Exception as e:  # this is the base exception for numpy
         raise ValueError(f"Error converting image to numpy array: {e}")
     return img
+
+
+THUMBNAIL_SIZE = (128, 192)  # (width, height) of the stored thumbnails - RoyalRoad covers are 2:3 portraits
+ARRAY_FILE = "thumbnails.npy"
+INDEX_FILE = "thumbnails.json"
+
+
+def decode_thumbnail(content: bytes, size: Tuple[int, int] = THUMBNAIL_SIZE) -> np.ndarray:
+    """
+    Decodes an image and resizes it to a thumbnail of a fixed shape, cropping it to the aspect ratio if needed.
+
+    Args:
+        content (bytes): The encoded image (.jpg, .png, ...).
+        size (Tuple[int, int]): The (width, height) of the thumbnail.
+
+    Returns:
+        np.ndarray: The RGB pixels of the thumbnail, of shape (height, width, 3) and dtype uint8.
+
+    Raises:
+        ValueError: If the image cannot be decoded.
+    """
+    try:
+        img = Image.open(BytesIO(content))
+        img.draft("RGB", size)  # JPEGs are decoded straight at a reduced scale - far faster than a full decode
+        img = ImageOps.fit(img.convert("RGB"), size, Image.Resampling.BILINEAR)
+    except OSError as e:  # this is the base exception for PIL
+        raise ValueError(f"Error loading image: {e}")
+    return np.asarray(img, dtype=np.uint8)
+
+
+class ThumbnailStore:
+    """
+    Thumbnails of a fixed shape in a single memory-mapped `.npy` array, with a JSON index of the row of every ID.
+
+    Identical images (by content hash) share a row, so the same default cover is only stored once. The array grows by
+    doubling its capacity; rows past `len(store)` are unused. Use `load_thumbnails` to read the thumbnails back
+    without copying or decoding them.
+
+    Args:
+        path (str): The directory holding the array and the index. Created if it doesn't exist.
+        size (Tuple[int, int]): The (width, height) of the thumbnails. Must match the store if it already exists.
+        initial_capacity (int): The number of rows the array starts out with.
+    """
+
+    def __init__(self, path: str, size: Tuple[int, int] = THUMBNAIL_SIZE, initial_capacity: int = 1024):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if tuple(index["size"]) != tuple(size):
+                raise ValueError(f"Thumbnail store at {path} holds {tuple(index['size'])} thumbnails, not {size}")
+            self.size, self.rows, self.ids, self.hashes = size, index["rows"], index["ids"], index["hashes"]
+            self._array = np.load(os.path.join(path, ARRAY_FILE), mmap_mode="r+")
+        else:
+            self.size, self.rows, self.ids, self.hashes = size, 0, {}, {}
+            self._array = self._allocate(os.path.join(path, ARRAY_FILE), initial_capacity)
+            self.flush()
+
+    def _allocate(self, array_path: str, capacity: int) -> np.memmap:
+        width, height = self.size
+        return np.lib.format.open_memmap(array_path, mode="w+", dtype=np.uint8, shape=(capacity, height, width, 3))
+
+    def _grow(self) -> None:
+        # copy the used rows into an array of twice the capacity, and swap it in
+        array_path = os.path.join(self.path, ARRAY_FILE)
+        grown = self._allocate(array_path + ".tmp", max(1, 2 * len(self._array)))
+        grown[: self.rows] = self._array[: self.rows]
+        grown.flush()
+        del self._array, grown
+        os.replace(array_path + ".tmp", array_path)
+        self._array = np.load(array_path, mmap_mode="r+")
+
+    def __contains__(self, item_id: str) -> bool:
+        return str(item_id) in self.ids
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def link(self, item_id: str, digest: str) -> bool:
+        """Points `item_id` at the row of an already stored image by its content hash. Returns whether it exists."""
+        with self._lock:
+            if digest not in self.hashes:
+                return False
+            self.ids[str(item_id)] = self.hashes[digest]
+            return True
+
+    def add(self, item_id: str, digest: str, pixels: np.ndarray) -> bool:
+        """
+        Stores the thumbnail of an item, unless an image with the same content hash is already stored.
+
+        Args:
+            item_id (str): The ID of the item, e.g. the fiction ID.
+            digest (str): The content hash of the encoded image.
+            pixels (np.ndarray): The thumbnail, as returned by `decode_thumbnail`.
+
+        Returns:
+            bool: Whether the thumbnail was stored in a new row (rather than linked to an identical image).
+        """
+        with self._lock:
+            new = digest not in self.hashes
+            if new:
+                if self.rows == len(self._array):
+                    self._grow()
+                self._array[self.rows] = pixels
+                self.hashes[digest] = self.rows
+                self.rows += 1
+            self.ids[str(item_id)] = self.hashes[digest]
+            return new
+
+    def flush(self) -> None:
+        """Writes the array and the index to disk. The index is swapped in atomically, after the array."""
+        with self._lock:
+            self._array.flush()
+            index = {"size": list(self.size), "rows": self.rows, "ids": self.ids, "hashes": self.hashes}
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+
+    def close(self) -> None:
+        self.flush()
+        del self._array
+
+
+def load_thumbnails(path: str) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Opens a `ThumbnailStore` read-only. The thumbnails are memory-mapped, so nothing is read until it is used.
+
+    Example:
+        thumbnails, rows = load_thumbnails("covers")
+        cover = thumbnails[rows["76259"]]  # (height, width, 3) uint8
+
+    Args:
+        path (str): The directory of the store.
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, int]]: The thumbnails, of shape (rows, height, width, 3), and the row of each ID.
+    """
+    with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    return np.load(os.path.join(path, ARRAY_FILE), mmap_mode="r")[: index["rows"]], index["ids"]
+
+
+def fetch_thumbnails(
+    items: Iterable[Tuple[str, str]],
+    store: ThumbnailStore,
+    max_concurrency: int = 16,
+    session: Optional[requests.Session] = None,
+    refresh: bool = False,
+) -> Dict[str, int]:
+    """
+    Downloads the images of many items concurrently, and stores their thumbnails (see `ThumbnailStore`).
+
+    Downloading and decoding both happen in the worker threads - Pillow releases the GIL while decoding. An image
+    whose content hash is already stored is not decoded again.
+
+    Example:
+        df = ResultsStore(".rrscrape_results").read(columns=["RR URL", "RR Thumbnail URL"])
+        items = zip(df["RR URL"].map(fiction_id), df["RR Thumbnail URL"])
+        fetch_thumbnails(items, ThumbnailStore("covers"))
+
+    Args:
+        items (Iterable[Tuple[str, str]]): The (ID, image URL) of every item. Items without a URL are skipped.
+        store (ThumbnailStore): The store to add the thumbnails to. It is flushed at the end.
+        max_concurrency (int): The number of images downloaded at the same time.
+        session (Optional[requests.Session]): A session to download with instead of creating a pooled one.
+        refresh (bool): Whether to download the images of items that are already in the store again.
+
+    Returns:
+        Dict[str, int]: The number of images "stored", "deduplicated" (identical to a stored one), "skipped" (already
+        in the store, or without a URL) and "failed".
+    """
+    session = session or make_session(pool_size=max_concurrency)
+    stats = {"stored": 0, "deduplicated": 0, "skipped": 0, "failed": 0}
+
+    def fetch_one(item_id: str, url: str) -> str:
+        response = session.get(url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        digest = hashlib.sha256(response.content).hexdigest()
+        if store.link(item_id, digest):
+            return "deduplicated"
+        return (
+            "stored" if store.add(item_id, digest, decode_thumbnail(response.content, store.size)) else "deduplicated"
+        )
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {}
+        for item_id, url in {str(item_id): url for item_id, url in items}.items():  # the last URL of an ID wins
+            if not url or (item_id in store and not refresh):
+                stats["skipped"] += 1
+                continue
+            futures[executor.submit(fetch_one, item_id, url)] = (item_id, url)
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except (requests.RequestException, ValueError) as e:
+                item_id, url = futures[future]
+                METRICS.event("thumbnail_failed", level="error", item_id=item_id, url=url, error=repr(e))
+                outcome = "failed"
+            stats[outcome] += 1
+            METRICS.inc(f"thumbnails_{outcome}")
+    store.flush()
+    return stats
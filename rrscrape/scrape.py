@@ -1,45 +1,60 @@
+from collections import Counter
+import contextlib
 import copy
-from datetime import datetime as dt
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-from typing import Union, Dict
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Union, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+from urllib.parse import urlparse
 
-import requests
-from bs4 import BeautifulSoup
 import openai
+import requests
+from requests.adapters import HTTPAdapter
 
-from consts import GENERAL_COLUMNS, RR_COLUMNS, VALUE_TYPES
-from general_utils import fix_json_string, normalize_vals
+from cascade import CASCADE_STATS, resolve_models
+from chapters import Chapter, iter_chapters, summarize
+from consts import CHAPTER_COLUMNS, COLS_DTYPES, GENERAL_COLUMNS, VALUE_TYPES, REQUEST_TIMEOUT
+from extract import EXTRACTORS, extract_bs4
+from general_utils import (
+    JsonMemberStream,
+    estimate_tokens,
+    fiction_id,
+    normalize_vals,
+    parse_json_tolerant,
+    trim_to_tokens,
+)
+from http_cache import HttpCache
+from llm_cache import LLMCache
+from llm_client import get_client_manager
+from metrics import METRICS
+from politeness import PolitenessScheduler, check_response
+from rules import apply_rules, record_savings
+from snapshots import SnapshotStore, content_hash
 
+if TYPE_CHECKING:
+    from parse_pool import ParsePool
 
-def llm_fill_values(data: Dict[str, VALUE_TYPES], model="gpt-4o", attempts: int = 2) -> Dict[str, VALUE_TYPES]:
-    """
-    Uses a Large Language Model to go over the data and try to infer missing values which require some holistic
-    understanding of the data. Only fill in values that are missing (None) in the data dictionary.
+PROMPT_VERSION = "2"  # bump whenever the enrichment prompt changes, so that cached LLM values are not reused
+BATCH_OUTPUT_TOKENS_PER_STORY = 200  # the completion budget of one story in a batched request
+NULL_ANSWERS = {"", "null", "none", "n/a", "na", "unknown", "not specified", "not available"}
+NUMBER_IN_TEXT = re.compile(r"-?\d[\d,]*(\.\d+)?")
+STORY_TOKEN_BUDGET = 400  # the tokens of a story's collected data in a prompt, see `budget_prompt_data`
+MIN_BLURB_TOKENS = 64  # what is left of a blurb however long the rest of the data is
+_NO_JSON_SCHEMA: Set[Tuple[Optional[str], str]] = set()  # (API base, model) of providers without structured outputs
 
-    :param data: Dictionary containing data with potentially missing values (None).
-    :param model: Optional string specifying the model to use (default is "gryphe/mythomax-l2-13b").
-    :param attempts: Optional integer specifying the number of attempts to make to fill in the missing values.
-    :return: Updated dictionary with inferred missing values.
-    """
-    if None not in data.values():  # If there are no missing values - return
-        return data
-    res = copy.deepcopy(data)  # make this a pure function
+
+def _prompt(data: Dict[str, VALUE_TYPES]) -> str:
     missing, filled = [], {}  # Collate missing and filled values
-    for k, v in res.items():
+    for k, v in data.items():
         if v is None:
             missing.append(k)
         else:
             filled[k] = v
     filled_formatted = "\n".join([f"{k}: {v}" for k, v in filled.items()])
-    client = openai.Client(
-        api_key=os.environ.get("OPENAI_API_KEY"),
-        base_url=os.environ.get("OPENAI_API_BASE"),
-    )
-    prompt = f"""
-You are a working on a project to analyze web serial stories from RoyalRoad. You have collected some data from a story, but some values are missing.
-Below is data collected from a RoyalRoad story. RoyalRoad stories are mostly Progression Fantasy. MC means Main Character. 
-Please use it to try to fill in the missing values listed at the end of this message. 
+    return f"""
+Below is data collected from a RoyalRoad web serial story (mostly Progression Fantasy; MC means Main Character). Fill in the missing values listed after it.
 
 ===COLLECTED DATA===
 {filled_formatted}
@@ -48,43 +63,755 @@ Please use it to try to fill in the missing values listed at the end of this mes
 ===KEYS FOR MISSING VALUES===
 {set(missing)}
 ===END KEYS FOR MISSING VALUES===
-If you cannot be reasonably sure of a value with the given data, put in null instead. 
-Output: json-format response of the keys and filled values. Format it in one line, no linebreaks, no preamble - straight to the json! Only fill in missing values. Do not return any of the existing data.
+Use null for any value you cannot be reasonably sure of. Answer with one line of JSON of the missing keys and their values only, no preamble.
+    """
+
+
+def _fill_with_rules(data: Dict[str, VALUE_TYPES], use_rules: bool) -> Dict[str, VALUE_TYPES]:
+    # fills in what the rules can infer confidently, and records the LLM tokens (and maybe the call) that saved
+    if not use_rules or None not in data.values():
+        return data
+    res, confidences = apply_rules(data)
+    if confidences:
+        record_savings({k: res[k] for k in confidences}, _prompt(data), None not in res.values())
+    return res
+
+
+def _column_schema(key: str) -> Dict[str, Any]:
+    dtype = COLS_DTYPES.get(key, "string")
+    json_type = "integer" if dtype.startswith("Int") else "number" if dtype.startswith("Float") else "string"
+    return {"type": [json_type, "null"]}
+
+
+def response_schema(keys: List[str]) -> Dict[str, Any]:
+    """
+    Builds the JSON schema of an answer with a value (or null) for each of the missing keys, typed by `COLS_DTYPES`.
+
+    Args:
+        keys (List[str]): The missing keys.
+
+    Returns:
+        Dict[str, Any]: The JSON schema, for a "json_schema" response format.
+    """
+    return {
+        "type": "object",
+        "properties": {key: _column_schema(key) for key in keys},
+        "required": list(keys),
+        "additionalProperties": False,
+    }
+
+
+def _response_format(schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "json_schema", "json_schema": {"name": "missing_values", "strict": True, "schema": schema}}
+
+
+def _request_json(
+    model: str, prompt: str, max_tokens: int, schema: Optional[Dict[str, Any]], stream: bool = False
+) -> Any:
+    # asks for a response following the schema where the provider supports structured outputs, and for any JSON
+    # object where it doesn't (or no schema is given). Providers that reject schemas are remembered per model.
+    # Streamed responses are an iterator of chunks (see `ClientManager.chat_stream`).
+    provider = (os.environ.get("OPENAI_API_BASE"), model)
+    kwargs = dict(
+        model=model, messages=[{"role": "system", "content": prompt}], max_tokens=max_tokens, temperature=0.25
+    )
+    chat = get_client_manager().chat_stream if stream else get_client_manager().chat
+    if schema is not None and provider not in _NO_JSON_SCHEMA:
+        try:
+            return chat(**kwargs, response_format=_response_format(schema))
+        except openai.BadRequestError as e:
+            if "response_format" not in str(e) and "json_schema" not in str(e):
+                raise
+            if provider not in _NO_JSON_SCHEMA:
+                _NO_JSON_SCHEMA.add(provider)
+                METRICS.event("json_schema_unsupported", level="info", model=model, base_url=provider[0])
+    return chat(**kwargs, response_format={"type": "json_object"})
+
+
+def _chat_json(model: str, prompt: str, max_tokens: int, schema: Optional[Dict[str, Any]]) -> Any:
+    # like `_request_json`, recording the latency and tokens of the request under its model in `CASCADE_STATS`
+    start = time.perf_counter()
+    response = _request_json(model, prompt, max_tokens, schema)
+    usage = getattr(response, "usage", None)
+    content = (response.choices[0].message.content or "") if response.choices else ""
+    CASCADE_STATS.record_request(
+        model,
+        time.perf_counter() - start,
+        getattr(usage, "prompt_tokens", None) or estimate_tokens(prompt),  # as counted up front, if not reported
+        getattr(usage, "completion_tokens", None) or estimate_tokens(content),
+    )
+    return response
+
+
+def _stream_json(
+    model: str, prompt: str, max_tokens: int, schema: Optional[Dict[str, Any]], keys: List[str]
+) -> Tuple[Dict[str, Any], str, Optional[str]]:
+    # like `_chat_json`, but streams the response: its members are parsed as they arrive (see `JsonMemberStream`), and
+    # the generation is cut off as soon as every key has its value. Returns those values, the text received, and why
+    # the generation stopped ("stop", "length" for cut off by the token limit, or None if we cut it off).
+    start = time.perf_counter()
+    members = JsonMemberStream()
+    values, usage, finish_reason = {}, None, None
+    with contextlib.closing(_request_json(model, prompt, max_tokens, schema, stream=True)) as chunks:
+        for chunk in chunks:
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            values.update({k: v for k, v in members.feed(chunk.choices[0].delta.content or "") if k in keys})
+            if len(values) == len(keys) and finish_reason is None:
+                METRICS.inc("llm_streams_cut_off")
+                break
+    CASCADE_STATS.record_request(
+        model,
+        time.perf_counter() - start,
+        getattr(usage, "prompt_tokens", None) or estimate_tokens(prompt),
+        getattr(usage, "completion_tokens", None) or estimate_tokens(members.text),
+    )
+    return values, members.text, finish_reason
+
+
+def _coerce(value: Any, key: str) -> VALUE_TYPES:
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lower() in NULL_ANSWERS:
+            return None
+    if value is None or isinstance(value, dict):
+        return None
+    if isinstance(value, list):
+        items = [str(item).strip() for item in value if item is not None and not isinstance(item, (dict, list))]
+        value = ", ".join(item for item in items if item)
+        return value or None
+    dtype = COLS_DTYPES.get(key, "string")
+    if dtype.startswith(("Int", "Float")):
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, str):
+            match = NUMBER_IN_TEXT.search(value)
+            if match is None:
+                return None
+            value = float(match.group(0).replace(",", ""))
+        return int(value) if dtype.startswith("Int") else float(value)
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    return str(value)
+
+
+def coerce_values(values: Any, keys: List[str]) -> Dict[str, VALUE_TYPES]:
+    """
+    Validates the values a model answered with, and coerces them to the types of their columns: "null", "unknown",
+    "N/A" and the like become None, numbers are parsed out of text for numeric columns, lists are joined with commas,
+    and booleans become "Yes"/"No". Keys the model left out are None; keys that weren't asked about are dropped.
+
+    Args:
+        values (Any): The parsed answer of the model. Anything but a dictionary counts as an empty answer.
+        keys (List[str]): The missing keys the model was asked about.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: A value (or None) for each key.
+    """
+    if not isinstance(values, dict):
+        values = {}
+    left_out = sum(key not in values for key in keys)
+    if left_out:
+        METRICS.inc("llm_keys_left_out", left_out)
+    return {key: _coerce(values.get(key), key) for key in keys}
+
+
+def budget_prompt_data(data: Dict[str, VALUE_TYPES], max_tokens: int = STORY_TOKEN_BUDGET) -> Dict[str, VALUE_TYPES]:
     """
-    tentative_values = {}
+    Fits the collected data of a story into a token budget before it is put in a prompt. Tokens are counted up front
+    (see `estimate_tokens`), and the blurb - by far the longest value - is trimmed to what the other values leave of
+    the budget (see `trim_to_tokens`).
+
+    Args:
+        data (Dict[str, VALUE_TYPES]): The story data, as passed to `llm_fill_values`.
+        max_tokens (int): The token budget of the story's data in the prompt.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: The data with the trimmed blurb. Only meant for the prompt - the story keeps its full
+        blurb.
+    """
+    blurb = data.get("RR Blurb")
+    if not isinstance(blurb, str):
+        return data
+    others = sum(estimate_tokens(f"{k}: {v}\n") for k, v in data.items() if v is not None and k != "RR Blurb")
+    trimmed = trim_to_tokens(blurb, max(MIN_BLURB_TOKENS, max_tokens - others))
+    if trimmed == blurb:
+        return data
+    METRICS.inc("llm_prompt_tokens_trimmed", estimate_tokens(blurb) - estimate_tokens(trimmed))
+    return {**data, "RR Blurb": trimmed}
+
+
+def _ask_model(
+    model: str, data: Dict[str, VALUE_TYPES], attempts: int, structured: bool, last: bool
+) -> Dict[str, VALUE_TYPES]:
+    # asks one model of the cascade about the missing keys of the data. A model that never answers with any JSON
+    # leaves all of them to the next model, or fails if it is the last one.
+    missing = [k for k, v in data.items() if v is None]
+    prompt = _prompt(data)
+    schema = response_schema(missing) if structured else None
     for attempt in range(attempts):
         # Call OpenAI API to fill missing value using the model
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "system", "content": prompt}],
-            max_tokens=200,
-            temperature=0.25,
-            response_format={"type": "json_object"},
-        )
+        with METRICS.span("llm_request"):
+            response = _chat_json(model, prompt, 200, schema)
         # Extract filled value from API response
-        response_text = response.choices[0].message.content.strip()
-        # remove preamble before parsing JSON (e.g., "Here is your json: {...")
-        json_start_idx = response_text.find("{")
+        response_text = (response.choices[0].message.content or "").strip()
         try:
-            tentative_values = json.loads(response_text[json_start_idx:])
+            # fixes what is broken in a single pass (preambles, unescaped quotes, cut-off output) - no round trip
+            with METRICS.span("json_parse"):
+                tentative_values = parse_json_tolerant(response_text)
+        except ValueError:  # if the response has no JSON at all.
+            METRICS.event("invalid_llm_json", response=response_text, attempt=attempt + 1, model=model)
+            METRICS.inc("llm_json_retries", attempt < attempts - 1)
+            continue
+        return coerce_values(tentative_values, missing)
+    if last:
+        raise ValueError(f"Failed to parse LLM JSON response in {attempts} attempts.")
+    return dict.fromkeys(missing)
+
+
+def _ask_model_streaming(
+    model: str, data: Dict[str, VALUE_TYPES], attempts: int, structured: bool, last: bool
+) -> Dict[str, VALUE_TYPES]:
+    # like `_ask_model`, but streams the answers. The values received are kept whatever happens to the rest of the
+    # answer, and a retry only asks about the keys that are still missing.
+    missing = [k for k, v in data.items() if v is None]
+    answer: Dict[str, Any] = {}
+    any_json = False
+    for attempt in range(attempts):
+        keys = [k for k in missing if k not in answer]
+        asked = {k: v for k, v in data.items() if v is not None or k in keys}
+        schema = response_schema(keys) if structured else None
+        with METRICS.span("llm_request"):
+            values, response_text, finish_reason = _stream_json(model, _prompt(asked), 200, schema, keys)
+        answer.update(values)
+        any_json = any_json or bool(values)
+        if len(values) < len(keys) and finish_reason != "length":
+            # the answer is complete, but wasn't valid JSON as it arrived. Cut-off answers aren't, since the value
+            # they were cut off in would be too.
+            try:
+                with METRICS.span("json_parse"):
+                    tentative_values = parse_json_tolerant(response_text)
+                any_json = True
+                if isinstance(tentative_values, dict):
+                    answer.update({k: v for k, v in tentative_values.items() if k in keys and k not in answer})
+            except ValueError:
+                METRICS.event("invalid_llm_json", response=response_text, attempt=attempt + 1, model=model)
+        if all(k in answer for k in missing):
             break
-        except ValueError:  # if the response is not valid JSON.
-            tentative_values = fix_json_string(response_text[json_start_idx:])
-            print(f"Invalid JSON response: {response.choices[0].message.content}")
-            if attempt == attempts - 1:
-                raise ValueError(f"Failed to parse LLM JSON response in {attempts} attempts.")
-    if len(tentative_values) == 0:
+        if attempt < attempts - 1:
+            METRICS.inc("llm_partial_retries")
+    if last and not any_json:
+        raise ValueError(f"Failed to parse LLM JSON response in {attempts} attempts.")
+    return coerce_values(answer, missing)
+
+
+def _escalate(model: str, asked: List[str], answer: Dict[str, VALUE_TYPES], last: bool) -> List[str]:
+    # records what a model of the cascade resolved, and returns the keys left for the next one
+    left = [key for key in asked if answer.get(key) is None]
+    CASCADE_STATS.record_keys(model, len(asked), len(asked) - len(left))
+    if left and not last:
+        METRICS.inc("llm_keys_escalated", len(left))
+    return left
+
+
+def stream_by_default() -> bool:
+    """Whether `llm_fill_values` streams responses unless told otherwise, per the RRSCRAPE_LLM_STREAM variable."""
+    return os.environ.get("RRSCRAPE_LLM_STREAM", "").strip().lower() in ("1", "true", "yes")
+
+
+def llm_fill_values(
+    data: Dict[str, VALUE_TYPES],
+    model: Union[str, Sequence[str], None] = None,
+    attempts: int = 2,
+    cache: Optional[LLMCache] = None,
+    use_rules: bool = True,
+    structured: bool = True,
+    max_story_tokens: Optional[int] = STORY_TOKEN_BUDGET,
+    stream: Optional[bool] = None,
+) -> Dict[str, VALUE_TYPES]:
+    """
+    Uses a Large Language Model to go over the data and try to infer missing values which require some holistic
+    understanding of the data. Only fill in values that are missing (None) in the data dictionary.
+
+    The models of a cascade are asked in turn, cheapest first: each one is only asked about the keys the models before
+    it answered with null, or with a value that failed validation (see `coerce_values`). See `cascade`.
+
+    :param data: Dictionary containing data with potentially missing values (None).
+    :param model: Optional model, or cascade of models, to ask (default is the process-wide `cascade.get_models()`).
+    :param attempts: Optional integer specifying the number of attempts to make to fill in the missing values.
+    :param cache: Optional cache of previous responses. Stories whose data hasn't changed are not sent to the model.
+    :param use_rules: Optional boolean specifying whether to first fill in the values that can be read off the tags,
+        warnings and blurb (see `rules.apply_rules`). The LLM is then only asked about the rest, if any.
+    :param structured: Optional boolean specifying whether to constrain the response to a JSON schema of the missing
+        keys (see `response_schema`), where the provider supports it.
+    :param max_story_tokens: Optional token budget of the story's data in the prompt, which long blurbs are trimmed
+        to (see `budget_prompt_data`). None sends the data as it is.
+    :param stream: Optional boolean specifying whether to stream the responses (default is the RRSCRAPE_LLM_STREAM
+        environment variable). Each value is taken as soon as it is complete, the generation is cut off once every key
+        has one, and a retry after a cut-off or broken response only asks about the keys that are still missing.
+    :return: Updated dictionary with inferred missing values. Values the models couldn't infer are None.
+    :raises ValueError: If no response of the last model contains any JSON in `attempts` attempts.
+    """
+    data = _fill_with_rules(data, use_rules)
+    if None not in data.values():  # If there are no missing values - return
         return data
-    for key in missing:
-        if tentative_values[key] in (None, "null"):  # assume that json parsed 'null' into None, but verify
-            res[key] = None
+    models = resolve_models(model)
+    ask = _ask_model_streaming if (stream_by_default() if stream is None else stream) else _ask_model
+    prompt_data = budget_prompt_data(data, max_story_tokens) if max_story_tokens else data
+    cache_key = LLMCache.make_key(prompt_data, "+".join(models), PROMPT_VERSION) if cache is not None else None
+    cached_values = cache.get(cache_key) if cache is not None else None
+    if cached_values is not None:
+        return {**data, **cached_values}
+    res = copy.deepcopy(data)  # make this a pure function
+    missing = [k for k, v in res.items() if v is None]
+    pending = missing
+    for tier, tier_model in enumerate(models):
+        last = tier == len(models) - 1
+        # the keys resolved by earlier models are left out, so every model judges from the collected data alone
+        asked = {k: v for k, v in prompt_data.items() if v is not None or k in pending}
+        answer = ask(tier_model, asked, attempts, structured, last)
+        res.update({key: value for key, value in answer.items() if value is not None})
+        pending = _escalate(tier_model, pending, answer, last)
+        if not pending:
+            break
+    if cache is not None:
+        cache.put(cache_key, "+".join(models), {key: res[key] for key in missing})
+
+    return res
+
+
+def _batch_prompt(stories: Dict[str, Dict[str, VALUE_TYPES]]) -> str:
+    story_blocks = []
+    for story_id, data in stories.items():
+        filled_formatted = "\n".join(f"{k}: {v}" for k, v in data.items() if v is not None)
+        missing = [k for k, v in data.items() if v is None]
+        story_blocks.append(
+            f"===STORY {story_id}===\n{filled_formatted}\nKEYS FOR MISSING VALUES: {missing}\n===END STORY {story_id}==="
+        )
+    stories_formatted = "\n\n".join(story_blocks)
+    return f"""
+You are a working on a project to analyze web serial stories from RoyalRoad. You have collected some data from several stories, but some values are missing.
+Below is data collected from each RoyalRoad story, followed by the keys of its missing values. RoyalRoad stories are mostly Progression Fantasy. MC means Main Character. 
+Please use each story's data to try to fill in that story's missing values. Never mix up data between stories.
+
+{stories_formatted}
+
+If you cannot be reasonably sure of a value with the given data, put in null instead. 
+Output: json-format response keyed by story ID, where each story ID maps to an object of that story's missing keys and filled values, e.g. {{"123": {{"MC Gender": "Female"}}}}. Format it in one line, no linebreaks, no preamble - straight to the json! Only fill in missing values. Do not return any of the existing data.
+    """
+
+
+def _pack_batches(
+    stories: Dict[str, Dict[str, VALUE_TYPES]], batch_size: int, max_prompt_tokens: int
+) -> List[Dict[str, Dict[str, VALUE_TYPES]]]:
+    # greedily fill each batch until it holds `batch_size` stories or the next story would exceed the token budget
+    batches, batch, batch_tokens = [], {}, estimate_tokens(_batch_prompt({}))
+    for story_id, data in stories.items():
+        story_tokens = estimate_tokens(_batch_prompt({story_id: data})) - estimate_tokens(_batch_prompt({}))
+        if batch and (len(batch) >= batch_size or batch_tokens + story_tokens > max_prompt_tokens):
+            batches.append(batch)
+            batch, batch_tokens = {}, estimate_tokens(_batch_prompt({}))
+        batch[story_id] = data
+        batch_tokens += story_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def llm_fill_values_batch(
+    stories: Dict[str, Dict[str, VALUE_TYPES]],
+    model: Union[str, Sequence[str], None] = None,
+    batch_size: int = 10,
+    max_prompt_tokens: int = 16_000,
+    attempts: int = 2,
+    cache: Optional[LLMCache] = None,
+    use_rules: bool = True,
+    structured: bool = True,
+    max_story_tokens: Optional[int] = STORY_TOKEN_BUDGET,
+) -> Dict[str, Dict[str, VALUE_TYPES]]:
+    """
+    Like `llm_fill_values`, but packs the data of many stories into each request, so the fixed cost of a round trip
+    and of the instructions is shared between them.
+
+    The model answers with a JSON object keyed by story ID. Stories whose answer is missing or malformed are split
+    off and retried in smaller batches, down to a single story, which is asked on its own. With a cascade of models,
+    the keys every model left unresolved are batched again for the next one.
+
+    :param stories: Dictionary mapping story IDs (e.g. the RoyalRoad fiction ID) to data with missing values (None).
+    :param model: Optional model, or cascade of models, to ask (see `llm_fill_values`).
+    :param batch_size: Optional integer specifying the maximum number of stories in a single request.
+    :param max_prompt_tokens: Optional integer specifying the (estimated) token budget of a single prompt. Set it
+        according to the context window of the model.
+    :param attempts: Optional integer specifying the number of attempts made for a story that is retried on its own.
+    :param cache: Optional cache of previous responses, shared with `llm_fill_values`.
+    :param use_rules: Optional boolean specifying whether to first fill in the values the rules can infer (see
+        `llm_fill_values`).
+    :param structured: Optional boolean specifying whether to constrain the response to a JSON schema of the stories
+        and their missing keys, where the provider supports it.
+    :param max_story_tokens: Optional token budget of each story's data in the prompt (see `llm_fill_values`).
+    :return: Dictionary mapping each story ID to its updated data. The values of a story that no model answered with
+        any JSON are left None (and not cached), rather than failing the whole batch.
+    """
+    models = resolve_models(model)
+    label = "+".join(models)
+    results, pending, prompt_datas = {}, {}, {}
+    for story_id, data in stories.items():
+        story_id = str(story_id)  # JSON object keys are always strings
+        data = _fill_with_rules(data, use_rules)
+        prompt_data = budget_prompt_data(data, max_story_tokens) if max_story_tokens else data
+        cached_values = None
+        if None in data.values() and cache is not None:
+            cached_values = cache.get(LLMCache.make_key(prompt_data, label, PROMPT_VERSION))
+        if None not in data.values():
+            results[story_id] = data
+        elif cached_values is not None:
+            results[story_id] = {**data, **cached_values}
+        else:
+            pending[story_id], prompt_datas[story_id] = data, prompt_data
+    if not pending:
+        return results
+
+    def fill_batch(
+        batch: Dict[str, Dict[str, VALUE_TYPES]],
+        tier_model: str,
+        last: bool,
+        answers: Dict[str, Dict[str, VALUE_TYPES]],
+    ) -> None:
+        if len(batch) == 1:
+            ((story_id, data),) = batch.items()
+            try:
+                answers[story_id] = _ask_model(tier_model, data, attempts, structured, last)
+            except ValueError as e:  # only this story failed - the rest of the batch keeps its answers
+                METRICS.event("enrich_failed", level="error", story_id=story_id, model=tier_model, error=str(e))
+                answers[story_id] = dict.fromkeys(k for k, v in data.items() if v is None)
+                failed_stories.add(story_id)
+            return
+        schema = None
+        if structured:
+            schema = {
+                "type": "object",
+                "properties": {
+                    story_id: response_schema([k for k, v in data.items() if v is None])
+                    for story_id, data in batch.items()
+                },
+                "required": list(batch),
+                "additionalProperties": False,
+            }
+        with METRICS.span("llm_batch_request"):
+            response = _chat_json(tier_model, _batch_prompt(batch), BATCH_OUTPUT_TOKENS_PER_STORY * len(batch), schema)
+        response_text = (response.choices[0].message.content or "").strip()
+        try:
+            with METRICS.span("json_parse"):
+                batch_values = parse_json_tolerant(response_text)
+        except ValueError:
+            METRICS.event("invalid_llm_batch_json", stories=len(batch), model=tier_model)
+            batch_values = {}
+        if not isinstance(batch_values, dict):
+            batch_values = {}
+
+        failed = {}
+        for story_id, data in batch.items():
+            values = batch_values.get(story_id)
+            missing = [k for k, v in data.items() if v is None]
+            if not isinstance(values, dict) or any(key not in values for key in missing):
+                failed[story_id] = data
+                continue
+            answers[story_id] = coerce_values(values, missing)
+        if failed:  # retry only the stories that failed, in two halves
+            failed_ids = list(failed)
+            half = (len(failed_ids) + 1) // 2
+            for part in (failed_ids[:half], failed_ids[half:]):
+                if part:
+                    fill_batch({story_id: failed[story_id] for story_id in part}, tier_model, last, answers)
+
+    failed_stories: Set[str] = set()  # stories with no JSON answer at all, which are not cached
+    resolved: Dict[str, Dict[str, VALUE_TYPES]] = {story_id: {} for story_id in pending}
+    unresolved = {story_id: [k for k, v in data.items() if v is None] for story_id, data in pending.items()}
+    for tier, tier_model in enumerate(models):
+        last = tier == len(models) - 1
+        asked = {  # as in `llm_fill_values`, without the keys resolved by earlier models
+            story_id: {k: v for k, v in prompt_datas[story_id].items() if v is not None or k in keys}
+            for story_id, keys in unresolved.items()
+            if keys
+        }
+        if not asked:
+            break
+        answers: Dict[str, Dict[str, VALUE_TYPES]] = {}
+        for batch in _pack_batches(asked, batch_size, max_prompt_tokens):
+            fill_batch(batch, tier_model, last, answers)
+        for story_id in asked:
+            resolved[story_id].update({k: v for k, v in answers[story_id].items() if v is not None})
+            unresolved[story_id] = _escalate(tier_model, unresolved[story_id], answers[story_id], last)
+
+    for story_id, data in pending.items():
+        missing = [k for k, v in data.items() if v is None]
+        res = copy.deepcopy(data)
+        res.update({key: resolved[story_id].get(key) for key in missing})
+        results[story_id] = res
+        if cache is not None and story_id not in failed_stories:
+            cache_key = LLMCache.make_key(prompt_datas[story_id], label, PROMPT_VERSION)
+            cache.put(cache_key, label, {key: res[key] for key in missing})
+    return {str(story_id): results[str(story_id)] for story_id in stories}
+
+
+class ScrapeResult(NamedTuple):
+    """The outcome of scraping a single URL as part of a batch. Exactly one of `data` and `error` is set."""
+
+    url: str
+    data: Optional[Dict[str, VALUE_TYPES]]
+    error: Optional[Exception]
+
+
+def make_session(pool_size: int = 10) -> requests.Session:
+    """
+    Creates a `requests.Session` whose connection pool can keep `pool_size` connections per host alive, so that
+    consecutive requests to RoyalRoad reuse TCP/TLS connections instead of opening a new one every time.
+
+    Args:
+        pool_size (int): The number of connections to keep alive per host.
+
+    Returns:
+        requests.Session: The pooled session. It is safe to share between threads for plain GET requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_page(
+    url: str,
+    session: Optional[requests.Session] = None,
+    cache: Optional[HttpCache] = None,
+    scheduler: Optional[PolitenessScheduler] = None,
+) -> bytes:
+    """
+    Downloads a page and returns its raw content.
+
+    Args:
+        url (str): The URL of the page.
+        session (Optional[requests.Session]): A session to reuse pooled connections from. If not given, a one-off
+            request is made.
+        cache (Optional[HttpCache]): An on-disk cache to serve and revalidate the page from.
+        scheduler (Optional[PolitenessScheduler]): A scheduler to make the request through, which keeps within the
+            host's concurrency limit and requeues the request while the host throttles it.
+
+    Returns:
+        bytes: The response body.
+
+    Raises:
+        politeness.ThrottledError: If the server throttles the request, or answers with a challenge page (after the
+            scheduler's requeues, if there is one).
+        requests.HTTPError: If the server responds with an error status code.
+    """
+    if scheduler is not None:
+        return scheduler.run(url, lambda: fetch_page(url, session, cache))
+    with METRICS.span("fetch"):
+        if cache is not None:
+            content = cache.fetch(url, session)
         else:
-            res[key] = tentative_values[key]
+            response = (session or requests).get(url, timeout=REQUEST_TIMEOUT)
+            METRICS.observe("fetch_headers", response.elapsed.total_seconds())  # connect, TLS and server time
+            check_response(response)
+            response.raise_for_status()
+            content = response.content
+    METRICS.inc("bytes_fetched", len(content))
+    return content
+
+
+def parse_page(
+    content: bytes,
+    url: str,
+    parser: str = "lxml",
+    chapters: Optional[List[Chapter]] = None,
+    with_chapters: bool = False,
+) -> Dict[str, VALUE_TYPES]:
+    """
+    Extracts the raw (not yet normalized) story data from the content of a RoyalRoad story page, and on request the
+    release cadence (`CHAPTER_COLUMNS`) from its chapter table. The values of `GENERAL_COLUMNS` are left as None, to
+    be filled in by `enrich_data`.
+
+    Args:
+        content (bytes): The HTML content of the story page.
+        url (str): The URL the content was fetched from.
+        parser (str): The extractor to use, one of `extract.EXTRACTORS`. If the fast "lxml" extractor fails on the
+            page, the BeautifulSoup extractor is tried before giving up.
+        chapters (Optional[List[Chapter]]): If given, the chapter table is parsed and its chapters are added to it,
+            so they can be passed on to `record_chapters` without parsing the table again.
+        with_chapters (bool): Whether to parse the chapter table for the `CHAPTER_COLUMNS` (implied by `chapters`).
+            They are left as None otherwise - the table is most of a long page, and parsing it takes several times
+            as long as extracting everything else.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: The extracted data, keyed by column name.
+    """
+    with METRICS.span("parse"):
+        try:
+            data = EXTRACTORS[parser](content, url)
+        except Exception as e:
+            if parser == "bs4":
+                raise
+            METRICS.event("parser_fallback", parser=parser, url=url, error=repr(e))
+            data = extract_bs4(content, url)
+    if chapters is None and not with_chapters:
+        data.update(dict.fromkeys(CHAPTER_COLUMNS))
+        return data
+    with METRICS.span("chapters"):
+        if chapters is None:
+            data.update(summarize(iter_chapters(content)))
+        else:
+            walked = list(iter_chapters(content))
+            chapters.extend(walked)
+            data.update(summarize(walked))
+    return data
+
+
+def record_chapters(
+    content: bytes, url: str, snapshots: SnapshotStore, chapters: Optional[List[Chapter]] = None
+) -> int:
+    """
+    Adds the chapters of a story page that were released since the last recorded one to the snapshot store's chapter
+    timeline (see `SnapshotStore.record_chapters`).
+
+    Args:
+        content (bytes): The HTML content of the story page.
+        url (str): The URL the content was fetched from.
+        snapshots (SnapshotStore): The store to add the chapters to.
+        chapters (Optional[List[Chapter]]): The chapters of the page if they were already parsed (see `parse_page`).
+            The chapter table is only parsed from `content` when they weren't.
+
+    Returns:
+        int: The number of new chapters.
+    """
+    story_id = fiction_id(url)
+    if story_id is None:
+        return 0
+    with METRICS.span("chapters"):
+        added = snapshots.record_chapters(story_id, iter_chapters(content) if chapters is None else chapters)
+    METRICS.inc("chapters_recorded", added)
+    return added
 
+
+def _relevant_data(data: Dict[str, VALUE_TYPES]) -> Dict[str, VALUE_TYPES]:
+    # the part of the scraped data the LLM gets to see, including the missing values it should fill in
+    return {
+        k: v
+        for k, v in data.items()
+        if k
+        in GENERAL_COLUMNS
+        + [
+            "RR Blurb",
+            "RR Tags",
+            "RR Warnings",
+            "RR Title",
+        ]
+    }
+
+
+def infer_data(
+    data: Dict[str, VALUE_TYPES], llm_cache: Optional[LLMCache] = None, snapshots: Optional[SnapshotStore] = None
+) -> Dict[str, VALUE_TYPES]:
+    """
+    Fills in the missing `GENERAL_COLUMNS` values of freshly parsed story data using an LLM.
+
+    With a snapshot store, the LLM is only asked about stories that are new or whose title, blurb, tags or warnings
+    changed since their last scrape; for the rest, the values inferred last time are carried forward. Every scrape is
+    recorded in the store.
+
+    Args:
+        data (Dict[str, VALUE_TYPES]): The data returned by `parse_page`.
+        llm_cache (Optional[LLMCache]): A cache of previous LLM responses to reuse for unchanged stories.
+        snapshots (Optional[SnapshotStore]): A store of previous scrapes to carry inferred values forward from.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: A new dictionary with the inferred data.
+
+    Raises:
+        ValueError: If the LLM response cannot be parsed.
+    """
+    story_id = fiction_id(data["RR URL"]) if snapshots is not None else None
+    previous = snapshots.previous(story_id) if story_id is not None else None
+    data_hash = content_hash(data) if story_id is not None else None
+    carried_forward = previous is not None and previous["content_hash"] == data_hash
+    if carried_forward:
+        res = {**data, **{k: v for k, v in previous["inferred"].items() if data.get(k) is None}}
+    else:
+        try:
+            with METRICS.span("enrich"):
+                inferred_data = llm_fill_values(_relevant_data(data), cache=llm_cache)
+        except ValueError as e:
+            METRICS.event("enrich_failed", level="error", url=data.get("RR URL"), error=str(e))
+            raise e
+        res = {**data, **inferred_data}
+    if story_id is not None:
+        snapshots.record(story_id, normalize_data(res), data_hash, carried_forward)
     return res
 
 
-def rr_scrape(url: str) -> Dict[str, VALUE_TYPES]:
+def normalize_data(data: Dict[str, VALUE_TYPES]) -> Dict[str, VALUE_TYPES]:
+    """Normalizes all values of the story data (scores to floats, counts to integers), see `normalize_vals`."""
+    with METRICS.span("normalize"):
+        return {k: normalize_vals(v) for k, v in data.items()}
+
+
+def enrich_data(
+    data: Dict[str, VALUE_TYPES], llm_cache: Optional[LLMCache] = None, snapshots: Optional[SnapshotStore] = None
+) -> Dict[str, VALUE_TYPES]:
+    """
+    Fills in the missing `GENERAL_COLUMNS` values of freshly parsed story data using an LLM, then normalizes all
+    values (scores to floats, counts to integers).
+
+    Args:
+        data (Dict[str, VALUE_TYPES]): The data returned by `parse_page`.
+        llm_cache (Optional[LLMCache]): A cache of previous LLM responses to reuse for unchanged stories.
+        snapshots (Optional[SnapshotStore]): A store of previous scrapes to carry inferred values forward from.
+
+    Returns:
+        Dict[str, VALUE_TYPES]: A new dictionary with the inferred and normalized data.
+
+    Raises:
+        ValueError: If the LLM response cannot be parsed, or a value cannot be normalized.
+    """
+    return normalize_data(infer_data(data, llm_cache, snapshots))
+
+
+def enrich_data_batch(
+    datas: List[Dict[str, VALUE_TYPES]], batch_size: int = 10, llm_cache: Optional[LLMCache] = None
+) -> List[Dict[str, VALUE_TYPES]]:
+    """
+    Like `enrich_data`, but for many stories at once, using batched LLM requests (see `llm_fill_values_batch`).
+
+    Args:
+        datas (List[Dict[str, VALUE_TYPES]]): The data returned by `parse_page` for each story.
+        batch_size (int): The maximum number of stories sent to the LLM in a single request.
+        llm_cache (Optional[LLMCache]): A cache of previous LLM responses to reuse for unchanged stories.
+
+    Returns:
+        List[Dict[str, VALUE_TYPES]]: The inferred and normalized data of each story, in the order of `datas`.
+    """
+    story_ids = [fiction_id(data["RR URL"]) or str(i) for i, data in enumerate(datas)]
+    id_counts = Counter(story_ids)  # the same fiction twice in one batch must not share a key
+    story_ids = [story_id if id_counts[story_id] == 1 else f"{story_id}-{i}" for i, story_id in enumerate(story_ids)]
+    inferred = llm_fill_values_batch(
+        {story_id: _relevant_data(data) for story_id, data in zip(story_ids, datas)},
+        batch_size=batch_size,
+        cache=llm_cache,
+    )
+    return [normalize_data({**data, **inferred[story_id]}) for story_id, data in zip(story_ids, datas)]
+
+
+def rr_scrape(
+    url: str,
+    session: Optional[requests.Session] = None,
+    cache: Optional[HttpCache] = None,
+    llm_cache: Optional[LLMCache] = None,
+    snapshots: Optional[SnapshotStore] = None,
+    scheduler: Optional[PolitenessScheduler] = None,
+    with_chapters: bool = False,
+) -> Dict[str, VALUE_TYPES]:
     """
     Scrapes a RoyalRoad story page and extracts relevant information.
 
@@ -94,6 +821,15 @@ def rr_scrape(url: str) -> Dict[str, VALUE_TYPES]:
 
     Args:
         url (str): The URL of the RoyalRoad story page to scrape.
+        session (Optional[requests.Session]): A session to reuse pooled connections from (see `make_session`).
+        cache (Optional[HttpCache]): An on-disk cache to serve and revalidate the page from.
+        llm_cache (Optional[LLMCache]): A cache of previous LLM responses to reuse if the story hasn't changed.
+        snapshots (Optional[SnapshotStore]): A store of previous scrapes. The scrape and the story's new chapters are
+            recorded in it, and the LLM is skipped if the story's content hasn't changed since the last one.
+        scheduler (Optional[PolitenessScheduler]): A scheduler to download through, which backs off while the host
+            throttles requests.
+        with_chapters (bool): Whether to fill in the `CHAPTER_COLUMNS` from the chapter table (see `parse_page`).
+            Always done with `snapshots`, which record the chapters anyway.
     Returns:
         Dict[str, Union[str, int, float]]: A dictionary containing the extracted data. The keys of the dictionary
         correspond to the column names in the final dataset, and the values are the extracted data.
@@ -101,70 +837,90 @@ def rr_scrape(url: str) -> Dict[str, VALUE_TYPES]:
     Raises:
         ValueError: If the value is a score or a count string but cannot be converted to a float or an integer.
     """
-    soup = BeautifulSoup(requests.get(url).content, "lxml")
-    data = {
-        "RR Retrieved at": dt.now().strftime("%Y-%m-%d"),
-        "RR URL": url,
-        "RR Title": soup.find("div", class_="row fic-header").find("h1").text.strip(),
-        "RR Author": soup.find("div", class_="row fic-header").find("a").text.strip(),
-        "RR Thumbnail URL": soup.find("img", class_="thumbnail inline-block").get("src").split("?")[0],
-        **{col: None for col in GENERAL_COLUMNS},
-    }
+    with METRICS.profile(url), METRICS.span("scrape"):
+        content = fetch_page(url, session, cache, scheduler)
+        chapters: Optional[List[Chapter]] = [] if with_chapters or snapshots is not None else None
+        data = parse_page(content, url, chapters=chapters)
+        if snapshots is not None:
+            record_chapters(content, url, snapshots, chapters)
+        return enrich_data(data, llm_cache, snapshots)
 
-    stats_container = soup.find("div", class_="stats-content")
-    if stats_container:
-        # Extract overall, style, story, grammar, and character scores
-        scores = stats_container.find_all("span", class_="star")
-        for score in scores:
-            title = "RR " + score.get("data-original-title")
-            value = score.get("data-content")
-            if title in RR_COLUMNS:
-                data[title] = value
-        # Extract other stats
-        stats_list = stats_container.find_all(
-            "li", class_="bold uppercase font-red-sunglo"
-        )  # TODO - find better way to do this so that it doesn't break
-        data["RR Total Views"] = stats_list[0].text.strip()
-        data["RR Average Views"] = stats_list[1].text.strip()
-        data["RR Followers"] = stats_list[2].text.strip()
-        data["RR Favorites"] = stats_list[3].text.strip()
-        data["RR Ratings"] = stats_list[4].text.strip()
-        data["RR Pages"] = stats_list[5].text.strip()
-    else:
-        print("Stats container not found")
 
-    info_container = soup.find("div", class_="fiction-info")
-    data["RR Tags"] = ", ".join(tag.text.strip() for tag in info_container.find("span", class_="tags").find_all("a"))
+def rr_scrape_many(
+    urls: Iterable[str],
+    max_concurrency: int = 8,
+    max_per_host: int = 4,
+    session: Optional[requests.Session] = None,
+    cache: Optional[HttpCache] = None,
+    llm_cache: Optional[LLMCache] = None,
+    snapshots: Optional[SnapshotStore] = None,
+    parse_pool: Optional["ParsePool"] = None,
+    scheduler: Optional[PolitenessScheduler] = None,
+    with_chapters: bool = False,
+) -> Iterator[ScrapeResult]:
+    """
+    Scrapes many RoyalRoad story pages concurrently, over a shared pool of keep-alive connections.
 
-    data["RR Warnings"] = ", ".join(
-        warning.text.strip() for warning in info_container.find("ul", class_="list-inline").find_all("li")
-    )
+    Each URL is fetched, parsed and enriched in its own worker, so the network and LLM round trips of different
+    stories overlap. At most `max_per_host` downloads run against the same host at once; parsing and enrichment
+    are not bound by that cap. A failing URL does not abort the batch - its exception is returned in its result.
 
-    data["RR Blurb"] = "\n".join(
-        row.text.strip().replace("\xa0", " ") for row in info_container.find("div", class_="description")
-    )
+    Args:
+        urls (Iterable[str]): The URLs of the story pages to scrape. Duplicates are scraped once.
+        max_concurrency (int): The number of URLs processed at the same time.
+        max_per_host (int): The maximum number of simultaneous downloads from a single host. Not used with a
+            `scheduler`, which adapts that number to the host instead.
+        session (Optional[requests.Session]): A session to use instead of creating a pooled one.
+        cache (Optional[HttpCache]): An on-disk cache to serve and revalidate the pages from.
+        llm_cache (Optional[LLMCache]): A cache of previous LLM responses to reuse for unchanged stories.
+        snapshots (Optional[SnapshotStore]): A store of previous scrapes to record into and carry inferred values
+            forward from.
+        parse_pool (Optional[ParsePool]): A pool of processes to parse the pages in (see `parse_pool.ParsePool`),
+            so that parsing isn't limited to one core. By default, pages are parsed in the worker threads.
+        scheduler (Optional[PolitenessScheduler]): A scheduler to download through (see `politeness`). It finds the
+            highest concurrency each host sustains, and requeues throttled URLs instead of failing them.
+        with_chapters (bool): Whether to fill in the `CHAPTER_COLUMNS` from the chapter tables (see `parse_page`).
+            Always done with `snapshots`.
 
-    try:
-        relevant_data = {
-            k: v
-            for k, v in data.items()
-            if k
-            in GENERAL_COLUMNS
-            + [
-                "RR Blurb",
-                "RR Tags",
-                "RR Warnings",
-                "RR Title",
-            ]
-        }
-        inferred_data = llm_fill_values(relevant_data)
-    except ValueError as e:
-        print(f"Error filling missing values: {e}")
-        raise e
-    data.update(inferred_data)
-    data = {k: normalize_vals(v) for k, v in data.items()}
+    Yields:
+        ScrapeResult: The result of each URL, in the order in which they finish.
+    """
+    urls = list(dict.fromkeys(urls))
+    session = session or make_session(pool_size=max(max_concurrency, max_per_host))
+    host_locks: Dict[str, threading.BoundedSemaphore] = {}
+    host_locks_guard = threading.Lock()
 
-    return data
+    def host_lock(url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with host_locks_guard:
+            if host not in host_locks:
+                host_locks[host] = threading.BoundedSemaphore(max_per_host)
+            return host_locks[host]
+
+    def scrape_one(url: str) -> Dict[str, VALUE_TYPES]:
+        with METRICS.profile(url), METRICS.span("scrape"):
+            if scheduler is not None:
+                content = fetch_page(url, session, cache, scheduler)
+            else:
+                with host_lock(url):
+                    content = fetch_page(url, session, cache)
+            chapters: Optional[List[Chapter]] = [] if with_chapters or snapshots is not None else None
+            if parse_pool is not None:
+                data = parse_pool.parse(url, content, chapters)
+            else:
+                data = parse_page(content, url, chapters=chapters)
+            if snapshots is not None:
+                record_chapters(content, url, snapshots, chapters)
+            return enrich_data(data, llm_cache, snapshots)
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        futures = {executor.submit(scrape_one, url): url for url in urls}
+        for future in as_completed(futures):
+            error = future.exception()  # one bad page must not take down the whole batch
+            yield ScrapeResult(futures[future], None if error else future.result(), error)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 def example_for_debug():
@@ -172,12 +928,14 @@ def example_for_debug():
         "https://www.royalroad.com/fiction/76259/ultimate-level-1",
         "https://www.royalroad.com/fiction/45048/hive-minds-give-good-hugs",
         "https://www.royalroad.com/fiction/36299/beneath-the-dragoneye-moons",
-        "https://www.royalroad.com/fiction/52854/an-unwavering-craftsman"
+        "https://www.royalroad.com/fiction/52854/an-unwavering-craftsman",
     ]
     rr_dicts = []
-    for url in urls:
-        curr_dict = rr_scrape(url)
-        rr_dicts.append(curr_dict)
+    for result in rr_scrape_many(urls):
+        if result.error is not None:
+            METRICS.event("scrape_failed", level="error", url=result.url, error=repr(result.error))
+            continue
+        rr_dicts.append(result.data)
     print("stop here")
 
 
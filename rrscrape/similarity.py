@@ -0,0 +1,412 @@
+"""
+A similarity index over scraped fictions, for "find fictions similar to X" queries.
+
+Every fiction is indexed twice:
+- by the words of its title and blurb, as a sparse TF-IDF vector of hashed terms (so there is no vocabulary to keep,
+  and new fictions never change the shape of anything);
+- by its tags and subgenre, as a bitset.
+
+The vectors are kept as postings per term in flat NumPy arrays, so a query scores every fiction at once. The blurb
+cosine similarity only walks the postings of the query's terms, and the tag Jaccard similarity is a popcount over the
+bitsets - a few milliseconds for tens of thousands of fictions.
+
+Fictions added later (e.g. as new scrapes arrive) are scored from a small in-memory delta until there are
+`MERGE_EVERY` of them, which are then merged into the postings. A saved index is a single file the arrays are
+memory-mapped from, so opening it costs next to nothing, however large it is:
+
+    index = SimilarityIndex.from_records(store.read(columns=INDEX_COLUMNS).to_dict("records"))
+    index.save("similarity.idx")
+    index = SimilarityIndex.load("similarity.idx")
+    index.add(new_records)
+    for hit in index.similar("76259", k=10):
+        print(hit.title, hit.score)
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import struct
+import zlib
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from consts import VALUE_TYPES
+from general_utils import fiction_id
+
+INDEX_COLUMNS = ["RR URL", "RR Title", "RR Blurb", "RR Tags", "Subgenre"]  # the columns the index is built from
+N_FEATURES = 2**18  # hashed term IDs - collisions between the words of a few thousand blurbs are rare
+TAG_WEIGHT = 0.35  # the share of the tag similarity in the score
+MERGE_EVERY = 1024  # added fictions kept in the in-memory delta before it is merged into the postings
+_MAGIC = b"RRSIMIDX\x01"
+_ALIGNMENT = 64
+_WORD = re.compile(r"[^\W\d_][^\W_]+")
+_STOPWORDS = frozenset(
+    "about after all also an and any are as at be been before but by can could did do does for from had has have he"
+    " her him his how if in into is it its just me more my no not now of on one only or our out over she so some such"
+    " than that the their them then there these they this those through to too up us was we were what when where"
+    " which while who will with would you your".split()
+)
+_TERM_IDS: Dict[str, int] = {}  # memoized hashes of the words seen so far
+_BYTE_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+class Similar(NamedTuple):
+    """A fiction similar to the queried one."""
+
+    fiction_id: str
+    title: str
+    score: float  # the combined similarity, between 0 and 1
+    blurb_similarity: float  # the cosine similarity of the TF-IDF vectors of the titles and blurbs
+    tag_similarity: float  # the Jaccard similarity of the tags and subgenres
+
+
+def _text(value: Any) -> str:
+    return value if isinstance(value, str) else ""  # None, NaN and pandas' NA alike
+
+
+def _terms(record: Dict[str, VALUE_TYPES]) -> Tuple[np.ndarray, np.ndarray]:
+    # the hashed term IDs of the title and blurb, and how often each occurs
+    counts: Dict[int, int] = {}
+    for word in _WORD.findall(f"{_text(record.get('RR Title'))}\n{_text(record.get('RR Blurb'))}".lower()):
+        if word in _STOPWORDS:
+            continue
+        term = _TERM_IDS.get(word)
+        if term is None:
+            term = _TERM_IDS.setdefault(word, zlib.crc32(word.encode("utf-8")) & (N_FEATURES - 1))
+        counts[term] = counts.get(term, 0) + 1
+    terms = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    order = np.argsort(terms)
+    return terms[order], np.fromiter(counts.values(), dtype=np.float32, count=len(counts))[order]
+
+
+def _tags(record: Dict[str, VALUE_TYPES]) -> Set[str]:
+    tags = {tag.strip().casefold() for tag in _text(record.get("RR Tags")).split(",") if tag.strip()}
+    subgenre = _text(record.get("Subgenre")).strip().casefold()
+    return tags | {f"subgenre: {subgenre}"} if subgenre else tags
+
+
+def _digest(record: Dict[str, VALUE_TYPES]) -> int:
+    content = json.dumps([_text(record.get(col)) for col in INDEX_COLUMNS[1:]], ensure_ascii=False)
+    return int.from_bytes(hashlib.blake2b(content.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _popcount(bits: np.ndarray) -> np.ndarray:
+    # the set bits along the last axis. np.bitwise_count is NumPy 2 only; 1.x counts the bits of each byte by lookup
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int32)
+    return _BYTE_POPCOUNT[np.ascontiguousarray(bits).view(np.uint8)].sum(axis=-1, dtype=np.int32)
+
+
+class SimilarityIndex:
+    """
+    Blurb TF-IDF and tag bitset similarity over fictions, keyed by RoyalRoad fiction ID. A fiction added again
+    replaces its earlier version.
+    """
+
+    def __init__(self):
+        self.source_version: Optional[int] = None  # of the records it was built from, e.g. `ResultsStore.version`
+        self.unsaved = 0  # fictions added or replaced since the index was loaded or last saved
+        self.ids: List[str] = []  # the fiction ID of every document, including replaced ones
+        self.titles: List[str] = []
+        self._rows: Dict[str, int] = {}  # fiction ID -> its current document
+        self._alive = bytearray()  # whether each document is the current version of its fiction
+        self._digests: List[int] = []  # of each document's indexed content, to skip unchanged re-adds
+        self._df = np.zeros(N_FEATURES, dtype=np.int32)  # the number of current documents with each term
+        self._tag_bits: Dict[str, int] = {}
+        # the merged documents: doc-major and term-major (postings) copies of the TF-IDF vectors, and the tag bitsets.
+        # These may be memory-mapped from a file, and are never written to - merging builds new ones.
+        self._doc_ptr = np.zeros(1, dtype=np.int64)
+        self._doc_terms = np.empty(0, dtype=np.int32)
+        self._doc_weights = np.empty(0, dtype=np.float32)
+        self._term_ptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        self._term_docs = np.empty(0, dtype=np.int32)
+        self._term_weights = np.empty(0, dtype=np.float32)
+        self._tags = np.zeros((0, 1), dtype=np.uint64)
+        # the documents added since the last merge
+        self._delta: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []  # (terms, weights, tag bitset)
+        self._delta_arrays: Optional[Tuple[np.ndarray, ...]] = None  # its postings and tag bitsets, see `_stack_delta`
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, VALUE_TYPES]]) -> "SimilarityIndex":
+        """Builds an index of scrape results with the `INDEX_COLUMNS` (later records of a fiction win)."""
+        index = cls()
+        index.add(records)
+        index.merge()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, story_id: str) -> bool:
+        return story_id in self._rows
+
+    def fictions(self) -> Dict[str, str]:
+        """Returns the title of every indexed fiction by fiction ID, the most recently added first."""
+        return {self.ids[doc]: self.titles[doc] for doc in sorted(self._rows.values(), reverse=True)}
+
+    @property
+    def _n_merged(self) -> int:
+        return len(self._doc_ptr) - 1
+
+    def _tag_bitset(self, tags: Set[str], grow: bool) -> np.ndarray:
+        if grow:
+            for tag in sorted(tags - self._tag_bits.keys()):
+                self._tag_bits[tag] = len(self._tag_bits)
+        bits = np.zeros(max(1, (len(self._tag_bits) + 63) // 64), dtype=np.uint64)
+        for tag in tags:
+            bit = self._tag_bits.get(tag)
+            if bit is not None:
+                bits[bit // 64] |= np.uint64(1 << (bit % 64))
+        return bits
+
+    def _weigh(self, terms: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        # sublinear TF times smoothed IDF, normalized to unit length
+        n_docs = max(1, len(self._rows))
+        idf = np.log((1 + n_docs) / (1 + self._df[terms].astype(np.float32))) + 1
+        weights = ((1 + np.log(counts)) * idf).astype(np.float32)
+        norm = float(np.linalg.norm(weights))
+        return weights / norm if norm else weights
+
+    def _vector(self, doc: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if doc < self._n_merged:
+            start, end = self._doc_ptr[doc], self._doc_ptr[doc + 1]
+            return self._doc_terms[start:end], self._doc_weights[start:end], self._tags[doc]
+        return self._delta[doc - self._n_merged]
+
+    def add(self, records: Iterable[Dict[str, VALUE_TYPES]]) -> int:
+        """
+        Adds scrape results with the `INDEX_COLUMNS` to the index. Fictions that are already indexed with the same
+        content are skipped; fictions whose content changed replace their earlier version. Of a fiction that appears
+        more than once in `records`, only the last record is added.
+
+        Returns:
+            int: The number of fictions added or replaced.
+        """
+        latest: Dict[str, Dict[str, VALUE_TYPES]] = {}
+        for record in records:  # only the last version of a fiction in the batch counts
+            story_id = fiction_id(_text(record.get("RR URL"))) or _text(record.get("RR URL"))
+            if story_id:
+                latest.pop(story_id, None)
+                latest[story_id] = record
+        new = []
+        for story_id, record in latest.items():
+            digest = _digest(record)
+            row = self._rows.get(story_id)
+            if row is not None and self._digests[row] == digest:
+                continue
+            if row is not None:  # the earlier version no longer counts
+                self._alive[row] = 0
+                self._df[self._vector(row)[0]] -= 1
+            terms, counts = _terms(record)
+            self._df[terms] += 1
+            self._rows[story_id] = len(self.ids)
+            self.ids.append(story_id)
+            self.titles.append(_text(record.get("RR Title")))
+            self._alive.append(1)
+            self._digests.append(digest)
+            new.append((terms, counts, _tags(record)))
+        for terms, counts, tags in new:  # weighed once the whole batch is counted in the document frequencies
+            self._delta.append((terms, self._weigh(terms, counts), self._tag_bitset(tags, grow=True)))
+        self._delta_arrays = None
+        if len(self._delta) >= MERGE_EVERY:
+            self.merge()
+        self.unsaved += len(new)
+        return len(new)
+
+    def merge(self) -> None:
+        """Merges the fictions added since the last merge into the postings, dropping replaced versions."""
+        if not self._delta:
+            return
+        n_merged = self._n_merged
+        lengths = np.diff(self._doc_ptr)
+        alive = np.frombuffer(bytes(self._alive[:n_merged]), dtype=np.uint8).astype(bool)
+        keep = np.repeat(alive, lengths)
+        docs = [np.repeat(np.arange(n_merged, dtype=np.int32), lengths)[keep]]
+        terms, weights = [self._doc_terms[keep]], [self._doc_weights[keep]]
+        for i, (delta_terms, delta_weights, _) in enumerate(self._delta):
+            if self._alive[n_merged + i]:
+                docs.append(np.full(len(delta_terms), n_merged + i, dtype=np.int32))
+                terms.append(delta_terms)
+                weights.append(delta_weights)
+        docs, terms, weights = np.concatenate(docs), np.concatenate(terms), np.concatenate(weights)
+        n_docs = len(self.ids)
+        self._doc_ptr = np.concatenate([[0], np.cumsum(np.bincount(docs, minlength=n_docs))]).astype(np.int64)
+        self._doc_terms, self._doc_weights = terms, weights  # still sorted by document
+        order = np.argsort(terms, kind="stable")  # stable, so every posting stays sorted by document
+        self._term_ptr = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=N_FEATURES))]).astype(np.int64)
+        self._term_docs, self._term_weights = docs[order], weights[order]
+        tags = np.zeros((n_docs, max(1, (len(self._tag_bits) + 63) // 64)), dtype=np.uint64)
+        tags[:n_merged, : self._tags.shape[1]] = self._tags
+        tags[n_merged:] = self._stack_delta()[3]
+        self._tags = tags
+        self._delta, self._delta_arrays = [], None
+
+    def _stack_delta(self) -> Tuple[np.ndarray, ...]:
+        # the (terms, docs, weights) postings of the delta, and its tag bitsets padded to the same width
+        if self._delta_arrays is None:
+            tags = np.zeros((len(self._delta), max(1, (len(self._tag_bits) + 63) // 64)), dtype=np.uint64)
+            for i, (_, _, bits) in enumerate(self._delta):
+                tags[i, : len(bits)] = bits
+            self._delta_arrays = (
+                np.concatenate([terms for terms, _, _ in self._delta]),
+                np.concatenate(
+                    [
+                        np.full(len(terms), self._n_merged + i, dtype=np.int32)
+                        for i, (terms, _, _) in enumerate(self._delta)
+                    ]
+                ),
+                np.concatenate([weights for _, weights, _ in self._delta]),
+                tags,
+            )
+        return self._delta_arrays
+
+    def _blurb_scores(self, terms: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        starts, ends = self._term_ptr[terms], self._term_ptr[terms + 1]
+        for start, end, weight in zip(starts.tolist(), ends.tolist(), weights.tolist()):
+            if start < end:  # a document has a term at most once, so its postings can be added at once
+                scores[self._term_docs[start:end]] += weight * self._term_weights[start:end]
+        if self._delta:
+            delta_terms, delta_docs, delta_weights, _ = self._stack_delta()
+            positions = np.searchsorted(terms, delta_terms).clip(max=len(terms) - 1) if len(terms) else None
+            if positions is not None:
+                shared = terms[positions] == delta_terms
+                np.add.at(scores, delta_docs[shared], weights[positions[shared]] * delta_weights[shared])
+        return scores
+
+    def _tag_scores(self, bits: np.ndarray) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        n_query = int(_popcount(bits))
+        if not n_query:
+            return scores
+        matrices = [(0, self._tags), (self._n_merged, self._stack_delta()[3])] if self._delta else [(0, self._tags)]
+        for first, matrix in matrices:
+            if not len(matrix):
+                continue
+            words = min(matrix.shape[1], len(bits))
+            common = _popcount(matrix[:, :words] & bits[:words])
+            union = _popcount(matrix) + n_query - common
+            scores[first : first + len(matrix)] = np.where(union > 0, common / np.maximum(union, 1), 0)
+        return scores
+
+    def _top(
+        self, terms: np.ndarray, weights: np.ndarray, bits: np.ndarray, k: int, exclude: Optional[int]
+    ) -> List[Similar]:
+        blurb = self._blurb_scores(terms, weights)
+        tags = self._tag_scores(bits)
+        scores = (1 - TAG_WEIGHT) * blurb + TAG_WEIGHT * tags
+        scores[np.frombuffer(bytes(self._alive), dtype=np.uint8) == 0] = -1
+        if exclude is not None:
+            scores[exclude] = -1
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            Similar(self.ids[doc], self.titles[doc], float(scores[doc]), float(blurb[doc]), float(tags[doc]))
+            for doc in top.tolist()
+            if scores[doc] > 0
+        ]
+
+    def similar(self, story_id: str, k: int = 10) -> List[Similar]:
+        """
+        Finds the fictions most similar to an indexed one.
+
+        Args:
+            story_id (str): The RoyalRoad fiction ID.
+            k (int): The maximum number of fictions to return.
+
+        Returns:
+            List[Similar]: The most similar fictions, most similar first. Fictions with nothing in common are left out.
+
+        Raises:
+            KeyError: If the fiction is not in the index.
+        """
+        doc = self._rows[story_id]
+        terms, weights, bits = self._vector(doc)
+        return self._top(np.asarray(terms), np.asarray(weights), np.asarray(bits), k, doc)
+
+    def similar_to(self, record: Dict[str, VALUE_TYPES], k: int = 10) -> List[Similar]:
+        """Like `similar`, for a fiction given by its scrape result, which needn't be in the index."""
+        terms, counts = _terms(record)
+        doc = self._rows.get(fiction_id(_text(record.get("RR URL"))) or "")
+        return self._top(terms, self._weigh(terms, counts), self._tag_bitset(_tags(record), grow=False), k, doc)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the index to a single file (merging first), replacing it atomically. The arrays are stored raw and
+        aligned, so that `load` can memory-map them. Saving merges and rewrites everything, so callers adding fictions
+        as they arrive should save every so often (e.g. once `unsaved` reaches `MERGE_EVERY`) rather than every time.
+        """
+        self.merge()
+        arrays = {
+            "df": self._df,
+            "alive": np.frombuffer(bytes(self._alive), dtype=np.uint8),
+            "digests": np.array(self._digests, dtype=np.uint64),
+            "doc_ptr": self._doc_ptr,
+            "doc_terms": self._doc_terms,
+            "doc_weights": self._doc_weights,
+            "term_ptr": self._term_ptr,
+            "term_docs": self._term_docs,
+            "term_weights": self._term_weights,
+            "tags": self._tags,
+        }
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            layout[name] = [array.dtype.str, list(array.shape), offset]
+            offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        header = json.dumps(
+            {
+                "arrays": layout,
+                "version": self.source_version,
+                "ids": self.ids,
+                "titles": self.titles,
+                "tag_bits": self._tag_bits,
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        data_start = -(-(len(_MAGIC) + 8 + len(header)) // _ALIGNMENT) * _ALIGNMENT
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC + struct.pack("<Q", len(header)) + header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name][2])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+        self.unsaved = 0
+
+    @classmethod
+    def load(cls, path: str) -> "SimilarityIndex":
+        """Opens an index written by `save`, memory-mapping its postings and bitsets rather than reading them."""
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a similarity index")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_length))
+        data_start = -(-(len(_MAGIC) + 8 + header_length) // _ALIGNMENT) * _ALIGNMENT
+        arrays = {}
+        for name, (dtype, shape, offset) in header["arrays"].items():
+            if math.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=data_start + offset, shape=tuple(shape))
+        index = cls()
+        index.source_version = header["version"]
+        index.ids, index.titles, index._tag_bits = header["ids"], header["titles"], header["tag_bits"]
+        index._alive = bytearray(arrays["alive"])
+        index._digests = arrays["digests"].tolist()
+        index._rows = {story_id: doc for doc, story_id in enumerate(index.ids) if index._alive[doc]}
+        index._df = np.array(arrays["df"])  # updated by `add`, so not mapped
+        index._doc_ptr, index._doc_terms, index._doc_weights = (
+            arrays["doc_ptr"],
+            arrays["doc_terms"],
+            arrays["doc_weights"],
+        )
+        index._term_ptr, index._term_docs = arrays["term_ptr"], arrays["term_docs"]
+        index._term_weights, index._tags = arrays["term_weights"], arrays["tags"]
+        return index
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Iterable, List, Optional
+
+from chapters import Chapter
+from consts import GENERAL_COLUMNS, RR_STATS_COLUMNS, VALUE_TYPES
+
+CONTENT_COLUMNS = ["RR Title", "RR Blurb", "RR Tags", "RR Warnings"]  # what the LLM infers the GENERAL_COLUMNS from
+
+
+def content_hash(data: Dict[str, VALUE_TYPES]) -> str:
+    """
+    Hashes the parts of the story data that `GENERAL_COLUMNS` are inferred from (see `CONTENT_COLUMNS`).
+    Whitespace differences are ignored, so that a re-scrape of an unchanged page always hashes the same.
+    """
+    content = [" ".join(str(data.get(col) or "").split()) for col in CONTENT_COLUMNS]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class SnapshotStore:
+    """
+    A SQLite store of every scrape of every fiction, keyed by RoyalRoad fiction ID.
+
+    Each scrape appends the fiction's stats (`RR_STATS_COLUMNS`) to a time series. The store also remembers the
+    latest inferred `GENERAL_COLUMNS` values of each fiction together with a hash of the content they were inferred
+    from, so that a re-scrape of an unchanged story can carry them forward instead of asking the LLM again
+    (see `scrape.infer_data`). It also keeps the chapter timeline of each fiction, adding only the chapters released
+    since the last one it has (see `record_chapters`). The store is safe to share between threads.
+
+    Example:
+        snapshots = SnapshotStore("rrscrape.sqlite3")
+        data = rr_scrape(url, snapshots=snapshots)
+        followers = [row["RR Followers"] for row in snapshots.history("76259")]
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The SQLite database file. Use ":memory:" for a store that lives only as long as the process.
+        """
+        self.carried_forward = 0  # scrapes that reused the previous inferred values
+        self.inferred = 0  # scrapes whose content was new or had changed
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS fictions (
+                fiction_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                inferred TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS stats (
+                fiction_id TEXT NOT NULL,
+                scraped_at REAL NOT NULL,
+                retrieved_at TEXT,
+                stats TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS stats_fiction_id ON stats (fiction_id, scraped_at)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chapters (
+                fiction_id TEXT NOT NULL,
+                chapter_id INTEGER NOT NULL,
+                title TEXT,
+                released_at INTEGER,
+                PRIMARY KEY (fiction_id, chapter_id)
+            )"""
+        )
+        self._conn.commit()
+
+    def previous(self, fiction_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the latest snapshot of a fiction: {"content_hash": ..., "inferred": {...}}, or None if it was never
+        scraped before.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, inferred FROM fictions WHERE fiction_id = ?", (fiction_id,)
+            ).fetchone()
+        return None if row is None else {"content_hash": row[0], "inferred": json.loads(row[1])}
+
+    def record(
+        self, fiction_id: str, data: Dict[str, VALUE_TYPES], data_hash: str, carried_forward: bool = False
+    ) -> None:
+        """
+        Appends a scrape of a fiction to its stats time series and makes it the fiction's latest snapshot.
+
+        Args:
+            fiction_id (str): The RoyalRoad fiction ID.
+            data (Dict[str, VALUE_TYPES]): The scraped data, after inference and normalization.
+            data_hash (str): The `content_hash` of the data.
+            carried_forward (bool): Whether the inferred values were carried forward from the previous snapshot.
+        """
+        now = time.time()
+        stats = {col: data.get(col) for col in RR_STATS_COLUMNS}
+        inferred = {col: data.get(col) for col in GENERAL_COLUMNS}
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO stats (fiction_id, scraped_at, retrieved_at, stats) VALUES (?, ?, ?, ?)",
+                (fiction_id, now, data.get("RR Retrieved at"), json.dumps(stats)),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fictions (fiction_id, content_hash, inferred, updated_at) VALUES (?, ?, ?, ?)",
+                (fiction_id, data_hash, json.dumps(inferred, ensure_ascii=False), now),
+            )
+            self._conn.commit()
+            if carried_forward:
+                self.carried_forward += 1
+            else:
+                self.inferred += 1
+
+    def history(self, fiction_id: str) -> List[Dict[str, VALUE_TYPES]]:
+        """
+        Returns the stats time series of a fiction, oldest scrape first. Every row holds `RR_STATS_COLUMNS`, the
+        "RR Retrieved at" date and the exact "Scraped at" unix timestamp.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT scraped_at, retrieved_at, stats FROM stats WHERE fiction_id = ? ORDER BY scraped_at",
+                (fiction_id,),
+            ).fetchall()
+        return [{"Scraped at": row[0], "RR Retrieved at": row[1], **json.loads(row[2])} for row in rows]
+
+    def last_chapter(self, fiction_id: str) -> Optional[Chapter]:
+        """Returns the latest chapter stored for a fiction, or None if none are."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chapter_id, title, released_at FROM chapters WHERE fiction_id = ? "
+                "ORDER BY COALESCE(released_at, 0) DESC, chapter_id DESC LIMIT 1",
+                (fiction_id,),
+            ).fetchone()
+        return None if row is None else Chapter(*row)
+
+    def record_chapters(self, fiction_id: str, chapters: Iterable[Chapter]) -> int:
+        """
+        Adds the chapters of a fiction that are newer (by release time, then ID) than the latest one stored, so a
+        re-scrape only writes the chapters released since the last one.
+
+        Args:
+            fiction_id (str): The RoyalRoad fiction ID.
+            chapters (Iterable[Chapter]): The chapters of the fiction, e.g. from `chapters.iter_chapters`.
+
+        Returns:
+            int: The number of chapters added.
+        """
+        last = self.last_chapter(fiction_id)
+        newer = [
+            (fiction_id, chapter.id, chapter.title, chapter.ts)
+            for chapter in chapters
+            if last is None or (chapter.ts or 0, chapter.id) > (last.ts or 0, last.id)
+        ]
+        if not newer:
+            return 0
+        with self._lock:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO chapters (fiction_id, chapter_id, title, released_at) VALUES (?, ?, ?, ?)",
+                newer,
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def chapters(self, fiction_id: str) -> List[Chapter]:
+        """Returns the stored chapter timeline of a fiction, oldest release first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chapter_id, title, released_at FROM chapters WHERE fiction_id = ? "
+                "ORDER BY COALESCE(released_at, 0), chapter_id",
+                (fiction_id,),
+            ).fetchall()
+        return [Chapter(*row) for row in rows]
+
+    def fiction_ids(self) -> List[str]:
+        """Returns the IDs of all fictions in the store."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT fiction_id FROM fictions ORDER BY fiction_id")]
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
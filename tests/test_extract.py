@@ -0,0 +1,22 @@
+import glob
+import os
+
+import pytest
+
+from bench.fixtures import FIXTURES_DIR
+from extract import EXTRACTORS, check_parity
+
+PAGES = sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html")))
+
+
+def test_fixture_pages_exist():
+    assert PAGES
+
+
+@pytest.mark.parametrize("path", PAGES, ids=os.path.basename)
+def test_extractors_match_bs4_on_fixture_pages(path):
+    with open(path, "rb") as f:
+        content = f.read()
+    url = f"https://www.royalroad.com/fiction/{os.path.basename(path)[: -len('.html')]}"
+    assert check_parity(content, url) == {}
+    assert len({tuple(extractor(content, url)) for extractor in EXTRACTORS.values()}) == 1  # the same key order
@@ -0,0 +1,17 @@
+from general_utils import parse_json_tolerant
+
+
+def test_parse_json_tolerant_leaves_out_cut_off_members():
+    assert parse_json_tolerant('{"MC Gender": "Male", "Subgenre": "LitRPG') == {"MC Gender": "Male"}
+    assert parse_json_tolerant('{"MC Gender": "Male", "Chapters": 12') == {"MC Gender": "Male"}
+    assert parse_json_tolerant('{"MC Gender": "Male", "Tags": ["Magic", "Sch') == {"MC Gender": "Male"}
+    assert parse_json_tolerant('{"MC Gender": "Male", "Subg') == {"MC Gender": "Male"}
+
+
+def test_parse_json_tolerant_keeps_complete_members():
+    assert parse_json_tolerant('Sure! {"a": "He said "hi"", "b": [1, 2], c: None,} Done.') == {
+        "a": 'He said "hi"',
+        "b": [1, 2],
+        "c": None,
+    }
+    assert parse_json_tolerant('{"a": "x", "b": true') == {"a": "x", "b": True}
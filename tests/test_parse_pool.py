@@ -0,0 +1,17 @@
+from bench.fixtures import fiction_url, fixture_ids, load_page
+from parse_pool import ParsePool
+from scrape import parse_page
+
+
+def test_pool_returns_parse_page_output_unchanged():
+    pages = [
+        (fiction_url(fiction_id, "https://www.royalroad.com"), load_page(fiction_id)) for fiction_id in fixture_ids()
+    ]
+    with ParsePool(workers=1) as pool:
+        for url, content in pages:
+            expected = parse_page(content, url)
+            data = pool.parse(url, content)
+            assert list(data.items()) == list(expected.items())  # the same keys, in the same order
+        for (url, content), (_, data, error) in zip(pages, pool.parse_many(pages)):
+            assert error is None
+            assert list(data.items()) == list(parse_page(content, url).items())
@@ -0,0 +1,16 @@
+from rules import apply_rules, infer_values
+
+MISSING = {"Steamy (18+/NSFW)": None, "MC Gender": None, "Subgenre": None, "Story Setting": None}
+
+
+def test_steamy_is_only_decided_on_a_warning():
+    data = {**MISSING, "RR Tags": "Fantasy", "RR Warnings": "", "RR Blurb": ""}
+    assert apply_rules(data)[0]["Steamy (18+/NSFW)"] is None
+    assert infer_values(data)["Steamy (18+/NSFW)"][0] == "No"  # still there, below the threshold
+    data["RR Warnings"] = "Profanity, Sexual Content"
+    assert apply_rules(data)[0]["Steamy (18+/NSFW)"] == "Yes"
+
+
+def test_subgenre_tags_pass_the_threshold():
+    data = {**MISSING, "RR Tags": "Reincarnation, Progression", "RR Warnings": "", "RR Blurb": ""}
+    assert apply_rules(data)[0]["Subgenre"] == "Progression Fantasy"
@@ -0,0 +1,14 @@
+from bench.fixtures import fiction_url, fixture_ids, load_page
+from consts import CHAPTER_COLUMNS
+from scrape import parse_page
+
+
+def test_chapter_columns_are_opt_in():
+    fiction_id = fixture_ids()[0]
+    url, content = fiction_url(fiction_id, "https://www.royalroad.com"), load_page(fiction_id)
+    assert all(parse_page(content, url)[col] is None for col in CHAPTER_COLUMNS)
+    data = parse_page(content, url, with_chapters=True)
+    assert data["RR Chapters"] == 90
+    chapters = []
+    assert parse_page(content, url, chapters=chapters) == data
+    assert len(chapters) == 90
@@ -0,0 +1,36 @@
+from similarity import SimilarityIndex
+
+
+def _record(story_id: int, blurb: str, tags: str = "Fantasy, Magic") -> dict:
+    return {
+        "RR URL": f"https://www.royalroad.com/fiction/{story_id}/story-{story_id}",
+        "RR Title": f"Story {story_id}",
+        "RR Blurb": blurb,
+        "RR Tags": tags,
+        "Subgenre": "LitRPG",
+    }
+
+
+def test_add_repeated_id_with_changed_content_in_one_batch():
+    index = SimilarityIndex()
+    added = index.add(
+        [
+            _record(1, "a dragon hoards gold in the mountains"),
+            _record(2, "a dragon guards the mountains"),
+            _record(1, "a wizard studies spells in a tower", tags="Magic, School"),
+        ]
+    )
+    assert added == 2
+    assert sorted(index.fictions()) == ["1", "2"]
+    # the last version of fiction 1 is the one indexed
+    assert index.add([_record(1, "a wizard studies spells in a tower", tags="Magic, School")]) == 0
+    assert index.add([_record(1, "a dragon hoards gold in the mountains")]) == 1
+
+
+def test_add_replaces_changed_fiction_across_batches():
+    index = SimilarityIndex()
+    index.add([_record(1, "a dragon hoards gold"), _record(2, "a dragon guards gold")])
+    assert index.add([_record(1, "a wizard studies spells")]) == 1
+    index.merge()
+    assert [similar.fiction_id for similar in index.similar("2", k=5)] == ["1"]
+    assert sorted(index.fictions()) == ["1", "2"]